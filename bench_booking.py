@@ -0,0 +1,289 @@
+"""Booking subsystem benchmark: latency percentiles and throughput at a given scale.
+
+Seeds synthetic masseurs, test patients (client_profiles.create_test_patient)
+and historical bookings into a fresh data directory, then drives the
+booking functions directly and the FastAPI booking routes through an
+in-process TestClient.
+
+Runs offline: Supabase and the Telegram Bot API are replaced by a local
+fake HTTP server (PostgREST-shaped empty answers, optional latency), so the
+Supabase code paths — availability check, queries, outbox mirroring — are
+exercised without a network. --no-supabase benchmarks the local-only mode.
+
+    python bench_booking.py --masseurs 20 --days 60 --bookings 20000 --iterations 300
+    python bench_booking.py --json > bench_output.txt
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+import statistics
+from datetime import date, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+# ─── Fake Supabase / Telegram ───
+
+class _FakeHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    requests = 0
+
+    def _reply(self, status: int, body: bytes = b"[]", extra: dict = None):
+        type(self).requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (extra or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _drain_body(self):
+        n = int(self.headers.get("Content-Length") or 0)
+        if n:
+            self.rfile.read(n)
+
+    def do_GET(self):
+        self._reply(200)
+
+    def do_HEAD(self):
+        self._reply(200, b"", {"Content-Range": "*/0"})
+
+    def do_POST(self):
+        self._drain_body()
+        if "/sendMessage" in self.path:  # Telegram Bot API
+            self._reply(200, b'{"ok": true, "result": {}}')
+        else:
+            self._reply(201)
+
+    def do_PATCH(self):
+        self._drain_body()
+        self._reply(204, b"")
+
+    do_DELETE = do_PATCH
+
+    def log_message(self, *args):
+        pass
+
+
+def start_fake_server(latency_ms: float) -> str:
+    _FakeHandler.latency = latency_ms / 1000
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _FakeHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+# ─── Seeding ───
+
+MASSEUR_BASE = 80000000
+
+
+def seed(n_masseurs: int, n_clients: int, n_bookings: int, days: int, rnd: random.Random) -> dict:
+    from core import booking_store, client_profiles
+    from core.masseur_diary import MASSEURS_PATH
+
+    masseurs = {}
+    for i in range(n_masseurs):
+        mid = MASSEUR_BASE + i
+        masseurs[str(mid)] = {
+            "chat_id": mid,
+            "name": rnd.choice(client_profiles._TEST_NAMES),
+            "specialties": rnd.sample(client_profiles._TEST_TECHNIQUES, 2),
+            "working_hours": {"start": rnd.choice(["08:00", "09:00", "10:00"]),
+                              "end": rnd.choice(["18:00", "19:00", "20:00"])},
+            "created_at": time.time(),
+        }
+    MASSEURS_PATH.write_text(json.dumps(masseurs, ensure_ascii=False), encoding="utf-8")
+
+    clients = [client_profiles.create_test_patient()["chat_id"] for _ in range(n_clients)]
+
+    # История: половина дней в прошлом, половина впереди; без пересечений у массажиста
+    taken, bookings = set(), []
+    today = date.today()
+    while len(bookings) < n_bookings:
+        mid = MASSEUR_BASE + rnd.randrange(n_masseurs)
+        d = (today + timedelta(days=rnd.randint(-days // 2, days - days // 2))).isoformat()
+        hour, minute = rnd.randint(10, 16), rnd.choice((0, 30))
+        if (mid, d, hour) in taken:
+            if len(taken) > n_masseurs * days * 7:
+                break
+            continue
+        taken.add((mid, d, hour))
+        bookings.append({
+            "id": len(bookings) + 1,
+            "client_chat_id": rnd.choice(clients),
+            "masseur_chat_id": mid,
+            "slot_date": d,
+            "start_time": f"{hour:02d}:{minute:02d}",
+            "duration_min": rnd.choice((30, 60)),
+            "service_name": rnd.choice(client_profiles._TEST_TECHNIQUES),
+            "status": rnd.choice(("confirmed", "confirmed", "cancelled", "pending")),
+            "created_at": f"{d}T08:00:00",
+        })
+    booking_store.replace_bookings(bookings)
+    return {"masseurs": [int(k) for k in masseurs], "clients": clients, "bookings": len(bookings)}
+
+
+# ─── Measurement ───
+
+def _pct(sorted_ms: list, p: float) -> float:
+    if not sorted_ms:
+        return 0.0
+    k = min(len(sorted_ms) - 1, max(0, int(round(p / 100 * len(sorted_ms) + 0.5)) - 1))
+    return sorted_ms[k]
+
+
+def measure(name: str, fn, iterations: int) -> dict:
+    lat = []
+    errors = 0
+    t0 = time.perf_counter()
+    for i in range(iterations):
+        s = time.perf_counter()
+        try:
+            fn(i)
+        except Exception as e:
+            errors += 1
+            if errors == 1:
+                print(f"  ! {name}: {e!r}", file=sys.stderr)
+        lat.append((time.perf_counter() - s) * 1000)
+    wall = time.perf_counter() - t0
+    lat.sort()
+    return {
+        "op": name, "n": iterations, "errors": errors,
+        "p50_ms": round(_pct(lat, 50), 3), "p95_ms": round(_pct(lat, 95), 3),
+        "p99_ms": round(_pct(lat, 99), 3), "mean_ms": round(statistics.fmean(lat), 3),
+        "ops_per_sec": round(iterations / wall, 1) if wall else 0.0,
+    }
+
+
+def run(args) -> dict:
+    rnd = random.Random(args.seed)
+    os.chdir(tempfile.mkdtemp(prefix="bench_booking_"))  # data/ создаётся здесь
+    sys.path.insert(0, ROOT)
+    os.environ["TELEGRAM_TOKEN"] = os.environ.get("TELEGRAM_TOKEN") or "1:bench"
+    if args.no_supabase:
+        os.environ["SUPABASE_URL"] = ""
+        os.environ["TELEGRAM_API_URL"] = start_fake_server(0)
+    else:
+        fake = start_fake_server(args.sb_latency)
+        os.environ["SUPABASE_URL"] = fake
+        os.environ["SUPABASE_SERVICE_KEY"] = "bench"
+        os.environ["TELEGRAM_API_URL"] = fake
+
+    t = time.perf_counter()
+    info = seed(args.masseurs, args.clients, args.bookings, args.days, rnd)
+    info["seed_sec"] = round(time.perf_counter() - t, 2)
+
+    from fastapi.testclient import TestClient
+    import main
+    from core import booking_manager as bm
+
+    masseurs = info["masseurs"]
+    today = date.today()
+    dates = [(today + timedelta(days=i)).isoformat() for i in range(args.days // 2)]
+    n = args.iterations
+    created = []
+
+    def pick():
+        return rnd.choice(masseurs), rnd.choice(dates)
+
+    def reserve(i):
+        mid, d = pick()
+        free = bm.get_free_slots(mid, d, duration=60)
+        if free:
+            s = rnd.choice(free)
+            r = bm.reserve_booking(90900000 + i, mid, d, s["start_time"], 60, "Бенчмарк")
+            if r["ok"]:
+                created.append(r["booking"]["id"])
+
+    def cancel(i):
+        if created:
+            bm.cancel_booking(created.pop(), "client")
+
+    results = [
+        measure("get_free_slots", lambda i: bm.get_free_slots(*pick()), n),
+        measure("get_booked_slots_for_month", lambda i: bm.get_booked_slots_for_month(
+            rnd.choice(masseurs), today.year, today.month), n),
+        measure("find_earliest_slots", lambda i: bm.find_earliest_slots(60, days=14, limit=5), n),
+        measure("get_workload", lambda i: bm.get_workload(rnd.choice(masseurs), weeks=4), n),
+        measure("free_slots+reserve_booking", reserve, n),
+        measure("cancel_booking", cancel, n),
+    ]
+
+    client = TestClient(main.app)
+    client.__enter__()  # один event loop на все запросы (как у uvicorn)
+    api_created = []
+
+    def api_book(i):
+        mid, d = pick()
+        slots = client.get("/api/massage/slots", params={"masseur_id": mid, "slot_date": d}).json()["slots"]
+        if slots:
+            # новый клиент → проходит анкетный фильтр только с первичным приёмом
+            r = client.post("/api/massage/book", json={
+                "client_chat_id": 90950000 + i, "masseur_chat_id": mid, "slot_date": d,
+                "start_time": rnd.choice(slots)["start_time"], "duration_min": 30,
+                "service_name": "Первичный приём (с консультацией)"}).json()
+            if r.get("ok"):
+                api_created.append(r["booking"]["id"])
+            elif r.get("error") and not r.get("reason"):
+                raise RuntimeError(r["error"])
+
+    results += [
+        measure("GET /api/massage/slots", lambda i: client.get(
+            "/api/massage/slots", params=dict(zip(("masseur_id", "slot_date"), pick()))), n),
+        measure("GET /api/massage/slots/month", lambda i: client.get("/api/massage/slots/month", params={
+            "masseur_id": rnd.choice(masseurs), "year": today.year, "month": today.month}), n),
+        measure("GET /api/massage/slots/earliest", lambda i: client.get(
+            "/api/massage/slots/earliest", params={"duration": 60, "days": 14}), n),
+        measure("GET /api/massage/workload", lambda i: client.get(
+            "/api/massage/workload", params={"masseur_id": rnd.choice(masseurs)}), n),
+        measure("GET slots + POST /api/massage/book", api_book, n),
+        measure("POST /api/massage/book/{id}/cancel", lambda i: api_created and client.post(
+            f"/api/massage/book/{api_created.pop()}/cancel", json={}), n),
+    ]
+    client.__exit__(None, None, None)
+    info["fake_requests"] = _FakeHandler.requests
+    return {"scale": vars(args), "setup": info, "results": results}
+
+
+def print_table(report: dict):
+    s = report["setup"]
+    print(f"Scale: {len(s['masseurs'])} masseurs, {len(s['clients'])} clients, "
+          f"{s['bookings']} bookings (seeded in {s['seed_sec']}s), "
+          f"{'local only' if report['scale']['no_supabase'] else 'fake Supabase'}")
+    head = f"{'operation':38} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'ops/s':>9} {'err':>4}"
+    print(head)
+    print("-" * len(head))
+    for r in report["results"]:
+        print(f"{r['op']:38} {r['p50_ms']:>9.3f} {r['p95_ms']:>9.3f} {r['p99_ms']:>9.3f} "
+              f"{r['ops_per_sec']:>9.1f} {r['errors']:>4}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    ap.add_argument("--masseurs", type=int, default=10)
+    ap.add_argument("--clients", type=int, default=50)
+    ap.add_argument("--bookings", type=int, default=5000)
+    ap.add_argument("--days", type=int, default=60, help="history + future horizon in days")
+    ap.add_argument("--iterations", type=int, default=200)
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--sb-latency", type=float, default=0.0, help="fake Supabase latency, ms")
+    ap.add_argument("--no-supabase", action="store_true", help="local store only")
+    ap.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = ap.parse_args()
+    import logging
+    logging.disable(logging.INFO)
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_table(report)
@@ -29,6 +29,53 @@ SUPABASE_URL = os.getenv("SUPABASE_URL", "")
 SUPABASE_ANON_KEY = os.getenv("SUPABASE_ANON_KEY", "")
 SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY", "")
 SUPABASE_ENABLED = bool(SUPABASE_URL and SUPABASE_SERVICE_KEY)
+SUPABASE_POOL_SIZE = int(os.getenv("SUPABASE_POOL_SIZE", 10))
+SUPABASE_CONNECT_TIMEOUT = float(os.getenv("SUPABASE_CONNECT_TIMEOUT", 5))
+SUPABASE_READ_TIMEOUT = float(os.getenv("SUPABASE_READ_TIMEOUT", 15))
+SUPABASE_RETRIES = int(os.getenv("SUPABASE_RETRIES", 2))
+SUPABASE_RETRY_BACKOFF = float(os.getenv("SUPABASE_RETRY_BACKOFF", 0.5))
+SUPABASE_MIGRATE_CHUNK = int(os.getenv("SUPABASE_MIGRATE_CHUNK", 500))
+SUPABASE_MIGRATE_WORKERS = int(os.getenv("SUPABASE_MIGRATE_WORKERS", 4))
+SUPABASE_OUTBOX_BATCH = int(os.getenv("SUPABASE_OUTBOX_BATCH", 100))
+SUPABASE_OUTBOX_MAX_ATTEMPTS = int(os.getenv("SUPABASE_OUTBOX_MAX_ATTEMPTS", 10))
+SUPABASE_COUNT_MODE = os.getenv("SUPABASE_COUNT_MODE", "exact")  # exact | estimated | planned
+SUPABASE_STATS_TTL = float(os.getenv("SUPABASE_STATS_TTL", 30))
+
+# Часовой пояс салона (IANA, напр. Europe/Moscow) — рабочие часы и записи в нём.
+# Пусто → время сервера. Массажист может задать свой "timezone" в masseurs.json.
+SALON_TZ = os.getenv("SALON_TZ", "")
+
+# Ночной прогрев кэша свободных слотов (веб-процесс): сколько дней вперёд и в котором часу
+AVAILABILITY_PRECOMPUTE_DAYS = int(os.getenv("AVAILABILITY_PRECOMPUTE_DAYS", 14))
+AVAILABILITY_PRECOMPUTE_HOUR = int(os.getenv("AVAILABILITY_PRECOMPUTE_HOUR", 3))
+
+# Консультация: сколько агентов (анкета, фото, видео) работают одновременно
+CONSULTATION_MAX_PARALLEL = int(os.getenv("CONSULTATION_MAX_PARALLEL", 4))
+
+# LLM-шлюз (core.llm_gateway): общий пул соединений к HF Router и таймауты, сек
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", 10))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", 10))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", 60))
+LLM_AUDIO_TIMEOUT = float(os.getenv("LLM_AUDIO_TIMEOUT", 120))
+
+# Кэш ответов LLM (core.llm_cache): память (записей) + data/llm_cache.db (МБ)
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") not in ("0", "false", "no")
+LLM_CACHE_MEMORY_ITEMS = int(os.getenv("LLM_CACHE_MEMORY_ITEMS", 512))
+LLM_CACHE_DISK_MB = float(os.getenv("LLM_CACHE_DISK_MB", 50))
+
+# Предохранитель провайдеров LLM (core.llm_health)
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", 3))            # неудач подряд → open
+LLM_BREAKER_ERROR_RATE = float(os.getenv("LLM_BREAKER_ERROR_RATE", 0.5))    # доля ошибок в окне → open
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", 30))         # сек до пробного вызова
+LLM_BREAKER_QUOTA_COOLDOWN = float(os.getenv("LLM_BREAKER_QUOTA_COOLDOWN", 300))  # после 429
+LLM_BREAKER_SLOW_SEC = float(os.getenv("LLM_BREAKER_SLOW_SEC", 20))         # медленнее — ниже в очереди
+
+# Хеджирование (core.llm_gateway.hedged): места вызова через запятую
+# ("specialist_chat,ritual"); пусто — выключено, обычный последовательный fallback
+LLM_HEDGE_SITES = {s.strip() for s in os.getenv("LLM_HEDGE_SITES", "").split(",") if s.strip()}
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", 90))   # бюджет = pXX задержки основного
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", 2))      # сек
+LLM_HEDGE_MAX_DELAY = float(os.getenv("LLM_HEDGE_MAX_DELAY", 15))     # сек, пока мало замеров
 
 # Mini App URL — Telegram требует HTTPS
 # На HF Spaces формируется автоматически, для локали — GitHub Pages или ngrok
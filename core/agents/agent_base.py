@@ -3,11 +3,10 @@ import os
 import base64
 import mimetypes
 from typing import Optional, List
-from google import genai
 from google.genai import types as genai_types
-import requests
 
-from config import GEMINI_KEY, HF_TOKEN, HF_TASKS, get_hf_system_prompt, get_vertical_name, FALLBACK_MODELS, IS_HF_SPACE
+from config import HF_TOKEN, get_hf_system_prompt, get_vertical_name, IS_HF_SPACE
+from core import llm_gateway
 
 logger = logging.getLogger(__name__)
 
@@ -32,6 +31,7 @@ class AgentBase:
     Стратегия (бесплатно для всех):
       1. HF Router (free, мультимодальный: Qwen7B / Llama Vision / Whisper)
       2. Gemini (если HF не ответил)
+    Оба провайдера — через core.llm_gateway (общий пул соединений и клиент).
     """
     def __init__(self, agent_id: str, name: str, role_prompt: str, model_type: str = "text", user_mode: str = "vertical"):
         self.agent_id = agent_id
@@ -40,7 +40,8 @@ class AgentBase:
         self.model_type = model_type
         self.user_mode = user_mode
         self.hf_token = HF_TOKEN.strip() if HF_TOKEN else None
-        self.gemini_client = genai.Client(api_key=GEMINI_KEY) if GEMINI_KEY else None
+        self.gemini_client = llm_gateway.gemini_client()  # общий на процесс
+        self.cache_site = None  # имя из llm_cache.TTLS — повторять одинаковые ответы из кэша
 
     def _system_prompt(self) -> str:
         platform = get_vertical_name() if self.user_mode == "vertical" else "AI Prophet"
@@ -57,23 +58,7 @@ class AgentBase:
     def _hf_text(self, prompt: str) -> Optional[str]:
         if not self.hf_token:
             return None
-        try:
-            resp = requests.post(
-                "https://router.huggingface.co/v1/chat/completions",
-                headers={"Authorization": f"Bearer {self.hf_token}", "Content-Type": "application/json"},
-                json={
-                    "model": HF_TASKS.get("text", "Qwen/Qwen2.5-7B-Instruct"),
-                    "messages": [{"role": "user", "content": f"{get_hf_system_prompt(self.user_mode)}\n\nЗапрос для {self.name}.\n\n{prompt}"}],
-                    "max_tokens": 4096,
-                },
-                timeout=60,
-            )
-            if resp.status_code == 200:
-                return resp.json()["choices"][0]["message"]["content"]
-            logger.warning(f"HF text {resp.status_code}: {resp.text[:100]}")
-        except Exception as e:
-            logger.warning(f"HF text error: {e}")
-        return None
+        return llm_gateway.hf_chat([{"role": "user", "content": f"{get_hf_system_prompt(self.user_mode)}\n\nЗапрос для {self.name}.\n\n{prompt}"}], cache=self.cache_site)
 
     def _hf_vision(self, text: str, image_path: str) -> Optional[str]:
         if not self.hf_token:
@@ -81,43 +66,20 @@ class AgentBase:
         try:
             with open(image_path, "rb") as f:
                 encoded = base64.b64encode(f.read()).decode("utf-8")
-            resp = requests.post(
-                "https://router.huggingface.co/v1/chat/completions",
-                headers={"Authorization": f"Bearer {self.hf_token}", "Content-Type": "application/json"},
-                json={
-                    "model": HF_TASKS.get("vision", "meta-llama/Llama-3.2-11B-Vision-Instruct"),
-                    "messages": [{"role": "user", "content": [
-                        {"type": "text", "text": f"{self._system_prompt()}\n\n{text}"},
-                        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{encoded}"}},
-                    ]}],
-                    "max_tokens": 4096,
-                },
-                timeout=60,
-            )
-            if resp.status_code == 200:
-                return resp.json()["choices"][0]["message"]["content"]
-            logger.warning(f"HF vision {resp.status_code}: {resp.text[:100]}")
-        except Exception as e:
+        except OSError as e:
             logger.warning(f"HF vision error: {e}")
-        return None
+            return None
+        return llm_gateway.hf_chat([{"role": "user", "content": [
+            {"type": "text", "text": f"{self._system_prompt()}\n\n{text}"},
+            {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{encoded}"}},
+        ]}], task="vision", cache=self.cache_site)
 
     # ────────────── Gemini (бекап) ──────────────
 
     def _gemini_text(self, prompt: str) -> Optional[str]:
         if not self.gemini_client:
             return None
-        for model in FALLBACK_MODELS[:2]:
-            try:
-                resp = self.gemini_client.models.generate_content(
-                    model=model,
-                    contents=prompt,
-                    config=genai_types.GenerateContentConfig(temperature=0.3, max_output_tokens=4096),
-                )
-                if resp and resp.text:
-                    return resp.text.strip()
-            except Exception as e:
-                logger.warning(f"Gemini {model}: {e}")
-        return None
+        return llm_gateway.gemini_generate(prompt, cache=self.cache_site)
 
     def _gemini_vision(self, text: str, image_path: str) -> Optional[str]:
         if not self.gemini_client:
@@ -126,47 +88,35 @@ class AgentBase:
         try:
             with open(image_path, "rb") as f:
                 img_bytes = f.read()
-            for model in FALLBACK_MODELS[:2]:
-                try:
-                    resp = self.gemini_client.models.generate_content(
-                        model=model,
-                        contents=[f"{self._system_prompt()}\n\n{text}",
-                                  genai_types.Part.from_bytes(data=img_bytes, mime_type=mime)],
-                        config=genai_types.GenerateContentConfig(temperature=0.3, max_output_tokens=4096),
-                    )
-                    if resp and resp.text:
-                        return resp.text.strip()
-                except Exception as e:
-                    logger.warning(f"Gemini vision {model}: {e}")
-        except Exception as e:
+        except OSError as e:
             logger.warning(f"Gemini vision error: {e}")
-        return None
+            return None
+        return llm_gateway.gemini_generate(
+            [f"{self._system_prompt()}\n\n{text}", genai_types.Part.from_bytes(data=img_bytes, mime_type=mime)],
+            label="Gemini vision", cache=self.cache_site)
 
     # ────────────── Публичные методы ──────────────
 
     def process_text(self, text: str) -> AgentResult:
-        """Обработка текста: HF → Gemini"""
+        """Обработка текста: HF → Gemini (порядок меняется по здоровью провайдеров)"""
         prompt = f"{self._system_prompt()}\n\n---\n\n{text}"
 
-        result = self._hf_text(prompt)
-        if result:
-            return AgentResult(self.agent_id, self.name, result.strip())
-
-        result = self._gemini_text(prompt)
-        if result:
-            return AgentResult(self.agent_id, self.name, result.strip())
+        for provider in llm_gateway.provider_order(("hf", "gemini")):
+            result = self._hf_text(prompt) if provider == "hf" else self._gemini_text(prompt)
+            if result:
+                return AgentResult(self.agent_id, self.name, result.strip())
 
         return AgentResult(self.agent_id, self.name, "", error="HF + Gemini failed")
 
     def process_vision(self, text: str, image_path: str) -> AgentResult:
-        """Обработка изображения: HF Vision → Gemini Vision"""
-        result = self._hf_vision(text, image_path)
-        if result:
-            return AgentResult(self.agent_id, self.name, result.strip())
-
-        result = self._gemini_vision(text, image_path)
-        if result:
-            return AgentResult(self.agent_id, self.name, result.strip())
+        """Обработка изображения: HF Vision → Gemini Vision (порядок — по здоровью)"""
+        for provider in llm_gateway.provider_order(("hf", "gemini"), task="vision"):
+            if provider == "hf":
+                result = self._hf_vision(text, image_path)
+            else:
+                result = self._gemini_vision(text, image_path)
+            if result:
+                return AgentResult(self.agent_id, self.name, result.strip())
 
         return AgentResult(self.agent_id, self.name, "", error="HF + Gemini vision failed")
 
@@ -5,12 +5,10 @@ import time
 import logging
 from dataclasses import dataclass, asdict
 from typing import Optional, List, Tuple
-from google import genai
-from google.genai import types as genai_types
-import requests
 
-from config import GEMINI_KEY, HF_TOKEN, HF_TASKS, FALLBACK_MODELS, get_vertical_name
+from config import HF_TOKEN, get_vertical_name
 from core.agents.agent_base import AgentResult, AgentBase
+from core import conversation_store, llm_gateway
 
 logger = logging.getLogger(__name__)
 
@@ -169,42 +167,25 @@ class SpecialistFactory:
     @classmethod
     def _ensure_clients(cls):
         if cls._gemini_client is None:
-            cls._gemini_client = genai.Client(api_key=GEMINI_KEY) if GEMINI_KEY else None
+            cls._gemini_client = llm_gateway.gemini_client()
         if cls._hf_token is None:
             cls._hf_token = HF_TOKEN.strip() if HF_TOKEN else None
 
     @classmethod
-    def _call_llm(cls, prompt: str, system: str = "") -> Optional[str]:
+    def _call_llm(cls, prompt: str, system: str = "", cache: str = None) -> Optional[str]:
         cls._ensure_clients()
-        if cls._gemini_client:
-            for model in FALLBACK_MODELS[:2]:
-                try:
-                    contents = f"{system}\n\n{prompt}" if system else prompt
-                    resp = cls._gemini_client.models.generate_content(
-                        model=model,
-                        contents=contents,
-                        config=genai_types.GenerateContentConfig(temperature=0.3, max_output_tokens=4096),
-                    )
-                    if resp and resp.text:
-                        return resp.text.strip()
-                except Exception as e:
-                    logger.warning(f"Gemini {model}: {e}")
-        if cls._hf_token:
-            msgs = []
-            if system:
-                msgs.append({"role": "system", "content": system})
-            msgs.append({"role": "user", "content": prompt})
-            try:
-                resp = requests.post(
-                    "https://router.huggingface.co/v1/chat/completions",
-                    headers={"Authorization": f"Bearer {cls._hf_token}", "Content-Type": "application/json"},
-                    json={"model": HF_TASKS.get("text", "Qwen/Qwen2.5-7B-Instruct"), "messages": msgs, "max_tokens": 4096},
-                    timeout=60,
-                )
-                if resp.status_code == 200:
-                    return resp.json()["choices"][0]["message"]["content"].strip()
-            except Exception as e:
-                logger.warning(f"HF: {e}")
+        # Gemini → HF, порядок меняется по здоровью провайдеров
+        for provider in llm_gateway.provider_order(("gemini", "hf")):
+            if provider == "gemini":
+                result = llm_gateway.gemini_generate(f"{system}\n\n{prompt}" if system else prompt, cache=cache)
+            else:
+                msgs = []
+                if system:
+                    msgs.append({"role": "system", "content": system})
+                msgs.append({"role": "user", "content": prompt})
+                result = llm_gateway.hf_chat(msgs, cache=cache)
+            if result:
+                return result.strip()
         return None
 
     @classmethod
@@ -330,7 +311,7 @@ class SpecialistFactory:
 
 Минимум 1 required, максимум 5 required + 5 optional. На русском языке."""
         try:
-            text = cls._call_llm(prompt, "Ты — конструктор анкет. Отвечай только JSON.")
+            text = cls._call_llm(prompt, "Ты — конструктор анкет. Отвечай только JSON.", cache="specialist_schema")
             if not text:
                 return default_schema
             start = text.find("{")
@@ -433,56 +414,28 @@ class SpecialistFactory:
             except Exception as e:
                 logger.warning(f"Specialist vision/video error: {e}")
 
-        # Gemini first — лучше следует system prompt
-        if cls._gemini_client:
-            for model in FALLBACK_MODELS[:2]:
-                try:
-                    ctx = specialist.system_prompt + memory_block
-                    for h in history[-10:]:
-                        ctx += f"{h['role']}: {h['content']}\n"
-                    ctx += f"user: {user_message}\n\n{specialist.name}:"
-                    resp = cls._gemini_client.models.generate_content(
-                        model=model,
-                        contents=ctx,
-                        config=genai_types.GenerateContentConfig(temperature=0.3, max_output_tokens=4096),
-                    )
-                    if resp and resp.text:
-                        specialist.message_count += 1
-                        specialist.client_memory = cls._merge_memory(specialist.client_memory, cls._extract_memory(user_message))
-                        _save_specialist(specialist)
-                        _save_conversation(chat_id, specialist.name, user_message, resp.text.strip())
-                        return AgentResult(f"s_{chat_id}", specialist.name, resp.text.strip())
-                    else:
-                        logger.warning(f"Gemini specialist chat {model}: empty response (safety filter?)")
-                except Exception as e:
-                    logger.warning(f"Gemini specialist chat {model}: {e}")
-
-        # HF fallback — обычно Qwen
-        if cls._hf_token:
-            try:
-                msgs = [{"role": "system", "content": specialist.system_prompt + memory_block}]
-                for h in history:
-                    msgs.append(h)
-                msgs.append({"role": "user", "content": user_message})
-                resp = requests.post(
-                    "https://router.huggingface.co/v1/chat/completions",
-                    headers={"Authorization": f"Bearer {cls._hf_token}", "Content-Type": "application/json"},
-                    json={
-                        "model": HF_TASKS.get("text", "Qwen/Qwen2.5-7B-Instruct"),
-                        "messages": msgs,
-                        "max_tokens": 4096,
-                    },
-                    timeout=60,
-                )
-                if resp.status_code == 200:
-                    content = resp.json()["choices"][0]["message"]["content"].strip()
-                    specialist.message_count += 1
-                    specialist.client_memory = cls._merge_memory(specialist.client_memory, cls._extract_memory(user_message))
-                    _save_specialist(specialist)
-                    _save_conversation(chat_id, specialist.name, user_message, content)
-                    return AgentResult(f"s_{chat_id}", specialist.name, content)
-            except Exception as e:
-                logger.warning(f"HF specialist chat: {e}")
+        # Gemini first — лучше следует system prompt; HF (обычно Qwen) — запасной.
+        # Упавший провайдер уходит в конец очереди (core.llm_health); при
+        # LLM_HEDGE_SITES=specialist_chat медленный основной догоняет запасной
+        ctx = specialist.system_prompt + memory_block
+        for h in history[-10:]:
+            ctx += f"{h['role']}: {h['content']}\n"
+        ctx += f"user: {user_message}\n\n{specialist.name}:"
+        msgs = [{"role": "system", "content": specialist.system_prompt + memory_block}]
+        for h in history:
+            msgs.append(h)
+        msgs.append({"role": "user", "content": user_message})
+        content, _ = llm_gateway.hedged("specialist_chat", [
+            llm_gateway.gemini_call(ctx, label="Gemini specialist chat"),
+            llm_gateway.hf_call(msgs),
+        ])
+        if content:
+            content = content.strip()
+            specialist.message_count += 1
+            specialist.client_memory = cls._merge_memory(specialist.client_memory, cls._extract_memory(user_message))
+            _save_specialist(specialist)
+            _save_conversation(chat_id, specialist.name, user_message, content)
+            return AgentResult(f"s_{chat_id}", specialist.name, content)
 
         return AgentResult(f"s_{chat_id}", specialist.name, "", error="All AI engines failed")
 
@@ -503,38 +456,12 @@ def _save_specialist(specialist: DynamicSpecialist):
     _write_specialists(data)
 
 
-CONVERSATIONS_FILE = os.path.join("temp", "specialist_convs.json")
-
 def _load_conversation(chat_id: int, specialist_name: str) -> list:
-    if not os.path.exists(CONVERSATIONS_FILE):
-        return []
-    try:
-        with open(CONVERSATIONS_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        key = f"{chat_id}_{specialist_name}"
-        return data.get(key, [])
-    except Exception:
-        return []
+    return conversation_store.load_tail(chat_id, specialist_name)
 
 def _save_conversation(chat_id: int, specialist_name: str, user_msg: str, bot_msg: str):
-    os.makedirs("temp", exist_ok=True)
-    data = {}
-    if os.path.exists(CONVERSATIONS_FILE):
-        try:
-            with open(CONVERSATIONS_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
-        except Exception:
-            pass
-    key = f"{chat_id}_{specialist_name}"
-    if key not in data:
-        data[key] = []
-    data[key].append({"role": "user", "content": user_msg})
-    data[key].append({"role": "assistant", "content": bot_msg})
-    if len(data[key]) > 20:
-        data[key] = data[key][-20:]
     try:
-        with open(CONVERSATIONS_FILE, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        conversation_store.append_turn(chat_id, specialist_name, user_msg, bot_msg)
     except Exception as e:
         logger.warning(f"Failed to save conversation: {e}")
 
@@ -593,19 +520,7 @@ def remove_specialist(chat_id: int, name: str) -> bool:
             lst.pop(i)
             _write_specialists(data)
             # Clean up conversation
-            conv = {}
-            if os.path.exists(CONVERSATIONS_FILE):
-                try:
-                    with open(CONVERSATIONS_FILE, "r", encoding="utf-8") as f:
-                        conv = json.load(f)
-                except Exception:
-                    pass
-            conv.pop(f"{chat_id}_{name}", None)
-            try:
-                with open(CONVERSATIONS_FILE, "w", encoding="utf-8") as f:
-                    json.dump(conv, f, ensure_ascii=False, indent=2)
-            except Exception:
-                pass
+            conversation_store.delete(chat_id, name)
             return True
     return False
 
@@ -626,23 +541,8 @@ def update_specialist(chat_id: int, old_name: str, new_name: str = "", new_role:
             if new_role:
                 s["role_description"] = new_role
             _write_specialists(data)
-            # Rename conversation key if name changed
+            # Rename conversation log if name changed
             if new_name and new_name.lower() != old_name.lower():
-                conv = {}
-                if os.path.exists(CONVERSATIONS_FILE):
-                    try:
-                        with open(CONVERSATIONS_FILE, "r", encoding="utf-8") as f:
-                            conv = json.load(f)
-                    except Exception:
-                        pass
-                old_key = f"{chat_id}_{old_name}"
-                new_key = f"{chat_id}_{new_name}"
-                if old_key in conv:
-                    conv[new_key] = conv.pop(old_key)
-                    try:
-                        with open(CONVERSATIONS_FILE, "w", encoding="utf-8") as f:
-                            json.dump(conv, f, ensure_ascii=False, indent=2)
-                    except Exception:
-                        pass
+                conversation_store.rename(chat_id, old_name, new_name)
             return True
     return False
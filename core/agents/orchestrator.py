@@ -1,6 +1,7 @@
 import logging
 import asyncio
 import os
+import time
 from typing import List, Optional, Dict, Any
 
 from core.agents.agent_base import AgentBase
@@ -11,18 +12,24 @@ logger = logging.getLogger(__name__)
 
 class MassageConsultationOrchestrator:
     """
-    Запускает полный пайплайн консультации:
-      1. Анкетолог    — анализ анкеты (текст)
-      2. Виз.Диагност — анализ фото (vision)
-      3. Движения     — анализ видео (извлечение кадров)
-      4. Техники      — рекомендации техник (текст)
-      5. Финальный    — синтез всех данных (текст)
+    Запускает полный пайплайн консультации как граф зависимостей:
+      1. Анкетолог    — анализ анкеты (текст)          ┐
+      2. Виз.Диагност — анализ каждого фото (vision)    ├ параллельно
+      3. Движения     — анализ каждого видео (кадры)    ┘
+      4. Техники      — рекомендации техник (ждёт 1–3)
+      5. Финальный    — синтез всех данных (ждёт 1–4)
+    Одновременно работает не больше CONSULTATION_MAX_PARALLEL агентов.
     """
-    def __init__(self, user_mode: str = "vertical"):
+    def __init__(self, user_mode: str = "vertical", max_parallel: int = None):
+        from config import CONSULTATION_MAX_PARALLEL
         self.user_mode = user_mode
+        self.max_parallel = max(1, max_parallel or CONSULTATION_MAX_PARALLEL)
         self.specialists = get_all_agents(user_mode=user_mode)
         defn = get_agent_def("final_expert")
         self.final = AgentBase(defn["id"], defn["name"], defn["role"], defn.get("model_type", "text"), user_mode=user_mode)
+        # Повторный запуск на той же анкете/фото не переспрашивает уже ответивших агентов
+        for agent in (*self.specialists, self.final):
+            agent.cache_site = "consultation"
 
     async def run_consultation(
         self,
@@ -30,42 +37,75 @@ class MassageConsultationOrchestrator:
         photo_paths: Optional[List[str]] = None,
         video_paths: Optional[List[str]] = None,
     ) -> Dict[str, Any]:
+        """Results per agent plus "timings" (seconds per stage, total and sum of stages)."""
         results = {}
+        # узел → (зависимости, функция для потока, куда положить результат)
+        nodes = {}
 
-        # 1. Анкетолог
-        logger.info("Агент: Анкетолог")
         qa = self._find("questionnaire_analyst")
         if qa:
-            results["questionnaire_analyst"] = (await asyncio.to_thread(qa.process_text, questionnaire_text)).to_dict()
-
-        # 2. Визуальный Диагност (по всем фото)
+            nodes["questionnaire_analyst"] = ((), lambda: qa.process_text(questionnaire_text),
+                                              ("questionnaire_analyst", None))
         diag = self._find("visual_diagnostician")
         if diag and photo_paths:
-            results["visual_diagnostician"] = []
-            for path in photo_paths:
-                r = await asyncio.to_thread(diag.process_vision, questionnaire_text, path)
-                results["visual_diagnostician"].append(r.to_dict())
-
-        # 3. Специалист по движениям (по видео — извлекает кадры)
+            results["visual_diagnostician"] = [None] * len(photo_paths)
+            for i, path in enumerate(photo_paths):
+                nodes[f"visual_diagnostician[{i}]"] = (
+                    (), lambda path=path: diag.process_vision(questionnaire_text, path), ("visual_diagnostician", i))
         mov = self._find("movement_specialist")
         if mov and video_paths:
-            results["movement_specialist"] = []
-            for path in video_paths:
-                r = await asyncio.to_thread(mov.process_video_frames, questionnaire_text, path)
-                results["movement_specialist"].append(r.to_dict())
+            results["movement_specialist"] = [None] * len(video_paths)
+            for i, path in enumerate(video_paths):
+                nodes[f"movement_specialist[{i}]"] = (
+                    (), lambda path=path: mov.process_video_frames(questionnaire_text, path), ("movement_specialist", i))
+        inputs = tuple(nodes)
 
-        # 4. Эксперт по техникам (собирает все данные)
-        tech_ctx = self._build_context("technique_expert", questionnaire_text, results)
         tech = self._find("technique_expert")
         if tech:
-            results["technique_expert"] = (await asyncio.to_thread(tech.process_text, tech_ctx)).to_dict()
-
-        # 5. Финальный эксперт
-        final_ctx = self._build_context("final_expert", questionnaire_text, results, include_all=True)
-        final_result = await asyncio.to_thread(self.final.process_text, final_ctx)
-        results["final_expert"] = final_result.to_dict()
-
-        return results
+            nodes["technique_expert"] = (inputs, lambda: tech.process_text(
+                self._build_context("technique_expert", questionnaire_text, results)), ("technique_expert", None))
+        nodes["final_expert"] = (tuple(nodes), lambda: self.final.process_text(
+            self._build_context("final_expert", questionnaire_text, results, include_all=True)), ("final_expert", None))
+
+        timings = await self._run_graph(nodes, results)
+        # Порядок ключей как раньше — по нему строится текст для Telegram
+        ordered = {k: results[k] for k in ("questionnaire_analyst", "visual_diagnostician", "movement_specialist",
+                                           "technique_expert", "final_expert") if k in results}
+        ordered["timings"] = timings
+        return ordered
+
+    async def _run_graph(self, nodes: Dict[str, tuple], results: Dict[str, Any]) -> Dict[str, Any]:
+        """Run every node as soon as its dependencies are done (at most max_parallel at once)."""
+        sem = asyncio.Semaphore(self.max_parallel)
+        tasks: Dict[str, asyncio.Task] = {}
+        stages: Dict[str, float] = {}
+
+        async def run(name: str):
+            deps, fn, (key, idx) = nodes[name]
+            if deps:
+                await asyncio.gather(*(tasks[d] for d in deps))
+            async with sem:
+                logger.info(f"Агент: {name}")
+                t0 = time.monotonic()
+                r = (await asyncio.to_thread(fn)).to_dict()
+                stages[name] = round(time.monotonic() - t0, 2)
+            if idx is None:
+                results[key] = r
+            else:
+                results[key][idx] = r
+
+        t0 = time.monotonic()
+        for name in nodes:  # зависимости всегда объявлены раньше
+            tasks[name] = asyncio.create_task(run(name))
+        try:
+            await asyncio.gather(*tasks.values())
+        finally:
+            for t in tasks.values():
+                t.cancel()
+        total = round(time.monotonic() - t0, 2)
+        logger.info(f"Консультация: {total}s (последовательно было бы ~{round(sum(stages.values()), 2)}s)")
+        return {"stages": stages, "total_sec": total, "sequential_sec": round(sum(stages.values()), 2),
+                "max_parallel": self.max_parallel}
 
     def _find(self, agent_id: str) -> Optional[AgentBase]:
         for a in self.specialists:
@@ -121,7 +161,7 @@ def format_consultation_results(results: dict) -> str:
             break
 
     for key, val in results.items():
-        if key == "final_expert":
+        if key in ("final_expert", "timings"):
             continue
         name = get_agent_def(key).get("name", key)
         texts = []
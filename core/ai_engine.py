@@ -1,19 +1,18 @@
 import logging
 import os
 import base64
-import requests
 import threading
-from google import genai
 from google.genai import types as genai_types
-from config import GEMINI_KEY, HF_TOKEN, get_system_prompt, get_hf_system_prompt, FALLBACK_MODELS, HF_TASKS
+from config import HF_TOKEN, get_system_prompt, get_hf_system_prompt, FALLBACK_MODELS, HF_TASKS
+from core import llm_gateway, llm_cache
 
 logger = logging.getLogger(__name__)
 
 # Чистка ключей
 CLEAN_HF_TOKEN = HF_TOKEN.strip() if HF_TOKEN else None
 
-# Клиенты
-gemini_client = genai.Client(api_key=GEMINI_KEY) if GEMINI_KEY else None
+# Клиенты — общий Gemini-клиент процесса (core.llm_gateway)
+gemini_client = llm_gateway.gemini_client()
 _chats = {}
 
 def get_ai_chat(chat_id, model_name=None, user_mode="vertical"):
@@ -96,93 +95,70 @@ def transcribe_local(audio_path, model_name="openai/whisper-base"):
         return None
 
 
-def get_hf_response(text=None, image_path=None, task="text", user_mode="vertical"):
+def _hf_request(text, image_path, task, user_mode):
+    """(kind, payload) for the gateway: ("audio", bytes) or ("chat", (messages, task))."""
+    # === АУДИО (Whisper) ===
+    if task == "audio" and image_path:
+        with open(image_path, "rb") as f:
+            audio_data = f.read()
+        logger.info(f"🎵 HF Whisper: {len(audio_data)} байт, модель {HF_TASKS['audio']}")
+        return "audio", audio_data
+
+    # === ВИЖЕН (Llama 3.2 Vision) ===
+    if task == "vision" and image_path:
+        with open(image_path, "rb") as f:
+            encoded = base64.b64encode(f.read()).decode('utf-8')
+        return "chat", ([{"role": "user", "content": [
+            {"type": "text", "text": text or "Опиши это фото."},
+            {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{encoded}"}}
+        ]}], "vision")
+
+    # === ТЕКСТ (Qwen) ===
+    hf_sys_prompt = get_hf_system_prompt(user_mode)
+    return "chat", ([{"role": "user", "content": f"{hf_sys_prompt}\n\n{text}"}],
+                    task if task in HF_TASKS and task != "audio" else "text")
+
+
+def get_hf_response(text=None, image_path=None, task="text", user_mode="vertical", cache=None):
+    """cache: call-site name from llm_cache.TTLS (None — always ask the model)."""
     if not CLEAN_HF_TOKEN: return "Ошибка: HF_TOKEN не настроен."
+    try:
+        kind, payload = _hf_request(text, image_path, task, user_mode)
+    except Exception as e:
+        logger.error(f"❌ HF Engine Exception: {e}")
+        return None
+    if kind == "audio":
+        result = llm_gateway.hf_transcribe(payload, cache=cache)
+        logger.info(f"✅ Whisper результат: {(result or '')[:100]}...")
+        return result
+    return llm_gateway.hf_chat(*payload, cache=cache)
 
-    model_id = HF_TASKS.get(task, HF_TASKS["text"])
-    headers = {"Authorization": f"Bearer {CLEAN_HF_TOKEN}"}
 
+async def get_hf_response_async(text=None, image_path=None, task="text", user_mode="vertical", cache=None):
+    """get_hf_response for async handlers: awaits the gateway instead of blocking the loop."""
+    if not CLEAN_HF_TOKEN: return "Ошибка: HF_TOKEN не настроен."
     try:
-        # === АУДИО (Whisper) ===
-        if task == "audio" and image_path:
-            # Whisper через HF Router (OpenAI-compatible API)
-            api_url = "https://router.huggingface.co/v1/audio/transcriptions"
-
-            with open(image_path, "rb") as f:
-                audio_data = f.read()
-
-            logger.info(f"🎵 HF Whisper: отправка {len(audio_data)} байт на {api_url}")
-            logger.info(f"📁 Файл: {image_path}")
-            logger.info(f"📦 Модель: {model_id}")
-
-            # OpenAI-compatible формат: multipart/form-data
-            files = {
-                "file": ("audio.wav", audio_data, "audio/wav"),
-                "model": (None, model_id)
-            }
-            headers = {
-                "Authorization": f"Bearer {CLEAN_HF_TOKEN}"
-            }
-            logger.info(f"📤 Отправка Whisper запроса (multipart/form-data)...")
-            response = requests.post(api_url, headers=headers, files=files, timeout=120)
-
-            logger.info(f"📥 HF Whisper response status: {response.status_code}")
-            logger.info(f"📄 HF Whisper response headers: {dict(response.headers)}")
-
-            if response.status_code == 200:
-                result = response.json()
-                logger.info(f"📦 HF Whisper response JSON: {result}")
-                logger.info(f"✅ Whisper результат: {result.get('text', '')[:100]}...")
-                return result.get("text", "").strip()
-            else:
-                logger.error(f"❌ HF Audio Error {response.status_code}: {response.text[:500]}")
-                return None
-
-        # === ВИЖЕН (Llama 3.2 Vision) ===
-        elif task == "vision" and image_path:
-            api_url = "https://router.huggingface.co/v1/chat/completions"
-            headers["Content-Type"] = "application/json"
-
-            with open(image_path, "rb") as f:
-                encoded = base64.b64encode(f.read()).decode('utf-8')
-            payload = {
-                "model": model_id,
-                "messages": [{"role": "user", "content": [
-                    {"type": "text", "text": text or "Опиши это фото."},
-                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{encoded}"}}
-                ]}],
-                "max_tokens": 4096
-            }
-            response = requests.post(api_url, headers=headers, json=payload, timeout=60)
-
-            if response.status_code == 200:
-                return response.json()['choices'][0]['message']['content']
-            else:
-                logger.error(f"❌ HF Vision Error {response.status_code}: {response.text}")
-                return None
-
-        # === ТЕКСТ (Qwen) ===
-        else:
-            api_url = "https://router.huggingface.co/v1/chat/completions"
-            headers["Content-Type"] = "application/json"
-
-            hf_sys_prompt = get_hf_system_prompt(user_mode)
-            payload = {
-                "model": model_id,
-                "messages": [{"role": "user", "content": f"{hf_sys_prompt}\n\n{text}"}],
-                "max_tokens": 4096
-            }
-            response = requests.post(api_url, headers=headers, json=payload, timeout=60)
-
-            if response.status_code == 200:
-                return response.json()['choices'][0]['message']['content']
-            else:
-                logger.error(f"❌ HF Text Error {response.status_code}: {response.text}")
-                return None
-
+        kind, payload = _hf_request(text, image_path, task, user_mode)
     except Exception as e:
         logger.error(f"❌ HF Engine Exception: {e}")
         return None
+    if kind == "audio":
+        result = await llm_gateway.hf_transcribe_async(payload, cache=cache)
+        logger.info(f"✅ Whisper результат: {(result or '')[:100]}...")
+        return result
+    return await llm_gateway.hf_chat_async(*payload, cache=cache)
+
+async def get_text_response_hedged(text, user_mode="vertical", site="ritual"):
+    """(answer, provider) for a text prompt: HF first, Gemini (same prompt) hedges it.
+
+    Gemini joins only when hedging is on for the site (LLM_HEDGE_SITES);
+    otherwise this is get_hf_response_async and the caller's own fallbacks follow.
+    """
+    _, (messages, task) = _hf_request(text, None, "text", user_mode)
+    calls = [llm_gateway.hf_call(messages, task)]
+    if llm_gateway.hedging_enabled(site):
+        calls.append(llm_gateway.gemini_call(messages[0]["content"], temperature=0.7, label=f"Gemini {site}"))
+    return await llm_gateway.hedged_async(site, calls)
 
 def transcribe_with_gemini(file_path, timeout_sec=60):
     """
@@ -210,13 +186,19 @@ def transcribe_with_gemini(file_path, timeout_sec=60):
     if file_size > 25 * 1024 * 1024:
         logger.warning(f"⚠️ Файл слишком большой ({file_size} bytes), Gemini может отказать")
 
+    # Повторно присланное голосовое — из кэша по хэшу аудио
+    with open(file_path, 'rb') as f:
+        bytes_data = f.read()
+    cache_key = llm_cache.make_key("gemini", "gemini-2.5-flash", "transcribe", media=[bytes_data], temperature=0)
+    cached = llm_cache.get("transcription", cache_key)
+    if cached is not None:
+        logger.info(f"✅ Gemini транскрибация из кэша: {len(cached)} символов")
+        return cached
+
     result = {"response": None, "error": None}
 
     def _transcribe():
         try:
-            with open(file_path, 'rb') as f:
-                bytes_data = f.read()
-
             # Пробуем разные MIME types для совместимости
             # WAV после конвертации или OGG из Telegram
             mime_types_to_try = ['audio/wav', 'audio/wave', 'audio/opus', 'audio/ogg', 'audio/webm']
@@ -274,7 +256,9 @@ def transcribe_with_gemini(file_path, timeout_sec=60):
 
     if result["response"] and result["response"].text:
         logger.info(f"✅ Gemini транскрибация успешна: {len(result['response'].text)} символов")
-        return result["response"].text.strip()
+        text = result["response"].text.strip()
+        llm_cache.put("transcription", cache_key, text)
+        return text
     else:
         logger.warning("⚠️ Gemini вернул пустой ответ")
         return None
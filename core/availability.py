@@ -0,0 +1,488 @@
+"""Computed availability: a masseur-day is working hours − breaks − bookings.
+
+Nothing is materialised. A day is a sorted list of free [start, end) minute
+intervals built from the masseur's schedule and that day's active bookings
+(one indexed query on the booking store); slot lists for any duration are
+cut from it on demand. Slot dicts keep the shape of the old time_slots rows
+(masseur_chat_id, slot_date, start_time, duration_min, status,
+client_chat_id, booking_id), so API responses did not change.
+
+Times are masseur-local: working hours, bookings and slot_date/start_time
+are in the masseur's timezone ("timezone" in masseurs.json, else SALON_TZ,
+else server time), and "now" for the past-slot cutoff is taken there too.
+With a client tz_offset each slot also carries client_date/client_time.
+Slot lists are cached (LRU) per (masseur, date, duration, ...) until a
+booking of that masseur-day or masseurs.json changes. Each masseur-day has
+an in-process stamp; booking changes reach the stamps through
+booking_store.days_changed_since(), asked right after a write of this
+process and otherwise at most every REFRESH_SEC, so a cache hit costs no
+query. precompute() fills the cache for the coming days in one pass
+(nightly job in the web process).
+"""
+import json
+import time
+import heapq
+import logging
+import itertools
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone, tzinfo
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Tuple
+
+from config import SALON_TZ
+from core import booking_store
+
+logger = logging.getLogger(__name__)
+
+MASSEURS_PATH = Path("data") / "masseurs.json"
+
+DEFAULT_WORK_HOURS = {"start": "09:00", "end": "18:00"}
+DEFAULT_BREAK = ("13:00", "13:30")
+DEFAULT_DURATION = 30
+SLOT_STEP_MIN = 30
+PRECOMPUTE_DURATIONS = (30, 60, 90)   # услуги салона
+
+# booking status → status of the slot it occupies
+SLOT_STATUS = {"pending": "reserved", "confirmed": "booked"}
+
+Interval = Tuple[int, int]
+
+_schedules: Dict[str, dict] = {}
+_schedules_mtime = None
+
+SLOT_CACHE_MAX = 8192
+REFRESH_SEC = 1.0          # как часто проверять записи другого процесса
+_slot_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+_cache_limit = SLOT_CACHE_MAX
+_cache_stats = {"hits": 0, "misses": 0, "evicted": 0, "refreshes": 0}
+_day_stamps: Dict[tuple, int] = {}   # (masseur, date) → штамп последнего изменения
+_stamp_seq = itertools.count(1)
+_epoch = 0                           # растёт при полной замене записей
+_seen = {"rev": None, "writes": None, "at": 0.0}
+_precompute_stats: Dict[str, Any] = {}
+
+
+def _to_min(t_str: str) -> int:
+    h, m = str(t_str)[:5].split(":")
+    return int(h) * 60 + int(m)
+
+
+def _to_time(mins: int) -> str:
+    return f"{mins // 60:02d}:{mins % 60:02d}"
+
+
+# ─── Schedule ───
+
+def _load_schedules() -> Dict[str, dict]:
+    """masseurs.json, re-read only when the file changes."""
+    global _schedules, _schedules_mtime
+    try:
+        mtime = MASSEURS_PATH.stat().st_mtime
+    except OSError:
+        mtime = None
+    if mtime != _schedules_mtime:
+        data = {}
+        if mtime is not None:
+            try:
+                data = json.loads(MASSEURS_PATH.read_text(encoding="utf-8"))
+            except (json.JSONDecodeError, OSError) as e:
+                logger.warning(f"Failed to load {MASSEURS_PATH}: {e}")
+        _schedules, _schedules_mtime = data if isinstance(data, dict) else {}, mtime
+    return _schedules
+
+
+def schedules_version():
+    """Changes whenever masseurs.json (working hours / breaks) changes."""
+    _load_schedules()
+    return _schedules_mtime
+
+
+def _zone(name: str) -> Optional[tzinfo]:
+    """IANA name or a fixed offset in minutes ("180", "-300") → tzinfo (None: server time)."""
+    if not name:
+        return None
+    try:
+        return timezone(timedelta(minutes=int(name)))
+    except ValueError:
+        pass
+    try:
+        from zoneinfo import ZoneInfo
+        return ZoneInfo(str(name))
+    except Exception as e:
+        logger.warning(f"Unknown timezone {name!r}: {e}")
+        return None
+
+
+def salon_tz() -> Optional[tzinfo]:
+    """The salon's zone (SALON_TZ; None → server local time)."""
+    return _zone(SALON_TZ)
+
+
+def schedule(masseur_chat_id: int, work_hours: dict = None,
+             break_start: str = None, break_end: str = None) -> Dict[str, Any]:
+    """Working window and breaks in minutes: {"start", "end", "breaks": [(s, e)], "tz"}.
+
+    Explicit arguments win; otherwise the masseur's entry in masseurs.json
+    (working_hours / break_start / break_end), otherwise the salon defaults.
+    "tz" is the masseur's tzinfo (None → server local time).
+    """
+    m = _load_schedules().get(str(masseur_chat_id)) or {}
+    wh = work_hours or m.get("working_hours") or DEFAULT_WORK_HOURS
+    if isinstance(wh, str):
+        try:
+            wh = json.loads(wh)
+        except ValueError:
+            wh = DEFAULT_WORK_HOURS
+    bs = break_start or m.get("break_start") or DEFAULT_BREAK[0]
+    be = break_end or m.get("break_end") or DEFAULT_BREAK[1]
+    start = _to_min(wh.get("start", DEFAULT_WORK_HOURS["start"]))
+    end = _to_min(wh.get("end", DEFAULT_WORK_HOURS["end"]))
+    breaks = [(_to_min(bs), _to_min(be))] if _to_min(be) > _to_min(bs) else []
+    return {"start": start, "end": end, "breaks": breaks,
+            "tz": _zone(str(m.get("timezone") or "")) or salon_tz()}
+
+
+# ─── Intervals ───
+
+def subtract(intervals: List[Interval], start: int, end: int) -> List[Interval]:
+    """Remove [start, end) from a sorted list of disjoint intervals."""
+    out = []
+    for s, e in intervals:
+        if e <= start or s >= end:
+            out.append((s, e))
+            continue
+        if s < start:
+            out.append((s, start))
+        if e > end:
+            out.append((end, e))
+    return out
+
+
+def fits(intervals: List[Interval], start: int, duration: int) -> bool:
+    """Is [start, start + duration) inside one free interval?"""
+    end = start + duration
+    for s, e in intervals:
+        if s > start:
+            return False
+        if start >= s and end <= e:
+            return True
+    return False
+
+
+def _spans(bookings: List[dict]) -> List[Tuple[int, int, dict]]:
+    """(start, end, booking) of the active bookings, by start."""
+    out = []
+    for b in bookings:
+        if b.get("status") not in SLOT_STATUS or not b.get("start_time"):
+            continue
+        try:
+            s = _to_min(b["start_time"])
+        except (ValueError, TypeError):
+            continue
+        out.append((s, s + int(b.get("duration_min") or 60), b))
+    out.sort(key=lambda x: x[0])
+    return out
+
+
+def _active_bookings(masseur_chat_id: int, slot_date: str) -> List[Tuple[int, int, dict]]:
+    return _spans(booking_store.get_bookings(masseur_chat_id=masseur_chat_id, slot_date=slot_date,
+                                             newest_first=False))
+
+
+def _now(tz: tzinfo = None) -> datetime:
+    """Naive wall clock in the masseur's zone (None → server local time)."""
+    if tz is not None:
+        return datetime.now(tz).replace(tzinfo=None)
+    return datetime.now()
+
+
+def _cutoff(slot_date: str, tz: tzinfo = None) -> Optional[int]:
+    """Minute of the day before which slots are in the past (None: whole day open, -1: day is over)."""
+    now = _now(tz)
+    today = now.date().isoformat()
+    if slot_date < today:
+        return -1
+    if slot_date == today:
+        return now.hour * 60 + now.minute
+    return None
+
+
+def today(masseur_chat_id: int) -> str:
+    """Today's date in the masseur's zone."""
+    return _now(schedule(masseur_chat_id)["tz"]).date().isoformat()
+
+
+def to_client(slot_date: str, minute: int, tz: tzinfo, client_offset: int) -> Tuple[str, str]:
+    """Masseur-local (date, minute of day) → client's (date, "HH:MM") for a UTC offset in minutes."""
+    local = datetime.strptime(slot_date, "%Y-%m-%d") + timedelta(minutes=minute)
+    aware = local.replace(tzinfo=tz) if tz is not None else local.astimezone()
+    client = aware.astimezone(timezone(timedelta(minutes=client_offset)))
+    return client.date().isoformat(), client.strftime("%H:%M")
+
+
+def day(masseur_chat_id: int, slot_date: str, sched: dict = None) -> Dict[str, Any]:
+    """Free intervals of a masseur-day plus the bookings that cut them."""
+    return _view(sched or schedule(masseur_chat_id), _active_bookings(masseur_chat_id, slot_date))
+
+
+def _view(sched: dict, busy: List[Tuple[int, int, dict]]) -> Dict[str, Any]:
+    free = [(sched["start"], sched["end"])]
+    for s, e in sched["breaks"]:
+        free = subtract(free, s, e)
+    for s, e, _ in busy:
+        free = subtract(free, s, e)
+    return {"schedule": sched, "free": free, "busy": busy}
+
+
+def _slot(masseur_chat_id, slot_date, start, duration, status="free", booking=None) -> Dict[str, Any]:
+    return {
+        "masseur_chat_id": masseur_chat_id,
+        "slot_date": slot_date,
+        "start_time": _to_time(start),
+        "duration_min": duration,
+        "status": status,
+        "client_chat_id": booking.get("client_chat_id") if booking else None,
+        "booking_id": booking.get("id") if booking else None,
+    }
+
+
+def day_slots(masseur_chat_id: int, slot_date: str, duration: int = None, tz_offset: int = None,
+              include_busy: bool = True, include_past: bool = False,
+              sched: dict = None, day_view: dict = None) -> List[Dict[str, Any]]:
+    """Slots of `duration` minutes on the SLOT_STEP_MIN grid.
+
+    include_busy=True also returns slots taken by a booking (status
+    reserved/booked with its client/booking id). Slots overlapping a break
+    are never returned, past ones (in the masseur's zone) only with
+    include_past. tz_offset: client's UTC offset in minutes → adds
+    client_date / client_time to every slot.
+    """
+    duration = duration or DEFAULT_DURATION
+    if sched is not None or day_view is not None:
+        view = day_view or day(masseur_chat_id, slot_date, sched)
+        return _render(_compute_slots(masseur_chat_id, slot_date, duration, include_busy, include_past, view),
+                       view["schedule"].get("tz"), tz_offset)
+    sched = schedule(masseur_chat_id)
+    cutoff = None if include_past else _cutoff(slot_date, sched["tz"])
+    if cutoff == -1:
+        return []
+    key = (masseur_chat_id, slot_date, duration, include_busy, cutoff)
+    _refresh()
+    version = _day_version(masseur_chat_id, slot_date)
+    slots = _cache_get(key, version)
+    if slots is None:
+        _cache_stats["misses"] += 1
+        slots = _compute_slots(masseur_chat_id, slot_date, duration, include_busy, include_past,
+                               day(masseur_chat_id, slot_date, sched))
+        _cache_put(key, version, slots)
+    return _render(slots, sched["tz"], tz_offset)
+
+
+def _refresh():
+    """Move the stamps of masseur-days whose bookings changed (either process).
+
+    Asks the store only after a write of this process or once per
+    REFRESH_SEC — not on every lookup.
+    """
+    global _epoch
+    writes, now = booking_store.local_writes(), time.monotonic()
+    if writes == _seen["writes"] and now - _seen["at"] < REFRESH_SEC:
+        return
+    _seen["writes"], _seen["at"] = writes, now
+    _cache_stats["refreshes"] += 1
+    if _seen["rev"] is None:
+        _seen["rev"] = booking_store.bookings_rev()
+        _epoch += 1
+        return
+    rev, days = booking_store.days_changed_since(_seen["rev"])
+    if days is None:  # записи заменены целиком (restore)
+        _epoch += 1
+        _day_stamps.clear()
+    else:
+        for d in days:
+            _day_stamps[d] = next(_stamp_seq)
+    _seen["rev"] = rev
+
+
+def _day_version(masseur_chat_id: int, slot_date: str) -> tuple:
+    """Changes with a booking of this masseur-day or masseurs.json."""
+    return _epoch, _day_stamps.get((masseur_chat_id, slot_date), 0), _schedules_mtime
+
+
+def _cache_get(key: tuple, version: tuple) -> Optional[List[dict]]:
+    hit = _slot_cache.get(key)
+    if hit is None or hit[0] != version:
+        return None
+    _slot_cache.move_to_end(key)
+    _cache_stats["hits"] += 1
+    return hit[1]
+
+
+def _cache_put(key: tuple, version: tuple, slots: List[dict]):
+    # cutoff в ключе: список «сегодня» меняется по мере хода времени
+    _slot_cache[key] = (version, slots)
+    _slot_cache.move_to_end(key)
+    while len(_slot_cache) > _cache_limit:
+        _slot_cache.popitem(last=False)
+        _cache_stats["evicted"] += 1
+
+
+def _render(slots: List[dict], tz: Optional[tzinfo], tz_offset: Optional[int]) -> List[Dict[str, Any]]:
+    """Copies of cached slots, with client_date / client_time for a client offset."""
+    out = [dict(s) for s in slots]
+    if tz_offset is not None:
+        for s in out:
+            s["client_date"], s["client_time"] = to_client(s["slot_date"], _to_min(s["start_time"]), tz, tz_offset)
+    return out
+
+
+def _compute_slots(masseur_chat_id: int, slot_date: str, duration: int,
+                   include_busy: bool, include_past: bool, view: dict) -> List[Dict[str, Any]]:
+    sched, free, busy = view["schedule"], view["free"], view["busy"]
+    cutoff = None if include_past else _cutoff(slot_date, sched.get("tz"))
+    if cutoff == -1:
+        return []
+    out = []
+    t = sched["start"]
+    while t + duration <= sched["end"]:
+        if cutoff is not None and t <= cutoff:
+            t += SLOT_STEP_MIN
+            continue
+        if fits(free, t, duration):
+            out.append(_slot(masseur_chat_id, slot_date, t, duration))
+        elif include_busy and not any(s < t + duration and t < e for s, e in sched["breaks"]):
+            taken = next((b for s, e, b in busy if s < t + duration and t < e), None)
+            if taken is not None:
+                out.append(_slot(masseur_chat_id, slot_date, t, duration, SLOT_STATUS[taken["status"]], taken))
+        t += SLOT_STEP_MIN
+    return out
+
+
+def free_slots(masseur_chat_id: int, slot_date: str, duration: int = None,
+               tz_offset: int = None) -> List[Dict[str, Any]]:
+    return day_slots(masseur_chat_id, slot_date, duration, tz_offset, include_busy=False)
+
+
+def precompute(masseur_ids: List[int], days: int, durations: List[int],
+               start_date: str = None) -> Dict[str, Any]:
+    """Fill the slot cache for every masseur × the next `days` days × durations.
+
+    Bookings for the whole range come from one store query; each masseur-day
+    view is built once and cut for every duration (free-only and with busy).
+    """
+    global _cache_limit
+    t0 = time.monotonic()
+    first = start_date or min((today(m) for m in masseur_ids), default=datetime.now().date().isoformat())
+    dates = [(datetime.strptime(first, "%Y-%m-%d") + timedelta(days=i)).date().isoformat()
+             for i in range(days)]
+    # кэш вмещает весь прогон с запасом на живые запросы — LRU не вытеснит его же вывод
+    _cache_limit = max(SLOT_CACHE_MAX, 2 * len(masseur_ids) * len(dates) * len(durations) * 2)
+    _refresh()
+    by_day: Dict[tuple, list] = {}
+    for b in booking_store.get_bookings_between(dates[0], dates[-1]):
+        by_day.setdefault((b.get("masseur_chat_id"), b.get("slot_date")), []).append(b)
+    entries = 0
+    for mid in masseur_ids:
+        sched = schedule(mid)
+        for slot_date in dates:
+            cutoff = _cutoff(slot_date, sched["tz"])
+            if cutoff == -1:
+                continue
+            version = _day_version(mid, slot_date)
+            view = _view(sched, _spans(by_day.get((mid, slot_date), [])))
+            for duration in durations:
+                for include_busy in (True, False):
+                    slots = _compute_slots(mid, slot_date, duration, include_busy, False, view)
+                    _cache_put((mid, slot_date, duration, include_busy, cutoff), version, slots)
+                    entries += 1
+    _precompute_stats.update({
+        "last_run_at": time.time(),
+        "last_run_sec": round(time.monotonic() - t0, 3),
+        "masseurs": len(masseur_ids), "days": days, "entries": entries,
+        "runs": _precompute_stats.get("runs", 0) + 1,
+    })
+    logger.info(f"Availability precompute: {len(masseur_ids)} masseurs × {days} days → "
+                f"{entries} cache entries in {_precompute_stats['last_run_sec']}s")
+    return dict(_precompute_stats)
+
+
+def cache_stats() -> Dict[str, Any]:
+    total = _cache_stats["hits"] + _cache_stats["misses"]
+    return {"entries": len(_slot_cache), "limit": _cache_limit, **_cache_stats,
+            "hit_ratio": round(_cache_stats["hits"] / total, 3) if total else None,
+            "precompute": dict(_precompute_stats)}
+
+
+def day_counts(sched: dict, busy: List[Interval], slot_date: str,
+               duration: int = None, include_past: bool = False) -> Dict[str, int]:
+    """{total, free, booked} for a day from its busy intervals (booking_store.day_busy).
+
+    Same grid and rules as day_slots(), without loading the day's bookings.
+    """
+    duration = duration or DEFAULT_DURATION
+    cutoff = None if include_past else _cutoff(slot_date, sched.get("tz"))
+    total = booked = 0
+    if cutoff != -1:
+        t = sched["start"]
+        while t + duration <= sched["end"]:
+            end = t + duration
+            if (cutoff is None or t > cutoff) and not any(s < end and t < e for s, e in sched["breaks"]):
+                total += 1
+                if any(s < end and t < e for s, e in busy):
+                    booked += 1
+            t += SLOT_STEP_MIN
+    return {"total": total, "free": total - booked, "booked": booked}
+
+
+# ─── Search across masseurs ───
+
+def _window_slots(masseur_chat_id: int, slot_date: str, sched: dict, busy: List[Interval],
+                  duration: int, lo: int, hi: int):
+    """(slot, gap left in its free interval) for every grid start inside [lo, hi)."""
+    free = [(sched["start"], sched["end"])]
+    for s, e in list(sched["breaks"]) + [tuple(b) for b in busy]:
+        free = subtract(free, s, e)
+    for fs, fe in free:
+        s, e = max(fs, lo), min(fe, hi)
+        # первая точка сетки (от начала рабочего дня) не раньше s
+        t = sched["start"] + (s - sched["start"] + SLOT_STEP_MIN - 1) // SLOT_STEP_MIN * SLOT_STEP_MIN
+        while t + duration <= e:
+            yield _slot(masseur_chat_id, slot_date, t, duration), fe - fs - duration
+            t += SLOT_STEP_MIN
+
+
+def search(masseur_ids: List[int], dates: List[str], busy_index: Dict[tuple, list],
+           duration: int = None, time_from: str = None, time_to: str = None,
+           limit: int = 5, mode: str = "earliest", tz_offset: int = None) -> List[Dict[str, Any]]:
+    """Top `limit` free slots of `duration` across masseurs and dates.
+
+    busy_index: booking_store.get_busy_index() for the date range, so the
+    whole search is one query plus interval arithmetic.
+    mode "earliest" — soonest first (stops after the first date that fills
+    the list); "best_fit" — slots that leave the smallest free gap around
+    them first (keeps the day compact), then by time.
+    """
+    duration = duration or DEFAULT_DURATION
+    lo = _to_min(time_from) if time_from else 0
+    hi = _to_min(time_to) if time_to else 24 * 60
+    scheds = {mid: schedule(mid) for mid in masseur_ids}
+    found = []
+    for slot_date in dates:
+        for mid in masseur_ids:
+            cutoff = _cutoff(slot_date, scheds[mid]["tz"])
+            if cutoff == -1:
+                continue
+            day_lo = max(lo, cutoff + 1) if cutoff is not None else lo
+            busy = busy_index.get((mid, slot_date), [])
+            found.extend(_window_slots(mid, slot_date, scheds[mid], busy, duration, day_lo, hi))
+        if mode == "earliest" and len(found) >= limit:
+            break
+    if mode == "best_fit":
+        key = lambda x: (x[1], x[0]["slot_date"], x[0]["start_time"])
+    else:
+        key = lambda x: (x[0]["slot_date"], x[0]["start_time"])
+    out = []
+    for slot, gap in heapq.nsmallest(limit, found, key=key):
+        slot = _render([slot], scheds[slot["masseur_chat_id"]]["tz"], tz_offset)[0]
+        out.append({**slot, "gap_min": gap})
+    return out
@@ -1,36 +1,27 @@
 import json
 import time
+import asyncio
 import logging
 from datetime import datetime, timedelta, date, time as dtime
 from typing import Optional, Dict, Any, List
 from pathlib import Path
 
+from core import booking_store, sb_outbox, availability, booking_scheduler
+
 logger = logging.getLogger(__name__)
 
 DATA_DIR = Path("data")
 DATA_DIR.mkdir(parents=True, exist_ok=True)
 
-SLOTS_PATH = DATA_DIR / "time_slots.json"
-BOOKINGS_PATH = DATA_DIR / "bookings.json"
-
 DEFAULT_WORK_HOURS = {"start": "09:00", "end": "18:00"}
 DEFAULT_DURATIONS = [30, 60, 90]
 DEFAULT_CANCEL_DEADLINE_MIN = 60
+MAX_PENDING_PER_CLIENT = 2
+AUTO_CANCEL_BEFORE_MIN = 60     # не подтверждена за час до сеанса → отмена
+REMINDER_BEFORE_MIN = 180       # напоминание массажисту за 3 часа
 
 WEEKDAYS_RU = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
 
-def _load_json(path: Path) -> list:
-    if path.exists():
-        try:
-            data = json.loads(path.read_text(encoding="utf-8"))
-            return data if isinstance(data, list) else []
-        except (json.JSONDecodeError, OSError) as e:
-            logger.warning(f"Failed to load {path}: {e}")
-    return []
-
-def _save_json(path: Path, data: list) -> None:
-    path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
-
 _sb_req_fn = None
 _sb_query_fn = None
 _sb_checked = False
@@ -58,47 +49,48 @@ def _init_sb():
 
 # ──────────────────── Masseurs ────────────────────
 
+def _masseurs_from_sb(masseurs: list) -> List[Dict[str, Any]]:
+    result = []
+    for m in masseurs:
+        wh = m.get("working_hours", {})
+        if isinstance(wh, str):
+            try: wh = json.loads(wh)
+            except: wh = {}
+        result.append({
+            "chat_id": m["chat_id"],
+            "name": m.get("name") or m.get("email", "").split("@")[0] or f"Массажист {m['chat_id']}",
+            "working_hours": wh,
+            "break_start": str(m.get("break_start", "13:00")),
+            "break_end": str(m.get("break_end", "13:30")),
+            "cancel_deadline_min": m.get("cancel_deadline_min", DEFAULT_CANCEL_DEADLINE_MIN),
+        })
+    return result
+
 def get_available_masseurs() -> List[Dict[str, Any]]:
     """Return list of masseurs with their working hours."""
     sb_req, sb_query = _init_sb()
     if sb_req:
         masseurs = sb_query("masseur_settings")
         if isinstance(masseurs, list) and masseurs:
-            result = []
-            for m in masseurs:
-                wh = m.get("working_hours", {})
-                if isinstance(wh, str):
-                    try: wh = json.loads(wh)
-                    except: wh = {}
-                result.append({
-                    "chat_id": m["chat_id"],
-                    "name": m.get("name") or m.get("email", "").split("@")[0] or f"Массажист {m['chat_id']}",
-                    "working_hours": wh,
-                    "break_start": str(m.get("break_start", "13:00")),
-                    "break_end": str(m.get("break_end", "13:30")),
-                    "cancel_deadline_min": m.get("cancel_deadline_min", DEFAULT_CANCEL_DEADLINE_MIN),
-                })
-            return result
+            return _masseurs_from_sb(masseurs)
+    return _masseurs_local()
+
+def _masseurs_local() -> List[Dict[str, Any]]:
     from core.masseur_diary import get_masseurs
     masseurs = get_masseurs()
     return [{
         "chat_id": m["chat_id"],
         "name": m.get("name", f"Массажист {m['chat_id']}"),
-        "working_hours": DEFAULT_WORK_HOURS,
-        "break_start": "13:00",
-        "break_end": "13:30",
-        "cancel_deadline_min": DEFAULT_CANCEL_DEADLINE_MIN,
+        "working_hours": m.get("working_hours") or DEFAULT_WORK_HOURS,
+        "break_start": m.get("break_start", "13:00"),
+        "break_end": m.get("break_end", "13:30"),
+        "cancel_deadline_min": m.get("cancel_deadline_min", DEFAULT_CANCEL_DEADLINE_MIN),
         "specialties": m.get("specialties", []),
     } for m in masseurs]
 
 # ──────────────────── Time Slots ────────────────────
-
-def _time_to_min(t_str: str) -> int:
-    h, m = t_str.split(":")
-    return int(h) * 60 + int(m)
-
-def _min_to_time(mins: int) -> str:
-    return f"{mins // 60:02d}:{mins % 60:02d}"
+# Slots are computed from working hours, breaks and bookings (core.availability);
+# nothing is pre-generated or stored.
 
 def _date_range(start_date: str, days: int = 7):
     """Yield date strings from start_date for N days."""
@@ -112,180 +104,123 @@ def _date_range(start_date: str, days: int = 7):
 
 def generate_slots(masseur_chat_id: int, start_date: str = None, days: int = 7,
                    work_hours: dict = None, durations: list = None,
-                   break_start: str = "13:00", break_end: str = "13:30",
+                   break_start: str = None, break_end: str = None,
                    tz_offset: int = None) -> List[Dict[str, Any]]:
-    """Generate time slots for a masseur for the next N days."""
-    if work_hours is None:
-        work_hours = DEFAULT_WORK_HOURS
-    if durations is None:
-        durations = DEFAULT_DURATIONS
-    wh_start = _time_to_min(work_hours.get("start", "09:00"))
-    wh_end = _time_to_min(work_hours.get("end", "18:00"))
-    br_start = _time_to_min(break_start)
-    br_end = _time_to_min(break_end)
-
+    """Free slots of a masseur for the next N days (computed, not stored)."""
+    duration = min(durations or DEFAULT_DURATIONS)
+    custom = work_hours or break_start or break_end
+    # Своё расписание — считаем напрямую; обычное — через кэш day_slots()
+    sched = availability.schedule(masseur_chat_id, work_hours, break_start, break_end) if custom else None
     slots = []
-    dt_start = date.today().isoformat() if not start_date else start_date
-    if tz_offset is not None:
-        now = datetime.utcnow() + timedelta(minutes=tz_offset)
-    else:
-        now = datetime.now()
-    now_min = now.hour * 60 + now.minute
-    for day_str in _date_range(dt_start, days):
-        slot_time = wh_start
-        while slot_time + min(durations) <= wh_end:
-            in_break = br_start < slot_time < br_end or br_start < slot_time + min(durations) < br_end
-            is_past = day_str == date.today().isoformat() and slot_time <= now_min
-            if not in_break and not is_past:
-                for dur in sorted(durations):
-                    if slot_time + dur <= wh_end:
-                        next_br = br_start < slot_time + dur < br_end
-                        if not next_br:
-                            slots.append({
-                                "masseur_chat_id": masseur_chat_id,
-                                "slot_date": day_str,
-                                "start_time": _min_to_time(slot_time),
-                                "duration_min": dur,
-                                "status": "free",
-                                "client_chat_id": None,
-                                "booking_id": None,
-                            })
-                        break
-            slot_time += 30
+    for day_str in _date_range(start_date or availability.today(masseur_chat_id), days):
+        slots.extend(availability.day_slots(masseur_chat_id, day_str, duration, tz_offset,
+                                            include_busy=False, sched=sched))
     return slots
 
-def _slot_key(slot: dict) -> str:
-    return f"{slot['masseur_chat_id']}:{slot['slot_date']}:{slot['start_time']}:{slot['duration_min']}"
+def get_free_slots(masseur_chat_id: int, slot_date: str = None, tz_offset: int = None,
+                   duration: int = None) -> List[Dict[str, Any]]:
+    """Get free slots for a masseur on a given date (no date → the next 3 days)."""
+    if slot_date:
+        return availability.free_slots(masseur_chat_id, slot_date, duration, tz_offset)
+    return generate_slots(masseur_chat_id, availability.today(masseur_chat_id), days=3,
+                          durations=[duration] if duration else None, tz_offset=tz_offset)
 
-def _save_slots(slots: list):
-    sb_req, _ = _init_sb()
-    if sb_req and slots:
-        try:
-            import requests as req_lib
-            from config import SUPABASE_URL, SUPABASE_SERVICE_KEY
-            headers = {
-                "apikey": SUPABASE_SERVICE_KEY,
-                "Authorization": f"Bearer {SUPABASE_SERVICE_KEY}",
-                "Content-Type": "application/json",
-                "Prefer": "resolution=merge-duplicates",
-            }
-            url = SUPABASE_URL.rstrip("/") + "/rest/v1/time_slots"
-            req_lib.post(url, json=slots, headers=headers, timeout=10)
-        except Exception as e:
-            logger.warning(f"Supabase batch slot save: {e}")
-    existing = _load_json(SLOTS_PATH)
-    keys = {_slot_key(s) for s in existing}
+
+def _match_specialties(masseur: dict, specialties: List[str]) -> bool:
+    have = {str(x).strip().lower() for x in masseur.get("specialties") or []}
+    return any(s.strip().lower() in have for s in specialties)
+
+def find_earliest_slots(duration: int = None, time_from: str = None, time_to: str = None,
+                        specialties: List[str] = None, days: int = 14, limit: int = 5,
+                        mode: str = "earliest", start_date: str = None,
+                        tz_offset: int = None) -> List[Dict[str, Any]]:
+    """Top-K free slots across all masseurs (optionally only those with one of `specialties`).
+
+    One day_stats query for the whole horizon instead of get_free_slots()
+    per masseur and date. mode: "earliest" | "best_fit".
+    """
+    from core.masseur_diary import get_masseurs
+    masseurs = [m for m in get_masseurs() if m.get("chat_id")]
+    if specialties:
+        masseurs = [m for m in masseurs if _match_specialties(m, specialties)]
+    if not masseurs:
+        return []
+    ids = [int(m["chat_id"]) for m in masseurs]
+    # «сегодня» самого западного массажиста: прошедшее время каждого отсечёт search()
+    dates = list(_date_range(start_date or min(availability.today(m) for m in ids), days))
+    busy_index = booking_store.get_busy_index(dates[0], dates[-1])
+    slots = availability.search(ids, dates, busy_index,
+                                duration, time_from, time_to, limit, mode, tz_offset)
+    names = {int(m["chat_id"]): m.get("name") or f"Массажист {m['chat_id']}" for m in masseurs}
     for s in slots:
-        if _slot_key(s) not in keys:
-            existing.append(s)
-            keys.add(_slot_key(s))
-    _save_json(SLOTS_PATH, existing)
-
-def get_free_slots(masseur_chat_id: int, slot_date: str = None, tz_offset: int = None) -> List[Dict[str, Any]]:
-    """Get free slots for a masseur on a given date."""
-    result = None
-    sb_req, sb_query = _init_sb()
-    if sb_req:
-        params = {"masseur_chat_id": f"eq.{masseur_chat_id}", "status": "eq.free"}
-        if slot_date:
-            params["slot_date"] = f"eq.{slot_date}"
-        slots = sb_query("time_slots", params)
-        if isinstance(slots, list):
-            result = slots
-    if result is None:
-        slots = _load_json(SLOTS_PATH)
-        result = [s for s in slots
-                  if s.get("masseur_chat_id") == masseur_chat_id
-                  and s.get("status") == "free"
-                  and (slot_date is None or s.get("slot_date") == slot_date)]
-    if not result:
-        sd = slot_date or date.today().isoformat()
-        generated = generate_slots(masseur_chat_id, sd, days=3, tz_offset=tz_offset)
-        _save_slots(generated)
-        result = [s for s in generated
-                  if s.get("status") == "free"
-                  and (slot_date is None or s.get("slot_date") == slot_date)]
-    return result
+        s["masseur_name"] = names.get(s["masseur_chat_id"], "")
+    return slots
 
 
 def get_all_slots_for_client(masseur_chat_id: int, slot_date: str, tz_offset: int = None) -> List[Dict[str, Any]]:
     """Get ALL slots (free/reserved/booked) for a client booking view."""
-    slots = _load_json(SLOTS_PATH)
-    result = [s for s in slots
-              if s.get("masseur_chat_id") == masseur_chat_id
-              and s.get("slot_date") == slot_date]
-    if not result:
-        generated = generate_slots(masseur_chat_id, slot_date, days=3, tz_offset=tz_offset)
-        _save_slots(generated)
-        result = [s for s in generated if s.get("slot_date") == slot_date]
-    return result
+    return availability.day_slots(masseur_chat_id, slot_date, tz_offset=tz_offset)
 
 
-def get_booked_slots_for_month(masseur_chat_id: int, year: int, month: int, tz_offset: int = None) -> dict:
-    """Get slot count per day for a month: {date: {total: N, free: N}}."""
+def _month_bounds(year: int, month: int) -> tuple:
     from calendar import monthrange
     _, days_in_month = monthrange(year, month)
     prefix = f"{year:04d}-{month:02d}"
-    all_slots = _load_json(SLOTS_PATH)
-    # Filter slots for this masseur in this month
+    return f"{prefix}-01", f"{prefix}-{days_in_month:02d}", days_in_month
+
+def _month_params(masseur_chat_id: int, year: int, month: int) -> list:
+    """Supabase range query for a month's active bookings (list: slot_date is filtered twice)."""
+    first, last, _ = _month_bounds(year, month)
+    return [
+        ("masseur_chat_id", f"eq.{masseur_chat_id}"),
+        ("slot_date", f"gte.{first}"),
+        ("slot_date", f"lte.{last}"),
+        ("status", "in.(pending,confirmed)"),
+        ("select", "slot_date,start_time,duration_min,status"),
+    ]
+
+def _month_stats_from_rows(rows: list) -> Dict[str, dict]:
+    by_day = {}
+    for b in rows:
+        by_day.setdefault(b.get("slot_date", ""), []).append(b)
+    return {d: booking_store.day_busy(bs) for d, bs in by_day.items()}
+
+def _month_day_map(masseur_chat_id: int, year: int, month: int, stats: Dict[str, dict]) -> dict:
+    """{date: {total, free, booked}} from day aggregates — O(days_in_month).
+
+    Days and the past cutoff are the masseur's (availability.schedule()["tz"]).
+    """
+    _, _, days_in_month = _month_bounds(year, month)
+    sched = availability.schedule(masseur_chat_id)
     day_map = {}
-    for s in all_slots:
-        if s.get("masseur_chat_id") != masseur_chat_id:
-            continue
-        sd = s.get("slot_date", "")
-        if not sd.startswith(prefix):
-            continue
-        key = sd
-        if key not in day_map:
-            day_map[key] = {"total": 0, "free": 0}
-        day_map[key]["total"] += 1
-        if s.get("status") == "free":
-            day_map[key]["free"] += 1
-    # Also query Supabase for extra data
-    sb_req, sb_query = _init_sb()
-    if sb_req:
-        start_date = f"{prefix}-01"
-        end_date = f"{prefix}-{days_in_month:02d}"
-        sb_slots = sb_query("time_slots", {
-            "masseur_chat_id": f"eq.{masseur_chat_id}",
-            "slot_date": f"gte.{start_date}",
-            "slot_date": f"lte.{end_date}",
-        })
-        if isinstance(sb_slots, list):
-            for s in sb_slots:
-                sd = s.get("slot_date", "")
-                if sd not in day_map:
-                    day_map[sd] = {"total": 0, "free": 0}
-                day_map[sd]["total"] = max(day_map[sd]["total"], day_map[sd].get("_sb_total", 0) + 1)
-                day_map[sd]["_sb_total"] = day_map[sd].get("_sb_total", 0) + 1
-                if s.get("status") == "free":
-                    day_map[sd]["free"] += 1
-    # Fill missing days
     for d in range(1, days_in_month + 1):
-        ds = f"{prefix}-{d:02d}"
-        if ds not in day_map:
-            day_map[ds] = {"total": 0, "free": 0}
-    # Cleanup internal keys
-    for v in day_map.values():
-        v.pop("_sb_total", None)
+        ds = f"{year:04d}-{month:02d}-{d:02d}"
+        busy = stats[ds]["busy"] if ds in stats else []
+        day_map[ds] = availability.day_counts(sched, busy, ds)
     return day_map
 
+def _month_needs_supabase() -> bool:
+    """Local store empty (restore skipped / fresh instance) → ask Supabase."""
+    sb_req, _ = _init_sb()
+    return bool(sb_req) and not booking_store.has_bookings()
+
+def get_booked_slots_for_month(masseur_chat_id: int, year: int, month: int, tz_offset: int = None) -> dict:
+    """Get slot count per day for a month: {date: {total: N, free: N, booked: N}}."""
+    if _month_needs_supabase():
+        _, sb_query = _init_sb()
+        stats = _month_stats_from_rows(sb_query("bookings", _month_params(masseur_chat_id, year, month)))
+    else:
+        first, last, _ = _month_bounds(year, month)
+        stats = booking_store.get_day_stats(masseur_chat_id, first, last)
+    return _month_day_map(masseur_chat_id, year, month, stats)
+
 
 # ──────────────────── Bookings ────────────────────
 
-def create_booking(client_chat_id: int, masseur_chat_id: int,
-                   slot_date: str, start_time: str, duration_min: int = 60,
-                   service_name: str = "", note: str = "",
-                   is_first_visit: bool = False,
-                   client_username: str = "") -> Optional[Dict[str, Any]]:
-    """Create a new booking (status: pending). Returns None if limit exceeded."""
-    # Check pending limit: max 2 pending bookings per client
-    existing = get_bookings(for_chat_id=client_chat_id, status="pending")
-    if len(existing) >= 2:
-        logger.warning(f"Client {client_chat_id} has {len(existing)} pending bookings, rejecting")
-        return None
-    sb_req, sb_query = _init_sb()
-    booking = {
+def _new_booking(client_chat_id: int, masseur_chat_id: int, slot_date: str, start_time: str,
+                 duration_min: int, service_name: str, note: str, is_first_visit: bool,
+                 client_username: str) -> Dict[str, Any]:
+    return {
         "client_chat_id": client_chat_id,
         "masseur_chat_id": masseur_chat_id,
         "service_name": service_name,
@@ -298,54 +233,155 @@ def create_booking(client_chat_id: int, masseur_chat_id: int,
         "client_username": client_username,
         "created_at": datetime.utcnow().isoformat(),
     }
-    if sb_req:
-        result = sb_req("POST", "bookings", booking)
-        if result is not None:
-            booking_id = result.get("id") if isinstance(result, dict) else None
-            if not booking_id:
-                b_list = sb_query("bookings", {"client_chat_id": f"eq.{client_chat_id}", "status": "eq.pending", "order": "created_at.desc", "limit": "1"})
-                booking_id = b_list[0]["id"] if isinstance(b_list, list) and b_list else None
-            if booking_id:
-                sb_req("PATCH", f"time_slots?masseur_chat_id=eq.{masseur_chat_id}&slot_date=eq.{slot_date}&start_time=eq.{start_time}&duration_min=eq.{duration_min}", {"status": "reserved", "client_chat_id": client_chat_id, "booking_id": booking_id})
-    bookings = _load_json(BOOKINGS_PATH)
-    booking["id"] = int(time.time() * 1000) % 10000000000
-    bookings.append(booking)
-    _save_json(BOOKINGS_PATH, bookings)
+
+RESERVE_REFUSALS = {
+    "pending_limit": f"Нельзя создать больше {MAX_PENDING_PER_CLIENT} активных записей",
+    "slot_taken": "Это время только что заняли — выберите другое",
+    "bad_time": "Некорректное время записи",
+}
+
+def _store_new_booking(booking: dict, notify: bool) -> Dict[str, Any]:
+    """Reserve locally (compare-and-set on the masseur's time) and notify the masseur."""
+    stored, reason = booking_store.reserve_booking(booking, max_pending=MAX_PENDING_PER_CLIENT)
+    if not stored:
+        return {"ok": False, "reason": reason, "message": RESERVE_REFUSALS.get(reason, reason)}
     booking_id = booking.get("id")
     errors = []
-    if sb_req:
+    if notify:
         try:
             from core.notifier import notify_booking_created
-            notify_booking_created(client_chat_id, masseur_chat_id, service_name, slot_date, start_time, client_username, booking_id)
+            notify_booking_created(booking["client_chat_id"], booking["masseur_chat_id"], booking["service_name"],
+                                   booking["slot_date"], booking["start_time"], booking["client_username"], booking_id)
         except Exception as e:
             logger.warning(f"Notify create failed: {e}")
             errors.append("notify")
     if errors:
         booking["_errors"] = errors
-    return booking
+    return {"ok": True, "reason": "created", "booking": booking}
+
+def _mirror_new_booking(booking: dict):
+    """Queue the Supabase copy of a new booking (same id as the local one)."""
+    row = {k: v for k, v in booking.items() if not k.startswith("_")}
+    sb_outbox.enqueue("POST", "bookings?on_conflict=id", row, prefer="resolution=merge-duplicates",
+                      entity=f"booking:{booking['id']}")
+
+def _commit_new_booking(booking: dict, sb_on: bool) -> Dict[str, Any]:
+    result = _store_new_booking(booking, notify=sb_on)
+    if result["ok"]:
+        booking_scheduler.on_booking(result["booking"])
+        if sb_on:
+            _mirror_new_booking(result["booking"])
+    else:
+        logger.info(f"Booking refused for client {booking.get('client_chat_id')} "
+                       f"({booking.get('masseur_chat_id')} {booking.get('slot_date')} {booking.get('start_time')}): {result['reason']}")
+    return result
+
+def reserve_booking(client_chat_id: int, masseur_chat_id: int,
+                    slot_date: str, start_time: str, duration_min: int = 60,
+                    service_name: str = "", note: str = "",
+                    is_first_visit: bool = False,
+                    client_username: str = "") -> Dict[str, Any]:
+    """Create a pending booking if the time is still free. Returns {ok, reason, message?, booking?}.
+
+    reason: created | slot_taken | pending_limit | bad_time. Concurrent
+    requests for the same time get exactly one "created".
+    """
+    sb_req, _ = _init_sb()
+    booking = _new_booking(client_chat_id, masseur_chat_id, slot_date, start_time, duration_min,
+                           service_name, note, is_first_visit, client_username)
+    return _commit_new_booking(booking, bool(sb_req))
+
+def create_booking(client_chat_id: int, masseur_chat_id: int,
+                   slot_date: str, start_time: str, duration_min: int = 60,
+                   service_name: str = "", note: str = "",
+                   is_first_visit: bool = False,
+                   client_username: str = "") -> Optional[Dict[str, Any]]:
+    """Create a new booking (status: pending). Returns None if the time is taken or limit exceeded."""
+    return reserve_booking(client_chat_id, masseur_chat_id, slot_date, start_time, duration_min,
+                           service_name, note, is_first_visit, client_username).get("booking")
+
+def _confirm_local(booking_id: int) -> bool:
+    b = booking_store.update_booking(booking_id, {"status": "confirmed", "confirmed_at": time.time()},
+                                     if_status="pending")
+    booking_scheduler.on_booking(b)
+    if b:
+        try:
+            from core.notifier import notify_booking_confirmed
+            notify_booking_confirmed(b.get("client_chat_id"), b.get("masseur_chat_id"), b.get("slot_date"), b.get("start_time"))
+        except Exception as e:
+            logger.warning(f"Notify confirm failed: {e}")
+        return True
+    return False
+
+def _confirm_path(booking_id: int) -> str:
+    """Conditional PATCH: Supabase only confirms a booking that is still pending."""
+    return f"bookings?id=eq.{booking_id}&status=eq.pending"
+
+def _mirror_confirm(booking_id: int):
+    """Queue the Supabase side of a confirmation — after the booking's own insert (same entity)."""
+    sb_outbox.enqueue("PATCH", _confirm_path(booking_id),
+                      {"status": "confirmed", "confirmed_at": datetime.utcnow().isoformat()},
+                      entity=f"booking:{booking_id}")
+
+def _confirm(booking_id: int, sb_on: bool) -> bool:
+    if not _confirm_local(booking_id):
+        return False
+    if sb_on:
+        _mirror_confirm(booking_id)
+    return True
 
 def confirm_booking(booking_id: int) -> bool:
     """Confirm a pending booking."""
-    sb_req, sb_query = _init_sb()
-    if sb_req:
-        sb_req("PATCH", f"bookings?id=eq.{booking_id}", {"status": "confirmed", "confirmed_at": datetime.utcnow().isoformat()})
-        b = sb_query("bookings", {"id": f"eq.{booking_id}"})
-        if isinstance(b, list) and b:
-            slot = b[0]
-            sb_req("PATCH", f"time_slots?id=eq.{slot.get('slot_id', 0)}", {"status": "booked"})
-    bookings = _load_json(BOOKINGS_PATH)
-    for b in bookings:
-        if b.get("id") == booking_id:
-            b["status"] = "confirmed"
-            b["confirmed_at"] = time.time()
-            _save_json(BOOKINGS_PATH, bookings)
-            try:
-                from core.notifier import notify_booking_confirmed
-                notify_booking_confirmed(b.get("client_chat_id"), b.get("masseur_chat_id"), b.get("slot_date"), b.get("start_time"))
-            except Exception as e:
-                logger.warning(f"Notify confirm failed: {e}")
-            return True
-    return False
+    sb_req, _ = _init_sb()
+    return _confirm(booking_id, bool(sb_req))
+
+def _cancel_refusal(bk: dict, m_settings) -> Optional[dict]:
+    """Why a Supabase booking can't be cancelled (None → go ahead)."""
+    if bk.get("status") == "cancelled":
+        return {"ok": False, "reason": "already_cancelled", "message": "Уже отменено"}
+    deadline = DEFAULT_CANCEL_DEADLINE_MIN
+    if isinstance(m_settings, list) and m_settings:
+        deadline = m_settings[0].get("cancel_deadline_min", DEFAULT_CANCEL_DEADLINE_MIN)
+    created = bk.get("created_at", "")
+    if created and isinstance(created, str):
+        try:
+            from datetime import datetime, timezone
+            created_dt = datetime.fromisoformat(created.replace("Z", "+00:00"))
+            if (datetime.now(timezone.utc) - created_dt).total_seconds() / 60 > deadline:
+                return {"ok": False, "reason": "past_deadline", "can_cancel": False, "message": f"Отмена недоступна — до сеанса меньше {deadline} мин. Позвоните массажисту."}
+        except:
+            pass
+    return None
+
+def _cancel_local(booking_id: int, cancelled_by: str) -> dict:
+    b = booking_store.get_booking(booking_id)
+    if b:
+        if b.get("status") == "cancelled":
+            return {"ok": False, "reason": "already_cancelled", "message": "Уже отменено"}
+        b = booking_store.update_booking(booking_id, {
+            "status": "cancelled", "cancelled_by": cancelled_by, "cancelled_at": time.time(),
+        })
+        booking_scheduler.on_booking(b)
+        try:
+            from core.notifier import notify_booking_cancelled
+            notify_booking_cancelled(b.get("client_chat_id"), b.get("masseur_chat_id"), b.get("slot_date"), b.get("start_time"), cancelled_by)
+        except Exception as e:
+            logger.warning(f"Notify cancel failed: {e}")
+        return {"ok": True, "reason": "cancelled", "message": "Запись отменена"}
+    return {"ok": False, "reason": "not_found", "message": "Запись не найдена"}
+
+def _mirror_cancel(bk: dict, cancelled_by: str):
+    """Queue the Supabase side of a cancellation (the slot frees itself: it is computed)."""
+    sb_outbox.enqueue("PATCH", f"bookings?id=eq.{bk['id']}&status=in.(pending,confirmed)",
+                      {"status": "cancelled", "cancelled_by": cancelled_by, "cancelled_at": datetime.utcnow().isoformat()},
+                      entity=f"booking:{bk['id']}")
+
+def _cancel_mirrored(bk: dict, cancelled_by: str) -> dict:
+    """Cancel a booking read from Supabase: local copy now, Supabase via the outbox."""
+    b = booking_store.update_booking(bk["id"], {"status": "cancelled", "cancelled_by": cancelled_by, "cancelled_at": time.time()})
+    booking_scheduler.on_booking(b)
+    _mirror_cancel(bk, cancelled_by)
+    return {"ok": True, "reason": "cancelled", "message": "Запись отменена"}
 
 def cancel_booking(booking_id: int, cancelled_by: str = "client") -> dict:
     """Cancel a booking. Returns {ok, reason, can_cancel}."""
@@ -354,257 +390,101 @@ def cancel_booking(booking_id: int, cancelled_by: str = "client") -> dict:
         b = sb_query("bookings", {"id": f"eq.{booking_id}"})
         if isinstance(b, list) and b:
             bk = b[0]
-            if bk.get("status") == "cancelled":
-                return {"ok": False, "reason": "already_cancelled", "message": "Уже отменено"}
-            deadline = DEFAULT_CANCEL_DEADLINE_MIN
-            m_settings = sb_query("masseur_settings", {"chat_id": f"eq.{bk['masseur_chat_id']}"})
-            if isinstance(m_settings, list) and m_settings:
-                deadline = m_settings[0].get("cancel_deadline_min", DEFAULT_CANCEL_DEADLINE_MIN)
-            created = bk.get("created_at", "")
-            if created and isinstance(created, str):
-                try:
-                    from datetime import datetime, timezone
-                    created_dt = datetime.fromisoformat(created.replace("Z", "+00:00"))
-                    if (datetime.now(timezone.utc) - created_dt).total_seconds() / 60 > deadline:
-                        return {"ok": False, "reason": "past_deadline", "can_cancel": False, "message": f"Отмена недоступна — до сеанса меньше {deadline} мин. Позвоните массажисту."}
-                except:
-                    pass
-            sb_req("PATCH", f"bookings?id=eq.{booking_id}", {"status": "cancelled", "cancelled_by": cancelled_by, "cancelled_at": datetime.utcnow().isoformat()})
-            slot_id = bk.get("slot_id")
-            if slot_id:
-                sb_req("PATCH", f"time_slots?id=eq.{slot_id}", {"status": "free", "client_chat_id": None, "booking_id": None})
-            return {"ok": True, "reason": "cancelled", "message": "Запись отменена"}
-    bookings = _load_json(BOOKINGS_PATH)
-    for b in bookings:
-        if b.get("id") == booking_id:
-            if b.get("status") == "cancelled":
-                return {"ok": False, "reason": "already_cancelled", "message": "Уже отменено"}
-            b["status"] = "cancelled"
-            b["cancelled_by"] = cancelled_by
-            b["cancelled_at"] = time.time()
-            _save_json(BOOKINGS_PATH, bookings)
-            try:
-                from core.notifier import notify_booking_cancelled
-                notify_booking_cancelled(b.get("client_chat_id"), b.get("masseur_chat_id"), b.get("slot_date"), b.get("start_time"), cancelled_by)
-            except Exception as e:
-                logger.warning(f"Notify cancel failed: {e}")
-            return {"ok": True, "reason": "cancelled", "message": "Запись отменена"}
-    return {"ok": False, "reason": "not_found", "message": "Запись не найдена"}
+            m_settings = None
+            if bk.get("status") != "cancelled":
+                m_settings = sb_query("masseur_settings", {"chat_id": f"eq.{bk['masseur_chat_id']}"})
+            refusal = _cancel_refusal(bk, m_settings)
+            if refusal:
+                return refusal
+            return _cancel_mirrored(bk, cancelled_by)
+    return _cancel_local(booking_id, cancelled_by)
+
+def _bookings_params(for_chat_id: int, by_masseur: bool, status: str, limit: int) -> dict:
+    key = "masseur_chat_id" if by_masseur else "client_chat_id"
+    params = {key: f"eq.{for_chat_id}"}
+    if status:
+        params["status"] = f"eq.{status}"
+    params["order"] = "created_at.desc"
+    params["limit"] = str(limit)
+    return params
+
+def _bookings_local(for_chat_id: int, by_masseur: bool, status: str, limit: int) -> List[Dict[str, Any]]:
+    filters = {}
+    if for_chat_id:
+        filters["masseur_chat_id" if by_masseur else "client_chat_id"] = for_chat_id
+    return booking_store.get_bookings(status=status or None, limit=limit, **filters)
 
 def get_bookings(for_chat_id: int = None, by_masseur: bool = False,
                  status: str = None, limit: int = 50) -> List[Dict[str, Any]]:
     """Get bookings for a client or masseur."""
     sb_req, sb_query = _init_sb()
     if sb_req:
-        key = "masseur_chat_id" if by_masseur else "client_chat_id"
-        params = {key: f"eq.{for_chat_id}"}
-        if status:
-            params["status"] = f"eq.{status}"
-        params["order"] = "created_at.desc"
-        params["limit"] = str(limit)
-        result = sb_query("bookings", params)
+        result = sb_query("bookings", _bookings_params(for_chat_id, by_masseur, status, limit))
         if isinstance(result, list) and result:
-            sb_result = result
             return result
-    bookings = _load_json(BOOKINGS_PATH)
-    result = bookings
-    if for_chat_id:
-        key = "masseur_chat_id" if by_masseur else "client_chat_id"
-        result = [b for b in result if b.get(key) == for_chat_id]
-    if status:
-        result = [b for b in result if b.get("status") == status]
-    return sorted(result, key=lambda x: x.get("created_at", 0), reverse=True)[:limit]
+    return _bookings_local(for_chat_id, by_masseur, status, limit)
 
 
 def get_masseur_slots(masseur_id: int, slot_date: str) -> List[Dict[str, Any]]:
     """Get ALL slots for a masseur on a date with status and booking info."""
-    slots = _load_json(SLOTS_PATH)
-    bookings = _load_json(BOOKINGS_PATH)
-    booking_map = {}
-    for b in bookings:
-        bid = b.get("id") or b.get("booking_id")
-        if bid:
-            booking_map[bid] = b
+    view = availability.day(masseur_id, slot_date)
+    bookings = {b["id"]: b for _, _, b in view["busy"]}
     result = []
-    for s in slots:
-        if s.get("masseur_chat_id") == masseur_id and s.get("slot_date") == slot_date:
-            bid = s.get("booking_id", 0)
-            status = s.get("status", "free")
-            entry = {
-                "start_time": s["start_time"],
-                "duration_min": s.get("duration_min", 30),
-                "status": status,
-                "booking_id": bid,
-            }
-            if bid and bid in booking_map:
-                entry["service_name"] = booking_map[bid].get("service_name", "—")
-                entry["client_chat_id"] = booking_map[bid].get("client_chat_id")
-            result.append(entry)
-    result.sort(key=lambda x: x["start_time"])
+    for s in availability.day_slots(masseur_id, slot_date, include_past=True, day_view=view):
+        bid = s.get("booking_id") or 0
+        entry = {
+            "start_time": s["start_time"],
+            "duration_min": s["duration_min"],
+            "status": s["status"],
+            "booking_id": bid,
+        }
+        if bid and bid in bookings:
+            entry["service_name"] = bookings[bid].get("service_name", "—")
+            entry["client_chat_id"] = bookings[bid].get("client_chat_id")
+        result.append(entry)
     return result
 
 
-# ──────────────────── Workload ────────────────────
-
 # ──────────────────── Auto-Cancel & Reminders ────────────────────
-
-def get_auto_cancel_candidates(now: datetime = None) -> List[Dict]:
-    """Return list of pending bookings where session starts <= 60 min from now."""
-    if now is None:
-        now = datetime.now()
-    bookings = _load_json(BOOKINGS_PATH)
-    candidates = []
-    for b in bookings:
-        if b.get("status") != "pending":
-            continue
-        sd = b.get("slot_date", "")
-        st = b.get("start_time", "")
-        try:
-            dt = datetime.strptime(f"{sd} {st}", "%Y-%m-%d %H:%M")
-        except (ValueError, TypeError):
-            continue
-        minutes_until = (dt - now).total_seconds() / 60
-        if 0 <= minutes_until <= 60:
-            candidates.append(b)
-    return candidates
-
-
-def auto_cancel_expired_pending() -> List[Dict]:
-    """Auto-cancel pending bookings where session <=60 min away. Returns cancelled list."""
-    candidates = get_auto_cancel_candidates()
-    if not candidates:
-        return []
-    bookings = _load_json(BOOKINGS_PATH)
-    cancelled = []
-    changed = False
-    cb_ids = {b.get("id") for b in candidates}
-    for b in bookings:
-        if b.get("id") in cb_ids and b.get("status") == "pending":
-            b["status"] = "cancelled"
-            b["cancelled_by"] = "auto"
-            b["cancelled_at"] = time.time()
-            b["cancel_reason"] = "Массажист не подтвердил запись"
-            cancelled.append(b)
-            changed = True
-    if changed:
-        _save_json(BOOKINGS_PATH, bookings)
-        # Try to notify client + free slot in Supabase
-        sb_req, sb_query = _init_sb()
-        for c in cancelled:
-            try:
-                from core.notifier import notify_auto_cancel
-                notify_auto_cancel(
-                    c.get("client_chat_id"), c.get("masseur_chat_id"),
-                    c.get("slot_date"), c.get("start_time"),
-                    c.get("service_name", "")
-                )
-            except Exception as e:
-                logger.warning(f"Auto-cancel notify failed: {e}")
-            if sb_req:
-                try:
-                    bid = c.get("id")
-                    sb_req("PATCH", f"bookings?id=eq.{bid}", {
-                        "status": "cancelled", "cancelled_by": "auto",
-                        "cancelled_at": datetime.utcnow().isoformat()
-                    })
-                    sb_req("PATCH",
-                        f"time_slots?masseur_chat_id=eq.{c['masseur_chat_id']}"
-                        f"&slot_date=eq.{c['slot_date']}"
-                        f"&start_time=eq.{c['start_time']}"
-                        f"&duration_min=eq.{c.get('duration_min', 60)}",
-                        {"status": "free", "client_chat_id": None, "booking_id": None}
-                    )
-                except Exception as e:
-                    logger.warning(f"Auto-cancel supabase failed: {e}")
-        logger.info(f"Auto-cancelled {len(cancelled)} pending bookings")
-    return cancelled
-
-
-def get_pending_reminder_candidates(now: datetime = None) -> List[Dict]:
-    """Return pending bookings where session is ~3h away (175-190 min window)."""
-    if now is None:
-        now = datetime.now()
-    bookings = _load_json(BOOKINGS_PATH)
-    candidates = []
-    for b in bookings:
-        if b.get("status") != "pending":
-            continue
-        sd = b.get("slot_date", "")
-        st = b.get("start_time", "")
+# Driven by core.booking_scheduler at each booking's due time.
+
+def auto_cancel_booking(booking_id: int) -> Optional[Dict]:
+    """Auto-cancel one booking if it is still pending. Returns it, or None if it changed meanwhile."""
+    b = booking_store.update_booking(booking_id, {
+        "status": "cancelled",
+        "cancelled_by": "auto",
+        "cancelled_at": time.time(),
+        "cancel_reason": "Массажист не подтвердил запись",
+    }, if_status="pending")
+    if not b:
+        return None
+    # Notify client; the Supabase side goes via the outbox
+    try:
+        from core.notifier import notify_auto_cancel
+        notify_auto_cancel(
+            b.get("client_chat_id"), b.get("masseur_chat_id"),
+            b.get("slot_date"), b.get("start_time"),
+            b.get("service_name", "")
+        )
+    except Exception as e:
+        logger.warning(f"Auto-cancel notify failed: {e}")
+    sb_req, _ = _init_sb()
+    if sb_req:
         try:
-            dt = datetime.strptime(f"{sd} {st}", "%Y-%m-%d %H:%M")
-        except (ValueError, TypeError):
-            continue
-        minutes_until = (dt - now).total_seconds() / 60
-        if 175 <= minutes_until <= 190:
-            candidates.append(b)
-    return candidates
-
-
-def get_just_after_0900(now: datetime = None) -> bool:
-    """Check if current time is between 09:00 and 09:05."""
-    if now is None:
-        now = datetime.now()
-    return now.hour == 9 and now.minute < 5
-
-
-_MORNING_DIGEST_SENT_DATE = None
-
-
-def should_send_morning_digest(now: datetime = None) -> bool:
-    """Returns True once per day at ~09:00."""
-    global _MORNING_DIGEST_SENT_DATE
-    if now is None:
-        now = datetime.now()
-    if get_just_after_0900(now):
-        today = now.date().isoformat()
-        if _MORNING_DIGEST_SENT_DATE != today:
-            _MORNING_DIGEST_SENT_DATE = today
-            return True
-    return False
-
-
-def reset_morning_digest_for_test():
-    global _MORNING_DIGEST_SENT_DATE
-    _MORNING_DIGEST_SENT_DATE = None
+            _mirror_cancel(b, "auto")
+        except Exception as e:
+            logger.warning(f"Auto-cancel outbox failed: {e}")
+    return b
 
 
-def get_pending_bookings_grouped_by_masseur() -> Dict[int, List[Dict]]:
-    """Return all pending bookings grouped by masseur chat_id."""
-    bookings = _load_json(BOOKINGS_PATH)
-    result = {}
-    for b in bookings:
-        if b.get("status") != "pending":
-            continue
-        mid = b.get("masseur_chat_id")
-        if mid not in result:
-            result[mid] = []
-        result[mid].append(b)
-    return result
+def mark_reminded(booking_id: int) -> Optional[Dict]:
+    """Record that the masseur was reminded (None if the booking is no longer pending)."""
+    return booking_store.update_booking(booking_id, {"reminder_sent_at": time.time()}, if_status="pending")
 
 
-def get_workload(masseur_chat_id: int, week_start: str = None) -> Dict[str, Any]:
-    """Get workload stats for a masseur for a given week."""
-    sb_req, sb_query = _init_sb()
-    slots_today = slots_week = booked_today = booked_week = 0
-    today = date.today().isoformat()
-
-    if sb_req:
-        all_slots = sb_query("time_slots", {"masseur_chat_id": f"eq.{masseur_chat_id}"})
-        if isinstance(all_slots, list):
-            slots_week = len(all_slots)
-            slots_today = len([s for s in all_slots if s.get("slot_date") == today])
-            booked_week = len([s for s in all_slots if s.get("status") in ("booked", "reserved")])
-            booked_today = len([s for s in all_slots if s.get("slot_date") == today and s.get("status") in ("booked", "reserved")])
-
-    slots = _load_json(SLOTS_PATH)
-    m_slots = [s for s in slots if s.get("masseur_chat_id") == masseur_chat_id]
-    if not sb_req:
-        slots_week = len(m_slots)
-        slots_today = len([s for s in m_slots if s.get("slot_date") == today])
-        booked_week = len([s for s in m_slots if s.get("status") in ("booked", "reserved")])
-        booked_today = len([s for s in m_slots if s.get("slot_date") == today and s.get("status") in ("booked", "reserved")])
+# ──────────────────── Workload ────────────────────
 
+def _workload_result(slots_today: int, slots_week: int, booked_today: int, booked_week: int) -> Dict[str, Any]:
     pct = (booked_week / slots_week * 100) if slots_week > 0 else 0
     level = "low" if pct < 50 else ("medium" if pct < 80 else "high")
     level_label = {"low": "🟢 Низкая", "medium": "🟡 Средняя", "high": "🔴 Высокая"}
@@ -617,3 +497,159 @@ def get_workload(masseur_chat_id: int, week_start: str = None) -> Dict[str, Any]
         "load_level": level,
         "load_label": level_label[level],
     }
+
+def _week_bounds(today: str, week_start: str = None) -> tuple:
+    """(first, last) day of the week: from week_start as given, else Monday of
+    the week containing today (the masseur's date, availability.today)."""
+    try:
+        first = date.fromisoformat(week_start) if week_start else None
+    except ValueError:
+        first = None
+    if first is None:
+        day = date.fromisoformat(today)
+        first = day - timedelta(days=day.weekday())
+    return first, first + timedelta(days=6)
+
+# (masseur, week_start, weeks, today) → (bookings_rev, schedules version, result)
+_workload_cache: Dict[tuple, tuple] = {}
+
+def get_workload(masseur_chat_id: int, week_start: str = None, weeks: int = 0) -> Dict[str, Any]:
+    """Workload of a masseur for one week (+ `weeks` weeks of trend ending with it).
+
+    Counts come from the per-day booking aggregates (booking_store.day_stats,
+    updated with every booking write) in one range query; the result is kept
+    until a booking or the masseur's schedule changes, so repeated dashboard
+    reads are a dict lookup.
+    """
+    today = availability.today(masseur_chat_id)
+    first, last = _week_bounds(today, week_start)
+    key = (masseur_chat_id, first.isoformat(), weeks, today)
+    version = (booking_store.bookings_rev(), availability.schedules_version())
+    hit = _workload_cache.get(key)
+    if hit and hit[0] == version:
+        return hit[1]
+
+    trend_first = first - timedelta(weeks=max(weeks - 1, 0))
+    lo, hi = min(trend_first.isoformat(), today), max(last.isoformat(), today)
+    stats = booking_store.get_day_stats(masseur_chat_id, lo, hi)
+    sched = availability.schedule(masseur_chat_id)
+
+    def counts(day_str):
+        busy = stats[day_str]["busy"] if day_str in stats else []
+        return availability.day_counts(sched, busy, day_str, include_past=True)
+
+    def week_totals(start: date) -> tuple:
+        days = [counts(d) for d in _date_range(start.isoformat(), 7)]
+        return sum(c["total"] for c in days), sum(c["booked"] for c in days)
+
+    slots_week, booked_week = week_totals(first)
+    c_today = counts(today)
+    result = _workload_result(c_today["total"], slots_week, c_today["booked"], booked_week)
+    result["week_start"], result["week_end"] = first.isoformat(), last.isoformat()
+    if weeks > 0:
+        result["trend"] = []
+        for i in range(weeks):
+            ws = trend_first + timedelta(weeks=i)
+            total, booked = week_totals(ws)
+            result["trend"].append({"week_start": ws.isoformat(), "slots": total, "booked": booked,
+                                    "load_pct": round(booked / total * 100, 0) if total else 0})
+    if len(_workload_cache) > 500:
+        _workload_cache.clear()
+    _workload_cache[key] = (version, result)
+    return result
+
+
+# ──────────────────── Async variants (FastAPI) ────────────────────
+# Same logic as the sync functions above, but Supabase I/O is awaited via
+# core.supabase_async, and blocking notifier calls and local store reads
+# (slot computation, workload) run in a thread, so the web event loop is
+# never held by a slow request.
+
+async def _init_sb_async() -> bool:
+    """Is Supabase on? (the one-time availability check runs in a thread)"""
+    if not _sb_checked:
+        await asyncio.to_thread(_init_sb)
+    return _sb_req_fn is not None
+
+def _sb_async():
+    from core import supabase_async
+    return supabase_async._sb_req, supabase_async.query
+
+async def get_available_masseurs_async() -> List[Dict[str, Any]]:
+    if await _init_sb_async():
+        _, sb_query = _sb_async()
+        masseurs = await sb_query("masseur_settings")
+        if isinstance(masseurs, list) and masseurs:
+            return _masseurs_from_sb(masseurs)
+    return await asyncio.to_thread(_masseurs_local)
+
+async def get_free_slots_async(masseur_chat_id: int, slot_date: str = None, tz_offset: int = None,
+                               duration: int = None) -> List[Dict[str, Any]]:
+    return await asyncio.to_thread(get_free_slots, masseur_chat_id, slot_date, tz_offset, duration)
+
+async def find_earliest_slots_async(duration: int = None, time_from: str = None, time_to: str = None,
+                                    specialties: List[str] = None, days: int = 14, limit: int = 5,
+                                    mode: str = "earliest", start_date: str = None,
+                                    tz_offset: int = None) -> List[Dict[str, Any]]:
+    return await asyncio.to_thread(find_earliest_slots, duration, time_from, time_to, specialties,
+                                   days, limit, mode, start_date, tz_offset)
+
+async def get_all_slots_for_client_async(masseur_chat_id: int, slot_date: str, tz_offset: int = None) -> List[Dict[str, Any]]:
+    return await asyncio.to_thread(get_all_slots_for_client, masseur_chat_id, slot_date, tz_offset)
+
+async def get_booked_slots_for_month_async(masseur_chat_id: int, year: int, month: int, tz_offset: int = None) -> dict:
+    if await _init_sb_async() and not await asyncio.to_thread(booking_store.has_bookings):
+        _, sb_query = _sb_async()
+        stats = _month_stats_from_rows(await sb_query("bookings", _month_params(masseur_chat_id, year, month)))
+        return await asyncio.to_thread(_month_day_map, masseur_chat_id, year, month, stats)
+    return await asyncio.to_thread(get_booked_slots_for_month, masseur_chat_id, year, month, tz_offset)
+
+async def get_bookings_async(for_chat_id: int = None, by_masseur: bool = False,
+                             status: str = None, limit: int = 50) -> List[Dict[str, Any]]:
+    if await _init_sb_async():
+        _, sb_query = _sb_async()
+        result = await sb_query("bookings", _bookings_params(for_chat_id, by_masseur, status, limit))
+        if isinstance(result, list) and result:
+            return result
+    return await asyncio.to_thread(_bookings_local, for_chat_id, by_masseur, status, limit)
+
+async def reserve_booking_async(client_chat_id: int, masseur_chat_id: int,
+                                slot_date: str, start_time: str, duration_min: int = 60,
+                                service_name: str = "", note: str = "",
+                                is_first_visit: bool = False,
+                                client_username: str = "") -> Dict[str, Any]:
+    booking = _new_booking(client_chat_id, masseur_chat_id, slot_date, start_time, duration_min,
+                           service_name, note, is_first_visit, client_username)
+    sb_on = await _init_sb_async()
+    return await asyncio.to_thread(_commit_new_booking, booking, sb_on)
+
+async def create_booking_async(client_chat_id: int, masseur_chat_id: int,
+                               slot_date: str, start_time: str, duration_min: int = 60,
+                               service_name: str = "", note: str = "",
+                               is_first_visit: bool = False,
+                               client_username: str = "") -> Optional[Dict[str, Any]]:
+    result = await reserve_booking_async(client_chat_id, masseur_chat_id, slot_date, start_time, duration_min,
+                                         service_name, note, is_first_visit, client_username)
+    return result.get("booking")
+
+async def confirm_booking_async(booking_id: int) -> bool:
+    sb_on = await _init_sb_async()
+    return await asyncio.to_thread(_confirm, booking_id, sb_on)
+
+async def cancel_booking_async(booking_id: int, cancelled_by: str = "client") -> dict:
+    if await _init_sb_async():
+        _, sb_query = _sb_async()
+        b = await sb_query("bookings", {"id": f"eq.{booking_id}"})
+        if isinstance(b, list) and b:
+            bk = b[0]
+            m_settings = None
+            if bk.get("status") != "cancelled":
+                m_settings = await sb_query("masseur_settings", {"chat_id": f"eq.{bk['masseur_chat_id']}"})
+            refusal = _cancel_refusal(bk, m_settings)
+            if refusal:
+                return refusal
+            return await asyncio.to_thread(_cancel_mirrored, bk, cancelled_by)
+    return await asyncio.to_thread(_cancel_local, booking_id, cancelled_by)
+
+async def get_workload_async(masseur_chat_id: int, week_start: str = None, weeks: int = 0) -> Dict[str, Any]:
+    return await asyncio.to_thread(get_workload, masseur_chat_id, week_start, weeks)
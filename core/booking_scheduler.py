@@ -0,0 +1,262 @@
+"""Due-time scheduler for booking housekeeping (bot process).
+
+A heap of (due_ts, job) replaces the once-a-minute scans over every
+booking:
+  auto_cancel — pending booking not confirmed AUTO_CANCEL_BEFORE_MIN before start
+  reminder    — masseur reminder REMINDER_BEFORE_MIN before start
+  digest      — morning digest of pending bookings at DIGEST_HOUR salon time (SALON_TZ)
+
+Jobs come from booking events in this process (on_booking) and from the
+booking store itself: when its bookings_rev counter moves (the web process
+wrote something) the pending bookings are re-read and new or moved ones get
+jobs. After a restart the heap is rebuilt from pending bookings only.
+
+Each action fires once: jobs are re-checked against the stored booking
+when due (moved / confirmed / cancelled → dropped), auto-cancel and the
+reminder mark are conditional updates (status must still be pending),
+reminded bookings carry reminder_sent_at, and the digest date is kept in
+the store.
+"""
+import os
+import json
+import time
+import heapq
+import logging
+import itertools
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional, Dict, Any, List
+
+from core import booking_store, availability
+
+logger = logging.getLogger(__name__)
+
+DIGEST_HOUR = 9
+DIGEST_WINDOW_MIN = 5       # проспали дольше — дайджест за сегодня не шлём
+REMINDER_GRACE_MIN = 15     # как прежнее окно 175–190 мин
+MAX_SLEEP_SEC = 30          # как часто проверять bookings_rev
+
+# Планировщик живёт в процессе бота, /api/admin/db_status — в веб-процессе
+STATS_PATH = Path("data") / "scheduler_stats.json"
+
+_heap: List[tuple] = []
+_seq = itertools.count()
+_scheduled: Dict[int, float] = {}   # booking id → start_ts, под который стоят задачи
+_active = False
+_rev = None
+_stats = {"rebuilds": 0, "syncs": 0, "fired": {"auto_cancel": 0, "reminder": 0, "digest": 0},
+          "dropped": 0, "last_lag_sec": 0.0, "max_lag_sec": 0.0}
+
+
+def _start_ts(b: dict) -> Optional[float]:
+    """Session start as a timestamp (booking times are in the masseur's zone)."""
+    try:
+        local = datetime.strptime(f"{b.get('slot_date', '')} {str(b.get('start_time', ''))[:5]}",
+                                  "%Y-%m-%d %H:%M")
+    except (ValueError, TypeError):
+        return None
+    tz = availability.schedule(b.get("masseur_chat_id"))["tz"]
+    return (local.replace(tzinfo=tz) if tz is not None else local).timestamp()
+
+
+def _push(due: float, kind: str, booking_id: int = None, start: float = None):
+    heapq.heappush(_heap, (due, next(_seq), kind, booking_id, start))
+
+
+def _schedule_booking(b: dict, now: float):
+    from core.booking_manager import AUTO_CANCEL_BEFORE_MIN, REMINDER_BEFORE_MIN
+    start = _start_ts(b)
+    bid = b.get("id")
+    if start is None or bid is None or start <= now:
+        return
+    _scheduled[bid] = start
+    _push(start - AUTO_CANCEL_BEFORE_MIN * 60, "auto_cancel", bid, start)
+    if not b.get("reminder_sent_at") and now < start - (REMINDER_BEFORE_MIN - REMINDER_GRACE_MIN) * 60:
+        _push(start - REMINDER_BEFORE_MIN * 60, "reminder", bid, start)
+
+
+def _next_digest(now: float) -> float:
+    """Next DIGEST_HOUR:00 in the salon's zone, like the booking times around it."""
+    dt = datetime.fromtimestamp(now, availability.salon_tz()).replace(
+        hour=DIGEST_HOUR, minute=0, second=0, microsecond=0)
+    if dt.timestamp() + DIGEST_WINDOW_MIN * 60 <= now:
+        dt += timedelta(days=1)
+    return dt.timestamp()
+
+
+# ─── Feeding ───
+
+def rebuild(now: float = None):
+    """Start (or restart) the scheduler from the pending bookings in the store."""
+    global _active, _rev
+    now = now or time.time()
+    _heap.clear()
+    _scheduled.clear()
+    _rev = booking_store.bookings_rev()
+    for b in booking_store.get_bookings(status="pending", newest_first=False):
+        _schedule_booking(b, now)
+    _push(_next_digest(now), "digest")
+    _active = True
+    _stats["rebuilds"] += 1
+    logger.info(f"Booking scheduler: {len(_scheduled)} pending bookings, {len(_heap)} jobs")
+
+
+def _sync(now: float):
+    """Pick up bookings written by the other process (only when bookings_rev moved)."""
+    global _rev
+    rev = booking_store.bookings_rev()
+    if rev == _rev:
+        return
+    _rev = rev
+    pending = booking_store.get_bookings(status="pending", newest_first=False)
+    ids = set()
+    for b in pending:
+        ids.add(b.get("id"))
+        if _scheduled.get(b.get("id")) != _start_ts(b):
+            _schedule_booking(b, now)
+    for bid in [i for i in _scheduled if i not in ids]:
+        del _scheduled[bid]    # задачи в куче отсеются при срабатывании
+    _stats["syncs"] += 1
+
+
+def on_booking(b: Optional[dict]):
+    """Booking created/confirmed/cancelled in this process."""
+    if not _active or not b:
+        return
+    if b.get("status") == "pending":
+        if _scheduled.get(b.get("id")) != _start_ts(b):
+            _schedule_booking(b, time.time())
+    else:
+        _scheduled.pop(b.get("id"), None)
+
+
+# ─── Running ───
+
+def seconds_until_next(now: float = None) -> float:
+    now = now or time.time()
+    if not _heap:
+        return MAX_SLEEP_SEC
+    return max(0.0, min(MAX_SLEEP_SEC, _heap[0][0] - now))
+
+
+def _current(booking_id: int, start: float) -> Optional[dict]:
+    """The booking, if the job still applies to it (pending, same start time)."""
+    if _scheduled.get(booking_id) != start:
+        return None
+    b = booking_store.get_booking(booking_id)
+    if not b or b.get("status") != "pending" or _start_ts(b) != start:
+        return None
+    return b
+
+
+def _send_reminders(bookings: List[dict]):
+    from core.notifier import notify_pending_reminder
+    by_masseur = {}
+    for b in bookings:
+        mid = b.get("masseur_chat_id")
+        by_masseur[mid] = by_masseur.get(mid, 0) + 1
+    for mid, cnt in by_masseur.items():
+        try:
+            notify_pending_reminder(mid, cnt)
+            logger.info(f"⏰ Reminded masseur {mid} about {cnt} pending bookings")
+        except Exception as e:
+            logger.warning(f"Reminder notify to {mid} failed: {e}")
+
+
+def _send_digest(now: float, due: float) -> bool:
+    from core.notifier import notify_morning_digest
+    _push(_next_digest(max(now, due + DIGEST_WINDOW_MIN * 60)), "digest")
+    if now - due > DIGEST_WINDOW_MIN * 60:
+        return False
+    today = datetime.fromtimestamp(now, availability.salon_tz()).date().isoformat()
+    if not booking_store.set_meta("digest_sent_date", today):
+        return False  # уже отправлен (например, до перезапуска)
+    grouped = {}
+    for b in booking_store.get_bookings(status="pending", newest_first=False):
+        grouped[b.get("masseur_chat_id")] = grouped.get(b.get("masseur_chat_id"), 0) + 1
+    for mid, cnt in grouped.items():
+        try:
+            notify_morning_digest(mid, cnt)
+            logger.info(f"🌅 Morning digest to masseur {mid}: {cnt} pending")
+        except Exception as e:
+            logger.warning(f"Morning digest to {mid} failed: {e}")
+    _stats["fired"]["digest"] += 1
+    return True
+
+
+def run_due(now: float = None) -> Dict[str, int]:
+    """Fire every job whose time has come. Returns counts per action."""
+    from core.booking_manager import auto_cancel_booking, mark_reminded
+    if not _active:
+        rebuild(now)
+    now = now or time.time()
+    _sync(now)
+    done = {"auto_cancel": 0, "reminder": 0, "digest": 0}
+    reminders = []
+    while _heap and _heap[0][0] <= now:
+        due, _, kind, bid, start = heapq.heappop(_heap)
+        lag = now - due
+        if kind == "digest":
+            done["digest"] += _send_digest(now, due)
+            continue
+        if _current(bid, start) is None:
+            _stats["dropped"] += 1
+            continue
+        _stats["last_lag_sec"] = round(lag, 1)
+        _stats["max_lag_sec"] = round(max(_stats["max_lag_sec"], lag), 1)
+        if kind == "auto_cancel":
+            if now >= start:
+                _stats["dropped"] += 1  # сеанс уже начался — как и раньше, не трогаем
+                continue
+            if auto_cancel_booking(bid):
+                _scheduled.pop(bid, None)
+                done["auto_cancel"] += 1
+        elif kind == "reminder":
+            b = mark_reminded(bid)
+            if b:
+                reminders.append(b)
+    if reminders:
+        _send_reminders(reminders)
+        done["reminder"] = len(reminders)
+    for k in ("auto_cancel", "reminder"):
+        _stats["fired"][k] += done[k]
+    if done["auto_cancel"]:
+        logger.info(f"🧹 Auto-cancelled {done['auto_cancel']} bookings")
+    return done
+
+
+def stats() -> Dict[str, Any]:
+    """Queue depth, time to the next job and lag of fired jobs (this process)."""
+    now = time.time()
+    by_kind = {}
+    for _, _, kind, _, _ in _heap:
+        by_kind[kind] = by_kind.get(kind, 0) + 1
+    return {
+        "active": _active,
+        "queue_depth": len(_heap),
+        "by_kind": by_kind,
+        "tracked_bookings": len(_scheduled),
+        "next_due_in_sec": round(_heap[0][0] - now, 1) if _heap else None,
+        "overdue": sum(1 for due, *_ in _heap if due <= now),
+        **_stats,
+    }
+
+
+def publish_stats():
+    """Write stats() for the web process (atomic replace)."""
+    try:
+        tmp = STATS_PATH.with_suffix(".tmp")
+        tmp.write_text(json.dumps({**stats(), "published_at": time.time()}), encoding="utf-8")
+        os.replace(tmp, STATS_PATH)
+    except OSError as e:
+        logger.warning(f"Scheduler stats write failed: {e}")
+
+
+def read_stats() -> Dict[str, Any]:
+    """Last stats published by the bot process ({"active": False} if none)."""
+    try:
+        data = json.loads(STATS_PATH.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {"active": False}
+    data["age_sec"] = round(time.time() - data.pop("published_at", 0), 1)
+    return data
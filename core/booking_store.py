@@ -0,0 +1,489 @@
+"""Local storage engine for bookings.
+
+Single-file SQLite DB (data/bookings.db) in WAL mode, so the bot process and
+the web process can read concurrently while one of them writes. Full records
+are kept as JSON in the `data` column; the columns next to it exist only to be
+indexed and filtered on.
+
+bookings.json is an import/export format only: it is imported once into an
+empty DB and can be re-exported with export_json(). Free slots are not stored
+at all — core.availability computes them from schedules and bookings.
+"""
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Iterable, Tuple
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = Path("data")
+DATA_DIR.mkdir(parents=True, exist_ok=True)
+
+DB_PATH = DATA_DIR / "bookings.db"
+BOOKINGS_JSON_PATH = DATA_DIR / "bookings.json"
+
+SCHEMA_SQL = """
+-- слоты вычисляются (core.availability); старая таблица больше не нужна
+DROP TABLE IF EXISTS time_slots;
+
+CREATE TABLE IF NOT EXISTS bookings (
+  id INTEGER PRIMARY KEY,
+  client_chat_id INTEGER,
+  masseur_chat_id INTEGER,
+  slot_date TEXT DEFAULT '',
+  start_time TEXT DEFAULT '',
+  status TEXT DEFAULT 'pending',
+  created_at TEXT DEFAULT '',
+  data TEXT NOT NULL
+);
+
+-- Per masseur-day aggregate of active bookings, kept current by every
+-- booking write (month calendar reads it instead of scanning bookings)
+CREATE TABLE IF NOT EXISTS day_stats (
+  masseur_chat_id INTEGER NOT NULL,
+  slot_date TEXT NOT NULL,
+  pending INTEGER NOT NULL DEFAULT 0,
+  confirmed INTEGER NOT NULL DEFAULT 0,
+  busy TEXT NOT NULL DEFAULT '[]',
+  PRIMARY KEY (masseur_chat_id, slot_date)
+);
+
+-- When each client's / masseur's bookings last changed (calendar feed ETags)
+CREATE TABLE IF NOT EXISTS person_changes (
+  chat_id INTEGER PRIMARY KEY,
+  changed_at REAL NOT NULL
+);
+
+-- bookings_rev at which each masseur-day last changed (slot cache of core.availability)
+CREATE TABLE IF NOT EXISTS day_changes (
+  masseur_chat_id INTEGER NOT NULL,
+  slot_date TEXT NOT NULL,
+  rev INTEGER NOT NULL,
+  PRIMARY KEY (masseur_chat_id, slot_date)
+);
+
+CREATE TABLE IF NOT EXISTS store_meta (
+  key TEXT PRIMARY KEY,
+  value TEXT
+);
+
+CREATE INDEX IF NOT EXISTS idx_bookings_client ON bookings(client_chat_id);
+CREATE INDEX IF NOT EXISTS idx_bookings_masseur_date ON bookings(masseur_chat_id, slot_date);
+CREATE INDEX IF NOT EXISTS idx_bookings_status ON bookings(status);
+CREATE INDEX IF NOT EXISTS idx_day_changes_rev ON day_changes(rev);
+"""
+
+_local = threading.local()
+_init_lock = threading.Lock()
+_initialized_pid = None
+_writes = 0   # committed write transactions of this process
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(str(DB_PATH), timeout=15, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=15000")
+    return conn
+
+
+def _conn() -> sqlite3.Connection:
+    """Per-thread connection (re-opened after fork — web runs in a child process)."""
+    global _initialized_pid
+    pid = os.getpid()
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "pid", None) != pid:
+        conn = _connect()
+        _local.conn = conn
+        _local.pid = pid
+    if _initialized_pid != pid:
+        with _init_lock:
+            if _initialized_pid != pid:
+                conn.executescript(SCHEMA_SQL)
+                _import_json_once(conn)
+                _ensure_day_stats(conn)
+                _initialized_pid = pid
+    return conn
+
+
+class _tx:
+    """BEGIN IMMEDIATE … COMMIT: serializes writers across threads and processes."""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        global _writes
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        if not exc_type:
+            _writes += 1
+        return False
+
+
+def _dumps(d: dict) -> str:
+    return json.dumps(d, ensure_ascii=False, default=str)
+
+
+def _int_or_none(v):
+    try:
+        return int(v) if v is not None and v != "" else None
+    except (TypeError, ValueError):
+        return None
+
+
+# ──────────────────── Bookings ────────────────────
+
+def _booking_row(b: dict) -> tuple:
+    return (
+        _int_or_none(b.get("id")),
+        _int_or_none(b.get("client_chat_id")),
+        _int_or_none(b.get("masseur_chat_id")),
+        str(b.get("slot_date") or ""),
+        str(b.get("start_time") or "")[:5],
+        b.get("status") or "pending",
+        str(b.get("created_at") or ""),
+        _dumps(b),
+    )
+
+
+def get_bookings(client_chat_id: int = None, masseur_chat_id: int = None, status: str = None,
+                 slot_date: str = None, booking_ids: Iterable[int] = None,
+                 limit: int = None, newest_first: bool = True) -> List[Dict[str, Any]]:
+    """Return bookings matching all given filters, newest first by default."""
+    where, args = [], []
+    if client_chat_id is not None:
+        where.append("client_chat_id = ?")
+        args.append(client_chat_id)
+    if masseur_chat_id is not None:
+        where.append("masseur_chat_id = ?")
+        args.append(masseur_chat_id)
+    if status is not None:
+        where.append("status = ?")
+        args.append(status)
+    if slot_date is not None:
+        where.append("slot_date = ?")
+        args.append(slot_date)
+    if booking_ids is not None:
+        ids = [int(i) for i in booking_ids]
+        if not ids:
+            return []
+        where.append(f"id IN ({','.join('?' * len(ids))})")
+        args.extend(ids)
+    sql = "SELECT data FROM bookings"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY created_at DESC, id DESC" if newest_first else " ORDER BY created_at, id"
+    if limit:
+        sql += " LIMIT ?"
+        args.append(int(limit))
+    return [json.loads(r[0]) for r in _conn().execute(sql, args)]
+
+
+def get_bookings_between(date_from: str, date_to: str, active_only: bool = True) -> List[Dict[str, Any]]:
+    """All bookings with slot_date in [date_from, date_to] (active ones by default), one query."""
+    sql = "SELECT data FROM bookings WHERE slot_date BETWEEN ? AND ?"
+    args = [date_from, date_to]
+    if active_only:
+        sql += " AND status IN (?, ?)"
+        args += list(ACTIVE_STATUSES)
+    sql += " ORDER BY created_at, id"  # как get_bookings(newest_first=False)
+    return [json.loads(r[0]) for r in _conn().execute(sql, args)]
+
+
+def get_booking(booking_id: int) -> Optional[Dict[str, Any]]:
+    row = _conn().execute("SELECT data FROM bookings WHERE id = ?", (booking_id,)).fetchone()
+    return json.loads(row[0]) if row else None
+
+
+def _put_booking(conn: sqlite3.Connection, b: dict):
+    """Insert/replace one booking and refresh the day aggregates it touches."""
+    row = _booking_row(b)
+    old = conn.execute("SELECT masseur_chat_id, slot_date, client_chat_id FROM bookings WHERE id = ?",
+                       (row[0],)).fetchone()
+    conn.execute(
+        "INSERT OR REPLACE INTO bookings "
+        "(id, client_chat_id, masseur_chat_id, slot_date, start_time, status, created_at, data) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", row)
+    days = {(row[2], row[3])} | ({(old[0], old[1])} if old else set())
+    for mid, sd in days:
+        _refresh_day(conn, mid, sd)
+    people = {row[1], row[2]} | ({old[0], old[2]} if old else set())
+    conn.executemany("INSERT OR REPLACE INTO person_changes (chat_id, changed_at) VALUES (?, ?)",
+                     [(c, time.time()) for c in people if c is not None])
+    rev = _bump_rev(conn)
+    conn.executemany("INSERT OR REPLACE INTO day_changes (masseur_chat_id, slot_date, rev) VALUES (?, ?, ?)",
+                     [(mid, sd, rev) for mid, sd in days])
+
+
+def add_booking(booking: dict) -> dict:
+    conn = _conn()
+    with _tx(conn):
+        _put_booking(conn, booking)
+    return booking
+
+
+def update_booking(booking_id: int, changes: dict, if_status: str = None) -> Optional[Dict[str, Any]]:
+    """Apply `changes` to a booking. Returns the updated booking or None.
+
+    if_status: apply only if the booking still has this status (checked in
+    the same write transaction), e.g. auto-cancel must not undo a confirm.
+    """
+    conn = _conn()
+    with _tx(conn):
+        row = conn.execute("SELECT data FROM bookings WHERE id = ?", (booking_id,)).fetchone()
+        if not row:
+            return None
+        b = json.loads(row[0])
+        if if_status is not None and b.get("status") != if_status:
+            return None
+        b.update(changes)
+        _put_booking(conn, b)
+    return b
+
+
+def _free_booking_id(conn: sqlite3.Connection) -> int:
+    """Millisecond id as before, bumped past ids that already exist."""
+    bid = int(time.time() * 1000) % 10000000000
+    while conn.execute("SELECT 1 FROM bookings WHERE id = ?", (bid,)).fetchone():
+        bid += 1
+    return bid
+
+
+def reserve_booking(booking: dict, max_pending: int = None) -> Tuple[Optional[dict], str]:
+    """Insert a new booking only if its time is still free. Returns (booking, "") or (None, reason).
+
+    Check and insert run in one write transaction (BEGIN IMMEDIATE locks the
+    DB for both processes), so of two clients taking the same time exactly one
+    wins; the other gets "slot_taken". max_pending: refuse with
+    "pending_limit" if the client already has that many pending bookings.
+    The booking gets its id here.
+    """
+    try:
+        h, m = str(booking.get("start_time") or "")[:5].split(":")
+        start = int(h) * 60 + int(m)
+    except ValueError:
+        return None, "bad_time"
+    end = start + int(booking.get("duration_min") or 60)
+    conn = _conn()
+    with _tx(conn):
+        if max_pending is not None:
+            pending = conn.execute("SELECT COUNT(*) FROM bookings WHERE client_chat_id = ? AND status = 'pending'",
+                                   (booking.get("client_chat_id"),)).fetchone()[0]
+            if pending >= max_pending:
+                return None, "pending_limit"
+        row = conn.execute("SELECT busy FROM day_stats WHERE masseur_chat_id = ? AND slot_date = ?",
+                           (booking.get("masseur_chat_id"), booking.get("slot_date"))).fetchone()
+        if row and any(s < end and start < e for s, e in json.loads(row[0])):
+            return None, "slot_taken"
+        booking["id"] = _free_booking_id(conn)
+        _put_booking(conn, booking)
+    return booking, ""
+
+
+def replace_bookings(bookings: Iterable[dict]) -> int:
+    """Replace the whole bookings table (used by JSON import and Supabase restore)."""
+    rows = [_booking_row(b) for b in bookings]
+    conn = _conn()
+    with _tx(conn):
+        conn.execute("DELETE FROM bookings")
+        conn.executemany(
+            "INSERT OR REPLACE INTO bookings "
+            "(id, client_chat_id, masseur_chat_id, slot_date, start_time, status, created_at, data) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        _rebuild_day_stats(conn)
+        conn.execute("INSERT OR REPLACE INTO store_meta (key, value) VALUES ('people_reset_at', ?)",
+                     (str(time.time()),))
+        rev = _bump_rev(conn)
+        conn.execute("DELETE FROM day_changes")
+        conn.execute("INSERT OR REPLACE INTO store_meta (key, value) VALUES ('days_reset_rev', ?)", (str(rev),))
+    return len(rows)
+
+
+def _bump_rev(conn: sqlite3.Connection) -> int:
+    conn.execute("INSERT INTO store_meta (key, value) VALUES ('bookings_rev', '1') "
+                 "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1")
+    return int(conn.execute("SELECT value FROM store_meta WHERE key = 'bookings_rev'").fetchone()[0])
+
+
+def bookings_rev() -> int:
+    """Counter bumped by every booking write (lets the other process notice changes)."""
+    return int(get_meta("bookings_rev") or 0)
+
+
+def local_writes() -> int:
+    """Write transactions committed by this process (no DB access — a cheap "did I write?")."""
+    return _writes
+
+
+def days_changed_since(rev: int) -> Tuple[int, Optional[List[tuple]]]:
+    """(current bookings_rev, [(masseur_chat_id, slot_date)] changed after rev).
+
+    None instead of the list when the whole table was replaced after rev
+    (restore / import): every day counts as changed.
+    """
+    now = bookings_rev()  # сначала rev: всё, что до него, попадёт в выборку ниже
+    reset = get_meta("days_reset_rev")
+    if reset is not None and int(reset) > rev:
+        return now, None
+    rows = _conn().execute("SELECT masseur_chat_id, slot_date FROM day_changes WHERE rev > ?", (rev,)).fetchall()
+    return now, [tuple(r) for r in rows]
+
+
+def person_changed_at(chat_id: int) -> float:
+    """Last time a booking of this client/masseur changed (0 if never; a full replace counts for all)."""
+    conn = _conn()
+    row = conn.execute("SELECT changed_at FROM person_changes WHERE chat_id = ?", (chat_id,)).fetchone()
+    reset = conn.execute("SELECT value FROM store_meta WHERE key = 'people_reset_at'").fetchone()
+    return max(row[0] if row else 0.0, float(reset[0]) if reset else 0.0)
+
+
+def get_meta(key: str) -> Optional[str]:
+    row = _conn().execute("SELECT value FROM store_meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def set_meta(key: str, value: str) -> bool:
+    """Set a store_meta value. False if it already had this value (check-and-set, one transaction)."""
+    conn = _conn()
+    with _tx(conn):
+        if get_meta(key) == value:
+            return False
+        conn.execute("INSERT OR REPLACE INTO store_meta (key, value) VALUES (?, ?)", (key, value))
+    return True
+
+
+def has_bookings() -> bool:
+    return _conn().execute("SELECT 1 FROM bookings LIMIT 1").fetchone() is not None
+
+
+# ──────────────────── Day aggregates ────────────────────
+
+ACTIVE_STATUSES = ("pending", "confirmed")
+
+
+def day_busy(bookings: Iterable[dict]) -> Dict[str, Any]:
+    """Aggregate of one masseur-day: active booking counts + merged busy [start, end) minutes."""
+    counts = {s: 0 for s in ACTIVE_STATUSES}
+    spans = []
+    for b in bookings:
+        st = b.get("status")
+        if st not in counts:
+            continue
+        counts[st] += 1
+        try:
+            h, m = str(b.get("start_time") or "")[:5].split(":")
+            start = int(h) * 60 + int(m)
+        except ValueError:
+            continue
+        spans.append((start, start + int(b.get("duration_min") or 60)))
+    busy = []
+    for s, e in sorted(spans):
+        if busy and s <= busy[-1][1]:
+            busy[-1][1] = max(busy[-1][1], e)
+        else:
+            busy.append([s, e])
+    return {**counts, "busy": busy}
+
+
+def _refresh_day(conn: sqlite3.Connection, masseur_chat_id, slot_date: str):
+    rows = conn.execute(
+        "SELECT data FROM bookings WHERE masseur_chat_id = ? AND slot_date = ? AND status IN (?, ?)",
+        (masseur_chat_id, slot_date, *ACTIVE_STATUSES)).fetchall()
+    if not rows:
+        conn.execute("DELETE FROM day_stats WHERE masseur_chat_id = ? AND slot_date = ?",
+                     (masseur_chat_id, slot_date))
+        return
+    agg = day_busy(json.loads(r[0]) for r in rows)
+    conn.execute(
+        "INSERT OR REPLACE INTO day_stats (masseur_chat_id, slot_date, pending, confirmed, busy) "
+        "VALUES (?, ?, ?, ?, ?)",
+        (masseur_chat_id, slot_date, agg["pending"], agg["confirmed"], json.dumps(agg["busy"])))
+
+
+def _rebuild_day_stats(conn: sqlite3.Connection):
+    conn.execute("DELETE FROM day_stats")
+    days = conn.execute(
+        "SELECT DISTINCT masseur_chat_id, slot_date FROM bookings WHERE status IN (?, ?)",
+        ACTIVE_STATUSES).fetchall()
+    for mid, sd in days:
+        _refresh_day(conn, mid, sd)
+
+
+def _ensure_day_stats(conn: sqlite3.Connection):
+    """Build day_stats for a DB created before the table existed."""
+    if conn.execute("SELECT value FROM store_meta WHERE key = 'day_stats'").fetchone():
+        return
+    with _tx(conn):
+        _rebuild_day_stats(conn)
+        conn.execute("INSERT OR REPLACE INTO store_meta (key, value) VALUES ('day_stats', '1')")
+
+
+def get_day_stats(masseur_chat_id: int, date_from: str, date_to: str) -> Dict[str, Dict[str, Any]]:
+    """{slot_date: {pending, confirmed, busy}} for days with active bookings in [date_from, date_to]."""
+    rows = _conn().execute(
+        "SELECT slot_date, pending, confirmed, busy FROM day_stats "
+        "WHERE masseur_chat_id = ? AND slot_date BETWEEN ? AND ?",
+        (masseur_chat_id, date_from, date_to))
+    return {sd: {"pending": p, "confirmed": c, "busy": json.loads(busy)} for sd, p, c, busy in rows}
+
+
+def get_busy_index(date_from: str, date_to: str) -> Dict[tuple, list]:
+    """{(masseur_chat_id, slot_date): busy intervals} for all masseurs in one query."""
+    rows = _conn().execute(
+        "SELECT masseur_chat_id, slot_date, busy FROM day_stats WHERE slot_date BETWEEN ? AND ?",
+        (date_from, date_to))
+    return {(mid, sd): json.loads(busy) for mid, sd, busy in rows}
+
+
+# ──────────────────── JSON import / export ────────────────────
+
+def _read_json_list(path: Path) -> list:
+    if path.exists():
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+            return data if isinstance(data, list) else []
+        except (json.JSONDecodeError, OSError) as e:
+            logger.warning(f"Failed to load {path}: {e}")
+    return []
+
+
+def _import_json_once(conn: sqlite3.Connection):
+    """Import legacy JSON files into a fresh DB (only once per DB file)."""
+    done = conn.execute("SELECT value FROM store_meta WHERE key = 'json_imported'").fetchone()
+    if done:
+        return
+    bookings = _read_json_list(BOOKINGS_JSON_PATH)
+    with _tx(conn):
+        if bookings:
+            conn.executemany(
+                "INSERT OR REPLACE INTO bookings "
+                "(id, client_chat_id, masseur_chat_id, slot_date, start_time, status, created_at, data) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", [_booking_row(b) for b in bookings if b.get("id") is not None])
+            _rebuild_day_stats(conn)
+            conn.execute("INSERT OR REPLACE INTO store_meta (key, value) VALUES ('people_reset_at', ?)",
+                         (str(time.time()),))
+        conn.execute("INSERT OR REPLACE INTO store_meta (key, value) VALUES ('json_imported', '1')")
+    if bookings:
+        logger.info(f"Imported {len(bookings)} bookings from JSON into {DB_PATH}")
+
+
+def export_json(bookings_path: Path = BOOKINGS_JSON_PATH) -> Dict[str, int]:
+    """Dump the DB back to the legacy JSON file (backup / manual inspection)."""
+    bookings = get_bookings(newest_first=False)
+    Path(bookings_path).write_text(json.dumps(bookings, ensure_ascii=False, indent=2), encoding="utf-8")
+    return {"bookings": len(bookings)}
+
+
+def count_rows() -> Dict[str, int]:
+    conn = _conn()
+    return {
+        "bookings": conn.execute("SELECT COUNT(*) FROM bookings").fetchone()[0],
+    }
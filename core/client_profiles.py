@@ -8,6 +8,7 @@ from typing import Optional, Dict, Any, List
 from dataclasses import dataclass, field, asdict
 from pathlib import Path
 from core.supabase_manager import SUPABASE_ENABLED, upsert, _sb_req
+from core import sb_outbox
 
 logger = logging.getLogger(__name__)
 
@@ -164,7 +165,6 @@ def save_consultation(
             "is_test": profile.get("is_test", False),
             "questionnaire_data": questionnaire,
         }
-        upsert("profiles", profile_payload)
         cons_payload = {
             "chat_id": chat_id,
             "consultation_date": datetime.fromtimestamp(now, tz=timezone.utc).isoformat(),
@@ -176,7 +176,11 @@ def save_consultation(
             "is_test": profile.get("is_test", False),
             "questionnaire_snapshot": questionnaire,
         }
-        _sb_req("POST", "consultations", cons_payload)
+        # Через outbox: профиль раньше консультации (FK), без ожидания сети
+        sb_outbox.enqueue_many([
+            ("POST", "profiles?on_conflict=chat_id", profile_payload, "resolution=merge-duplicates"),
+            ("POST", "consultations", cons_payload, None),
+        ], entity=f"profile:{chat_id}")
 
 
 def get_profile(chat_id: int) -> Optional[Dict[str, Any]]:
@@ -461,7 +465,10 @@ def delete_test_patient(chat_id: int) -> bool:
         del profiles[chat_key]
         _save_profiles(profiles)
     if SUPABASE_ENABLED:
-        _sb_req("DELETE", f"consultations?chat_id=eq.{chat_id}")
-        _sb_req("DELETE", f"profiles?chat_id=eq.{chat_id}")
+        # Same entity as save_consultation, so queued writes can't resurrect the rows
+        sb_outbox.enqueue_many([
+            ("DELETE", f"consultations?chat_id=eq.{chat_id}", None, None),
+            ("DELETE", f"profiles?chat_id=eq.{chat_id}", None, None),
+        ], entity=f"profile:{chat_id}")
     logger.info(f"Deleted test patient {chat_id}")
     return True
@@ -0,0 +1,237 @@
+"""Append-only store for specialist conversations.
+
+One JSONL log per (chat_id, specialist): temp/specialist_convs/<chat_id>/<name>.jsonl.
+A chat turn appends two lines to its own file, so the write cost does not
+depend on how many users or specialists exist. Reads take only the tail of
+the file. Logs that grow past COMPACT_AT_LINES are trimmed to the last
+MAX_MESSAGES by a background thread.
+
+temp/specialist_convs.json (the old single-file format) is split into logs
+once, on first use, and renamed to *.imported.
+"""
+import os
+import re
+import json
+import queue
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import List, Dict
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+TEMP_DIR = Path("temp")
+CONVS_DIR = TEMP_DIR / "specialist_convs"
+LEGACY_FILE = TEMP_DIR / "specialist_convs.json"
+
+MAX_MESSAGES = 20          # сколько сообщений истории отдаём модели
+COMPACT_AT_LINES = 60      # после скольких строк лог урезается до MAX_MESSAGES
+
+_line_counts: Dict[Path, int] = {}
+_compact_queue: "queue.Queue[Path]" = queue.Queue()
+_worker_pid = None
+_legacy_checked = False
+_lock = threading.Lock()
+
+
+# ─── Paths ───
+
+def _slug(name: str) -> str:
+    safe = re.sub(r"[^\w\-]+", "_", name, flags=re.UNICODE).strip("_")[:40]
+    digest = hashlib.sha1(name.encode("utf-8")).hexdigest()[:8]
+    return f"{safe}_{digest}" if safe else digest
+
+
+def _path(chat_id, specialist_name: str) -> Path:
+    return CONVS_DIR / str(chat_id) / f"{_slug(specialist_name)}.jsonl"
+
+
+class _file_lock:
+    """Exclusive lock on a log (append vs. compaction, bot vs. web process)."""
+
+    def __init__(self, path: Path):
+        self.lock_path = path.with_suffix(".lock")
+
+    def __enter__(self):
+        self._f = None
+        if fcntl is not None:
+            self._f = open(self.lock_path, "a")
+            fcntl.flock(self._f, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self._f is not None:
+            fcntl.flock(self._f, fcntl.LOCK_UN)
+            self._f.close()
+        return False
+
+
+# ─── Legacy import ───
+
+def _import_legacy():
+    """Split temp/specialist_convs.json ("<chat_id>_<name>" → messages) into logs."""
+    global _legacy_checked
+    if _legacy_checked:
+        return
+    with _lock:
+        if _legacy_checked:
+            return
+        _legacy_checked = True
+        if not LEGACY_FILE.exists():
+            return
+        try:
+            with open(LEGACY_FILE, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            n = 0
+            for key, messages in data.items():
+                chat_id, sep, name = key.partition("_")
+                if not sep or not isinstance(messages, list):
+                    continue
+                path = _path(chat_id, name)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                with open(path, "w", encoding="utf-8") as f:
+                    for m in messages[-MAX_MESSAGES:]:
+                        f.write(json.dumps(m, ensure_ascii=False) + "\n")
+                n += 1
+            os.replace(LEGACY_FILE, LEGACY_FILE.with_suffix(".json.imported"))
+            logger.info(f"Imported {n} specialist conversations from {LEGACY_FILE}")
+        except Exception as e:
+            logger.warning(f"Failed to import {LEGACY_FILE}: {e}")
+
+
+# ─── Compaction ───
+
+def _ensure_worker():
+    global _worker_pid
+    pid = os.getpid()
+    if _worker_pid == pid:
+        return
+    _worker_pid = pid
+    threading.Thread(target=_compact_worker, daemon=True, name="conv-compact").start()
+
+
+def _compact_worker():
+    while True:
+        path = _compact_queue.get()
+        try:
+            compact(path)
+        except Exception as e:
+            logger.warning(f"Conversation compaction failed for {path}: {e}")
+
+
+def compact(path: Path, keep: int = MAX_MESSAGES) -> int:
+    """Rewrite a log keeping only the last `keep` messages. Returns lines kept."""
+    with _file_lock(path):
+        if not path.exists():
+            _line_counts.pop(path, None)
+            return 0
+        with open(path, "r", encoding="utf-8") as f:
+            lines = [ln for ln in f if ln.strip()]
+        lines = lines[-keep:]
+        tmp = path.with_suffix(f".tmp{os.getpid()}")
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.writelines(lines)
+        os.replace(tmp, path)
+    _line_counts[path] = len(lines)
+    return len(lines)
+
+
+def _count_lines(path: Path) -> int:
+    try:
+        with open(path, "rb") as f:
+            return sum(1 for _ in f)
+    except OSError:
+        return 0
+
+
+# ─── Public API ───
+
+def append_turn(chat_id, specialist_name: str, user_msg: str, bot_msg: str):
+    """Append one user/assistant exchange to the conversation log."""
+    _import_legacy()
+    path = _path(chat_id, specialist_name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    payload = (
+        json.dumps({"role": "user", "content": user_msg}, ensure_ascii=False) + "\n"
+        + json.dumps({"role": "assistant", "content": bot_msg}, ensure_ascii=False) + "\n"
+    )
+    with _file_lock(path):
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(payload)
+    count = _line_counts.get(path)
+    count = _count_lines(path) if count is None else count + 2
+    _line_counts[path] = count
+    if count > COMPACT_AT_LINES:
+        _ensure_worker()
+        _line_counts[path] = MAX_MESSAGES  # не ставим в очередь повторно
+        _compact_queue.put(path)
+
+
+def load_tail(chat_id, specialist_name: str, limit: int = MAX_MESSAGES) -> List[dict]:
+    """Last `limit` messages of a conversation, oldest first."""
+    _import_legacy()
+    path = _path(chat_id, specialist_name)
+    if not path.exists():
+        return []
+    try:
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            pos = f.tell()
+            buf = b""
+            block = 8192
+            # Читаем с конца блоками, пока не наберём limit строк
+            while pos > 0 and buf.count(b"\n") <= limit:
+                step = min(block, pos)
+                pos -= step
+                f.seek(pos)
+                buf = f.read(step) + buf
+        out = []
+        for ln in buf.splitlines()[-limit:]:
+            try:
+                out.append(json.loads(ln.decode("utf-8")))
+            except (ValueError, UnicodeDecodeError):
+                continue  # первая строка блока может быть обрезана
+        return out
+    except OSError as e:
+        logger.warning(f"Failed to read conversation {path}: {e}")
+        return []
+
+
+def delete(chat_id, specialist_name: str) -> bool:
+    _import_legacy()
+    path = _path(chat_id, specialist_name)
+    _line_counts.pop(path, None)
+    try:
+        path.with_suffix(".lock").unlink(missing_ok=True)
+        path.unlink()
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def rename(chat_id, old_name: str, new_name: str) -> bool:
+    _import_legacy()
+    old, new = _path(chat_id, old_name), _path(chat_id, new_name)
+    if not old.exists():
+        return False
+    with _file_lock(old):
+        os.replace(old, new)
+    old.with_suffix(".lock").unlink(missing_ok=True)
+    _line_counts.pop(old, None)
+    _line_counts.pop(new, None)
+    return True
+
+
+def stats() -> Dict[str, int]:
+    files = list(CONVS_DIR.glob("*/*.jsonl")) if CONVS_DIR.exists() else []
+    return {
+        "conversations": len(files),
+        "bytes": sum(p.stat().st_size for p in files),
+        "compaction_queue": _compact_queue.qsize(),
+    }
@@ -0,0 +1,155 @@
+"""iCalendar (RFC 5545) feeds of bookings — one per masseur and one per client.
+
+Calendar apps poll a subscribed URL every few minutes. A feed is built once
+and kept in memory with its ETag / Last-Modified until that person's
+bookings change (booking_store.person_changed_at, stamped by every booking
+write) or masseurs.json does, so a poll costs one primary-key lookup and
+is usually answered with 304 Not Modified.
+
+Booking times are masseur-local (core.availability); events carry them in
+UTC, so a calendar in any zone shows the real time of the session.
+
+Feed URLs carry an HMAC token (derived from the bot token), because
+calendar apps cannot send Telegram initData.
+"""
+import hmac
+import hashlib
+import logging
+from datetime import datetime, timedelta, timezone
+from email.utils import formatdate
+from typing import Dict, Any, Optional, Tuple
+
+from config import TOKEN
+from core import booking_store, availability
+
+logger = logging.getLogger(__name__)
+
+ROLES = ("masseur", "client")
+PAST_DAYS = 30          # старые сеансы в календаре не нужны
+STATUS = {"pending": "TENTATIVE", "confirmed": "CONFIRMED", "cancelled": "CANCELLED"}
+STATUS_RU = {"pending": "⏳ ожидает подтверждения", "confirmed": "✅ подтверждена", "cancelled": "❌ отменена"}
+
+# (role, chat_id) → ((changed_at, schedules_version), etag, last_modified, body)
+_cache: Dict[tuple, tuple] = {}
+_stats = {"builds": 0, "hits": 0}
+
+
+def feed_token(role: str, chat_id: int) -> str:
+    msg = f"ics:{role}:{chat_id}".encode()
+    return hmac.new((TOKEN or "").encode(), msg, hashlib.sha256).hexdigest()[:24]
+
+
+def check_token(role: str, chat_id: int, token: str) -> bool:
+    return role in ROLES and hmac.compare_digest(feed_token(role, chat_id), token or "")
+
+
+def _escape(text: str) -> str:
+    return (str(text or "").replace("\\", "\\\\").replace(";", "\\;")
+            .replace(",", "\\,").replace("\n", "\\n"))
+
+
+def _fold(line: str) -> str:
+    """Lines longer than 75 octets continue on the next line after a space."""
+    raw = line.encode("utf-8")
+    if len(raw) <= 75:
+        return line
+    parts, cur = [], b""
+    for ch in line:
+        b = ch.encode("utf-8")
+        if len(cur) + len(b) > (75 if not parts else 74):
+            parts.append(cur.decode("utf-8"))
+            cur = b""
+        cur += b
+    parts.append(cur.decode("utf-8"))
+    return "\r\n ".join(parts)
+
+
+def _event(b: dict, role: str, names: Dict[int, str], stamp: str) -> Optional[list]:
+    try:
+        start = datetime.strptime(f"{b['slot_date']} {str(b['start_time'])[:5]}", "%Y-%m-%d %H:%M")
+    except (KeyError, ValueError, TypeError):
+        return None
+    tz = availability.schedule(b.get("masseur_chat_id"))["tz"]
+    start = (start.replace(tzinfo=tz) if tz is not None else start.astimezone()).astimezone(timezone.utc)
+    end = start + timedelta(minutes=int(b.get("duration_min") or 60))
+    service = b.get("service_name") or "Массаж"
+    if role == "masseur":
+        who = f"@{b['client_username']}" if b.get("client_username") else f"клиент {b.get('client_chat_id')}"
+        summary = f"{service} — {who}"
+    else:
+        summary = f"{service} — {names.get(b.get('masseur_chat_id')) or 'массажист'}"
+    status = b.get("status", "pending")
+    desc = [f"Запись №{b.get('id')}: {STATUS_RU.get(status, status)}"]
+    if b.get("client_note"):
+        desc.append(f"Комментарий: {b['client_note']}")
+    return [
+        "BEGIN:VEVENT",
+        f"UID:booking-{b.get('id')}@ai-prophet",
+        f"DTSTAMP:{stamp}",
+        f"DTSTART:{start:%Y%m%dT%H%M%SZ}",
+        f"DTEND:{end:%Y%m%dT%H%M%SZ}",
+        f"SUMMARY:{_escape(summary)}",
+        f"DESCRIPTION:{_escape(chr(10).join(desc))}",
+        f"STATUS:{STATUS.get(status, 'TENTATIVE')}",
+        "END:VEVENT",
+    ]
+
+
+def build(role: str, chat_id: int) -> str:
+    """The whole VCALENDAR text for a masseur's or client's bookings."""
+    from core.masseur_diary import get_masseurs
+    names = {int(m["chat_id"]): m.get("name", "") for m in get_masseurs() if m.get("chat_id")}
+    key = "masseur_chat_id" if role == "masseur" else "client_chat_id"
+    today = (availability.today(chat_id) if role == "masseur"
+             else datetime.now(availability.salon_tz()).date().isoformat())
+    since = (datetime.strptime(today, "%Y-%m-%d") - timedelta(days=PAST_DAYS)).date().isoformat()
+    bookings = [b for b in booking_store.get_bookings(newest_first=False, **{key: chat_id})
+                if str(b.get("slot_date", "")) >= since]
+    stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
+    if role == "masseur":
+        title = f"Записи — {names[chat_id]}" if names.get(chat_id) else "Записи клиентов"
+    else:
+        title = "Мои записи на массаж"
+    lines = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        "PRODID:-//ai_prophet//bookings//RU",
+        "CALSCALE:GREGORIAN",
+        "METHOD:PUBLISH",
+        f"X-WR-CALNAME:{_escape(title)}",
+        "REFRESH-INTERVAL;VALUE=DURATION:PT15M",
+    ]
+    for b in bookings:
+        lines.extend(_event(b, role, names, stamp) or [])
+    lines.append("END:VCALENDAR")
+    return "\r\n".join(_fold(l) for l in lines) + "\r\n"
+
+
+def get_feed(role: str, chat_id: int) -> Tuple[str, str, str]:
+    """(body, etag, last_modified) — rebuilt only after this person's bookings changed."""
+    changed = booking_store.person_changed_at(chat_id)
+    version = (changed, availability.schedules_version())  # пояс массажиста — в masseurs.json
+    hit = _cache.get((role, chat_id))
+    if hit and hit[0] == version:
+        _stats["hits"] += 1
+        return hit[3], hit[1], hit[2]
+    body = build(role, chat_id)
+    etag = '"' + hashlib.sha1(f"{role}:{chat_id}:{version}".encode()).hexdigest()[:20] + '"'
+    last_modified = formatdate(changed or 0, usegmt=True)
+    if len(_cache) > 2000:
+        _cache.clear()
+    _cache[(role, chat_id)] = (version, etag, last_modified, body)
+    _stats["builds"] += 1
+    return body, etag, last_modified
+
+
+def not_modified(etag: str, last_modified: str, if_none_match: str = None,
+                 if_modified_since: str = None) -> bool:
+    """Conditional GET check (If-None-Match wins over If-Modified-Since)."""
+    if if_none_match:
+        return etag in [t.strip() for t in if_none_match.split(",")] or if_none_match.strip() == "*"
+    return bool(if_modified_since) and if_modified_since == last_modified
+
+
+def stats() -> Dict[str, Any]:
+    return {"cached": len(_cache), **_stats}
@@ -0,0 +1,235 @@
+"""Content-addressed cache of LLM responses (memory LRU + SQLite on disk).
+
+Key = sha256 of (provider, model, normalized prompt, media hashes,
+temperature): the same questionnaire, role or voice note gives the same key
+whatever process or call site sends it. Media (images, audio, video frames)
+enter the key as their own sha256, not as bytes/base64.
+
+Caching is opt-in per call site: a site passes its name (one of TTLS) to
+the llm_gateway call; without a name nothing is cached, which is how
+user-facing creative replies (chat, rituals, specialist dialogue) stay
+fresh. Failed calls (None / empty) are never stored.
+
+  memory — OrderedDict LRU of LLM_CACHE_MEMORY_ITEMS entries, per process
+  disk   — data/llm_cache.db (WAL, shared by the bot and web processes),
+           least recently used rows are evicted above LLM_CACHE_DISK_MB
+"""
+import os
+import re
+import json
+import time
+import base64
+import sqlite3
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Dict, Any, Iterable
+
+from config import LLM_CACHE_ENABLED, LLM_CACHE_MEMORY_ITEMS, LLM_CACHE_DISK_MB
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = Path("data")
+DB_PATH = DATA_DIR / "llm_cache.db"
+
+DAY = 86400
+# call site → TTL, сек
+TTLS = {
+    "specialist_schema": 30 * DAY,   # анкета специалиста по роли
+    "music_queries": 7 * DAY,        # запрос о музыке → поисковые запросы IA
+    "transcription": 30 * DAY,       # повторно присланное голосовое
+    "consultation": 1 * DAY,         # этапы консультации при повторном запуске
+}
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS llm_cache (
+  key TEXT PRIMARY KEY,
+  site TEXT NOT NULL,
+  value TEXT NOT NULL,
+  size INTEGER NOT NULL,
+  expires_at REAL NOT NULL,
+  used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_llm_cache_used ON llm_cache(used_at);
+"""
+
+_mem: "OrderedDict[str, tuple]" = OrderedDict()   # key → (expires_at, value)
+_mem_lock = threading.Lock()
+_local = threading.local()
+_initialized_pid = None
+_stats: Dict[str, Dict[str, int]] = {}
+_EVICT_EVERY = 50   # проверять размер БД раз в N записей
+_puts = 0
+
+
+def _site_stats(site: str) -> Dict[str, int]:
+    return _stats.setdefault(site, {"hits": 0, "disk_hits": 0, "misses": 0, "stores": 0})
+
+
+# ─── Keys ───
+
+def _normalize_text(text: str) -> str:
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+
+def _media_hash(data) -> str:
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return "sha256:" + hashlib.sha256(data).hexdigest()
+
+
+def _normalize(obj):
+    """Prompt structure with text normalized and inline media replaced by hashes."""
+    if isinstance(obj, str):
+        m = re.match(r"data:[\w/+.-]+;base64,(.*)", obj, re.S)
+        if m:
+            return _media_hash(base64.b64decode(m.group(1)))
+        return _normalize_text(obj)
+    if isinstance(obj, (bytes, bytearray)):
+        return _media_hash(bytes(obj))
+    if isinstance(obj, dict):
+        return {k: _normalize(v) for k, v in sorted(obj.items())}
+    if isinstance(obj, (list, tuple)):
+        return [_normalize(v) for v in obj]
+    inline = getattr(obj, "inline_data", None)  # google.genai Part
+    if inline is not None and getattr(inline, "data", None) is not None:
+        return {"mime": inline.mime_type, "data": _media_hash(inline.data)}
+    text = getattr(obj, "text", None)
+    if isinstance(text, str):
+        return _normalize_text(text)
+    return repr(obj)
+
+
+def make_key(provider: str, model: str, prompt, media: Iterable = (), temperature: float = None) -> str:
+    raw = json.dumps([provider, model, _normalize(prompt), [_media_hash(m) for m in media], temperature],
+                     ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+# ─── Disk tier ───
+
+def _conn() -> sqlite3.Connection:
+    """Per-thread connection (re-opened after fork — web runs in a child process)."""
+    global _initialized_pid
+    pid = os.getpid()
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "pid", None) != pid:
+        DATA_DIR.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(DB_PATH), timeout=15, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=15000")
+        _local.conn, _local.pid = conn, pid
+    if _initialized_pid != pid:
+        conn.executescript(SCHEMA_SQL)
+        _initialized_pid = pid
+    return conn
+
+
+def _evict_disk(conn: sqlite3.Connection):
+    now = time.time()
+    conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (now,))
+    limit = int(LLM_CACHE_DISK_MB * 1024 * 1024)
+    total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+    if total <= limit:
+        return
+    # LRU: удаляем самые давно использованные, пока не влезем в 90% лимита
+    excess, cutoff = total - int(limit * 0.9), None
+    for used_at, size in conn.execute("SELECT used_at, size FROM llm_cache ORDER BY used_at"):
+        excess -= size
+        cutoff = used_at
+        if excess <= 0:
+            break
+    if cutoff is not None:
+        conn.execute("DELETE FROM llm_cache WHERE used_at <= ?", (cutoff,))
+
+
+# ─── API ───
+
+def _mem_put(key: str, expires_at: float, value: str):
+    with _mem_lock:
+        _mem[key] = (expires_at, value)
+        _mem.move_to_end(key)
+        while len(_mem) > LLM_CACHE_MEMORY_ITEMS:
+            _mem.popitem(last=False)
+
+
+def get(site: Optional[str], key: str) -> Optional[str]:
+    """Cached response or None. site=None (opt-out) always misses without counting."""
+    if not site or not LLM_CACHE_ENABLED:
+        return None
+    st = _site_stats(site)
+    now = time.time()
+    with _mem_lock:
+        hit = _mem.get(key)
+        if hit and hit[0] > now:
+            _mem.move_to_end(key)
+            st["hits"] += 1
+            return hit[1]
+        if hit:
+            del _mem[key]
+    try:
+        conn = _conn()
+        row = conn.execute("SELECT value, expires_at FROM llm_cache WHERE key = ? AND expires_at > ?",
+                           (key, now)).fetchone()
+        if row:
+            conn.execute("UPDATE llm_cache SET used_at = ? WHERE key = ?", (now, key))
+            _mem_put(key, row[1], row[0])
+            st["hits"] += 1
+            st["disk_hits"] += 1
+            return row[0]
+    except sqlite3.Error as e:
+        logger.warning(f"LLM cache read failed: {e}")
+    st["misses"] += 1
+    return None
+
+
+def put(site: Optional[str], key: str, value: Optional[str]):
+    """Store a successful response for the site's TTL."""
+    global _puts
+    if not site or not value or not LLM_CACHE_ENABLED:
+        return
+    now = time.time()
+    expires_at = now + TTLS.get(site, DAY)
+    _mem_put(key, expires_at, value)
+    _site_stats(site)["stores"] += 1
+    try:
+        conn = _conn()
+        conn.execute("INSERT OR REPLACE INTO llm_cache (key, site, value, size, expires_at, used_at) "
+                     "VALUES (?, ?, ?, ?, ?, ?)", (key, site, value, len(value.encode("utf-8")), expires_at, now))
+        _puts += 1
+        if _puts % _EVICT_EVERY == 0:
+            _evict_disk(conn)
+    except sqlite3.Error as e:
+        logger.warning(f"LLM cache write failed: {e}")
+
+
+def clear():
+    with _mem_lock:
+        _mem.clear()
+    try:
+        _conn().execute("DELETE FROM llm_cache")
+    except sqlite3.Error as e:
+        logger.warning(f"LLM cache clear failed: {e}")
+
+
+def stats() -> Dict[str, Any]:
+    """Hit/miss counters per call site (this process) and tier sizes."""
+    disk = {"entries": 0, "bytes": 0}
+    try:
+        n, size = _conn().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache").fetchone()
+        disk = {"entries": n, "bytes": size}
+    except sqlite3.Error:
+        pass
+    hits = sum(s["hits"] for s in _stats.values())
+    misses = sum(s["misses"] for s in _stats.values())
+    return {
+        "enabled": LLM_CACHE_ENABLED,
+        "memory_entries": len(_mem),
+        "disk": disk,
+        "hit_ratio": round(hits / (hits + misses), 3) if hits + misses else None,
+        "sites": {k: dict(v) for k, v in _stats.items()},
+    }
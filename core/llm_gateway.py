@@ -0,0 +1,512 @@
+"""One gateway to the LLM providers: HF Router (pooled async HTTP) and Gemini.
+
+Every HF Router call (agents, specialist factory, ai_engine / conduct_ai_ritual)
+goes through one aiohttp.ClientSession with keep-alive connections instead
+of a fresh requests.post per call. The session lives on a private event loop
+in a daemon thread ("llm-gateway"), so it serves both kinds of callers:
+  - async handlers: await hf_chat_async(...) — cancelling the awaiting task
+    cancels the HTTP request;
+  - sync code in worker threads (agents under asyncio.to_thread):
+    hf_chat(...) blocks the calling thread only.
+Gemini has a single shared genai.Client per process (its own httpx pool)
+with the same timeout.
+
+Contract as before: content string or None on any failure, never raises
+(except cancellation). Call sites that name a cache (llm_cache.TTLS) get
+identical answers from core.llm_cache instead of a new request. Every
+call passes the per-model circuit breaker of core.llm_health; an open one
+answers None at once, and provider_order() sorts fallbacks by health. Timeouts: LLM_CONNECT_TIMEOUT / LLM_READ_TIMEOUT,
+audio uses LLM_AUDIO_TIMEOUT.
+
+Latency-critical sites (specialist chat, rituals) can hedge: hedged() runs
+the primary provider and, if it has not answered within the site's latency
+budget (a percentile of its recent answers, HEDGE_POLICIES), fires the
+secondary as well; the first non-empty answer wins and the other request is
+cancelled. Sites not listed in LLM_HEDGE_SITES just fall back in order.
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from typing import Optional, List, Dict, Any, Tuple
+
+import aiohttp
+
+from config import (
+    GEMINI_KEY, HF_TOKEN, HF_TASKS, FALLBACK_MODELS,
+    LLM_POOL_SIZE, LLM_CONNECT_TIMEOUT, LLM_READ_TIMEOUT, LLM_AUDIO_TIMEOUT,
+    LLM_HEDGE_SITES, LLM_HEDGE_PERCENTILE, LLM_HEDGE_MIN_DELAY, LLM_HEDGE_MAX_DELAY,
+)
+from core import llm_cache, llm_health
+
+logger = logging.getLogger(__name__)
+
+HF_ROUTER_URL = "https://router.huggingface.co/v1"
+
+_lock = threading.Lock()
+_loop = None
+_loop_pid = None
+_session_obj = None
+_gemini = None
+_gemini_pid = None
+
+_stats = {"hf_requests": 0, "hf_connections": 0, "hf_errors": 0, "hf_cancelled": 0, "hf_skipped": 0,
+          "gemini_requests": 0, "gemini_errors": 0}
+
+
+def _hf_token() -> Optional[str]:
+    return HF_TOKEN.strip() if HF_TOKEN else None
+
+
+# ─── Loop thread + pooled session ───
+
+def _gateway_loop() -> asyncio.AbstractEventLoop:
+    """Private loop in a daemon thread (re-created after fork: threads do not survive it)."""
+    global _loop, _loop_pid, _session_obj
+    with _lock:
+        if _loop is None or _loop_pid != os.getpid():
+            _loop = asyncio.new_event_loop()
+            _loop_pid = os.getpid()
+            _session_obj = None
+            threading.Thread(target=_loop.run_forever, name="llm-gateway", daemon=True).start()
+        return _loop
+
+
+async def _on_connection_create(session, ctx, params):
+    _stats["hf_connections"] += 1
+
+
+def _session() -> aiohttp.ClientSession:
+    """Keep-alive session; only ever used on the gateway loop."""
+    global _session_obj
+    if _session_obj is None or _session_obj.closed:
+        trace = aiohttp.TraceConfig()
+        trace.on_connection_create_end.append(_on_connection_create)
+        _session_obj = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=LLM_POOL_SIZE, keepalive_timeout=60),
+            timeout=aiohttp.ClientTimeout(sock_connect=LLM_CONNECT_TIMEOUT),  # total — на каждый запрос
+            trace_configs=[trace],
+        )
+    return _session_obj
+
+
+def _submit(coro):
+    return asyncio.run_coroutine_threadsafe(coro, _gateway_loop())
+
+
+def _run_sync(coro, timeout: float):
+    fut = _submit(coro)
+    try:
+        return fut.result(timeout=timeout + LLM_CONNECT_TIMEOUT + 5)
+    except Exception as e:  # таймаут ожидания — запрос на шлюзе тоже отменяем
+        fut.cancel()
+        logger.warning(f"LLM gateway call failed: {e!r}")
+        return None
+
+
+async def _run_async(coro):
+    try:
+        return await asyncio.wrap_future(_submit(coro))
+    except asyncio.CancelledError:
+        _stats["hf_cancelled"] += 1
+        raise
+
+
+# ─── HF Router ───
+
+async def _hf_post(path: str, model: str, timeout: float, label: str, **kwargs) -> Optional[dict]:
+    token = _hf_token()
+    if not token:
+        return None
+    target = f"hf:{model}"
+    if not llm_health.allow(target):
+        _stats["hf_skipped"] += 1  # предохранитель открыт — не ждём таймаут
+        return None
+    _stats["hf_requests"] += 1
+    t0 = time.monotonic()
+    try:
+        async with _session().post(f"{HF_ROUTER_URL}/{path}", headers={"Authorization": f"Bearer {token}"},
+                                   timeout=aiohttp.ClientTimeout(total=timeout, sock_connect=LLM_CONNECT_TIMEOUT),
+                                   **kwargs) as resp:
+            body = await resp.read()
+            if resp.status == 200:
+                llm_health.record(target, True, time.monotonic() - t0)
+                return json.loads(body)
+            _stats["hf_errors"] += 1
+            text = body[:200].decode('utf-8', 'replace')
+            logger.warning(f"HF {label} {resp.status}: {text}")
+            if resp.status == 429 or resp.status >= 500 or resp.status == 408:
+                llm_health.record(target, False, quota=resp.status == 429, error=f"{resp.status} {text}")
+            else:
+                llm_health.release(target)  # ошибка запроса, а не провайдера
+    except asyncio.CancelledError:
+        llm_health.release(target)
+        raise
+    except Exception as e:
+        _stats["hf_errors"] += 1
+        llm_health.record(target, False, error=repr(e))
+        logger.warning(f"HF {label} error: {e!r}")
+    return None
+
+
+async def _hf_chat(messages: List[dict], task: str, max_tokens: int, timeout: float) -> Optional[str]:
+    model = HF_TASKS.get(task, HF_TASKS["text"])
+    data = await _hf_post("chat/completions", model, timeout, task,
+                          json={"model": model, "messages": messages, "max_tokens": max_tokens})
+    try:
+        return data["choices"][0]["message"]["content"] if data else None
+    except (KeyError, IndexError, TypeError):
+        logger.warning(f"HF {task}: unexpected response {str(data)[:200]}")
+        return None
+
+
+async def _hf_transcribe(audio: bytes, filename: str, mime: str, timeout: float) -> Optional[str]:
+    form = aiohttp.FormData()
+    form.add_field("file", audio, filename=filename, content_type=mime)
+    form.add_field("model", HF_TASKS["audio"])
+    data = await _hf_post("audio/transcriptions", HF_TASKS["audio"], timeout, "audio", data=form)
+    return (data.get("text") or "").strip() if isinstance(data, dict) else None
+
+
+def _chat_key(messages: List[dict], task: str, max_tokens: int) -> str:
+    return llm_cache.make_key("hf", HF_TASKS.get(task, HF_TASKS["text"]), [messages, max_tokens])
+
+
+def hf_chat(messages: List[dict], task: str = "text", max_tokens: int = 4096,
+            timeout: float = None, cache: str = None) -> Optional[str]:
+    """OpenAI-style chat completion via HF Router (blocks the calling thread).
+
+    cache: call-site name from llm_cache.TTLS to reuse identical answers.
+    """
+    if not _hf_token():
+        return None
+    key = _chat_key(messages, task, max_tokens) if cache else None
+    hit = llm_cache.get(cache, key)
+    if hit is not None:
+        return hit
+    timeout = timeout or LLM_READ_TIMEOUT
+    result = _run_sync(_hf_chat(messages, task, max_tokens, timeout), timeout)
+    llm_cache.put(cache, key, result)
+    return result
+
+
+async def hf_chat_async(messages: List[dict], task: str = "text", max_tokens: int = 4096,
+                        timeout: float = None, cache: str = None) -> Optional[str]:
+    if not _hf_token():
+        return None
+    key = _chat_key(messages, task, max_tokens) if cache else None
+    hit = llm_cache.get(cache, key)
+    if hit is not None:
+        return hit
+    result = await _run_async(_hf_chat(messages, task, max_tokens, timeout or LLM_READ_TIMEOUT))
+    llm_cache.put(cache, key, result)
+    return result
+
+
+def _audio_key(audio: bytes) -> str:
+    return llm_cache.make_key("hf", HF_TASKS["audio"], "transcribe", media=[audio])
+
+
+def hf_transcribe(audio: bytes, filename: str = "audio.wav", mime: str = "audio/wav",
+                  cache: str = None) -> Optional[str]:
+    """Whisper via HF Router (multipart, OpenAI-compatible)."""
+    if not _hf_token():
+        return None
+    key = _audio_key(audio) if cache else None
+    hit = llm_cache.get(cache, key)
+    if hit is not None:
+        return hit
+    result = _run_sync(_hf_transcribe(audio, filename, mime, LLM_AUDIO_TIMEOUT), LLM_AUDIO_TIMEOUT)
+    llm_cache.put(cache, key, result)
+    return result
+
+
+async def hf_transcribe_async(audio: bytes, filename: str = "audio.wav", mime: str = "audio/wav",
+                              cache: str = None) -> Optional[str]:
+    if not _hf_token():
+        return None
+    key = _audio_key(audio) if cache else None
+    hit = llm_cache.get(cache, key)
+    if hit is not None:
+        return hit
+    result = await _run_async(_hf_transcribe(audio, filename, mime, LLM_AUDIO_TIMEOUT))
+    llm_cache.put(cache, key, result)
+    return result
+
+
+# ─── Gemini ───
+
+def gemini_client():
+    """The process-wide genai.Client (None without GEMINI_API_KEY)."""
+    global _gemini, _gemini_pid
+    if not GEMINI_KEY:
+        return None
+    with _lock:
+        if _gemini is None or _gemini_pid != os.getpid():
+            from google import genai
+            from google.genai import types as genai_types
+            _gemini = genai.Client(api_key=GEMINI_KEY, http_options=genai_types.HttpOptions(
+                timeout=int((LLM_CONNECT_TIMEOUT + LLM_READ_TIMEOUT) * 1000)))
+            _gemini_pid = os.getpid()
+        return _gemini
+
+
+def gemini_generate(contents, models: List[str] = None, temperature: float = 0.3,
+                    max_tokens: int = 4096, label: str = "Gemini", cache: str = None) -> Optional[str]:
+    """generate_content on the first model that answers (FALLBACK_MODELS[:2] by default).
+
+    cache: call-site name from llm_cache.TTLS to reuse identical answers.
+    """
+    client = gemini_client()
+    if not client:
+        return None
+    models = models or FALLBACK_MODELS[:2]
+    key = llm_cache.make_key("gemini", ",".join(models), [contents, max_tokens], temperature=temperature) if cache else None
+    hit = llm_cache.get(cache, key)
+    if hit is not None:
+        return hit
+    result = _gemini_generate(client, contents, models, temperature, max_tokens, label)
+    llm_cache.put(cache, key, result)
+    return result
+
+
+def _gemini_generate(client, contents, models: List[str], temperature: float, max_tokens: int,
+                     label: str) -> Optional[str]:
+    from google.genai import types as genai_types
+    config = genai_types.GenerateContentConfig(temperature=temperature, max_output_tokens=max_tokens)
+    for model in llm_health.models("gemini", models):
+        target = f"gemini:{model}"
+        if not llm_health.allow(target):
+            continue
+        _stats["gemini_requests"] += 1
+        t0 = time.monotonic()
+        try:
+            resp = client.models.generate_content(model=model, contents=contents, config=config)
+        except Exception as e:
+            _stats["gemini_errors"] += 1
+            llm_health.record(target, False, quota=llm_health.is_quota_error(e), error=repr(e))
+            logger.warning(f"{label} {model}: {e}")
+            continue
+        llm_health.record(target, True, time.monotonic() - t0)  # пустой ответ — фильтр, не сбой
+        if resp and resp.text:
+            return resp.text.strip()
+        logger.warning(f"{label} {model}: empty response (safety filter?)")
+    return None
+
+
+async def _gemini_generate_async(client, contents, models: List[str], temperature: float, max_tokens: int,
+                                 label: str) -> Optional[str]:
+    """_gemini_generate on the aio client: runs on the gateway loop and can be cancelled (hedging)."""
+    from google.genai import types as genai_types
+    config = genai_types.GenerateContentConfig(temperature=temperature, max_output_tokens=max_tokens)
+    for model in llm_health.models("gemini", models):
+        target = f"gemini:{model}"
+        if not llm_health.allow(target):
+            continue
+        _stats["gemini_requests"] += 1
+        t0 = time.monotonic()
+        try:
+            resp = await client.aio.models.generate_content(model=model, contents=contents, config=config)
+        except asyncio.CancelledError:
+            llm_health.release(target)
+            raise
+        except Exception as e:
+            _stats["gemini_errors"] += 1
+            llm_health.record(target, False, quota=llm_health.is_quota_error(e), error=repr(e))
+            logger.warning(f"{label} {model}: {e}")
+            continue
+        llm_health.record(target, True, time.monotonic() - t0)
+        if resp and resp.text:
+            return resp.text.strip()
+        logger.warning(f"{label} {model}: empty response (safety filter?)")
+    return None
+
+
+def provider_order(preferred=("hf", "gemini"), task: str = "text") -> List[str]:
+    """Configured providers in health order; the preferred order wins among equally healthy ones.
+
+    A provider whose breakers are all open is left out, so callers fall
+    through to the next one at once instead of waiting for a timeout.
+    """
+    targets = {}
+    for p in preferred:
+        if p == "hf" and _hf_token():
+            targets["hf"] = [f"hf:{HF_TASKS.get(task, HF_TASKS['text'])}"]
+        elif p == "gemini" and gemini_client():
+            targets["gemini"] = [f"gemini:{m}" for m in FALLBACK_MODELS[:2]]
+    return llm_health.providers(targets)
+
+
+# ─── Hedging ───
+
+# call site → когда запускать запасного провайдера: бюджет = percentile
+# последних успешных ответов основного на этом месте, в [min_delay, max_delay]
+HEDGE_POLICIES = {
+    "specialist_chat": {"percentile": LLM_HEDGE_PERCENTILE, "min_delay": LLM_HEDGE_MIN_DELAY,
+                        "max_delay": LLM_HEDGE_MAX_DELAY},
+    "ritual": {"percentile": LLM_HEDGE_PERCENTILE, "min_delay": LLM_HEDGE_MIN_DELAY,
+               "max_delay": LLM_HEDGE_MAX_DELAY},
+}
+HEDGE_SAMPLES = 50       # последних задержек на (site, provider)
+HEDGE_MIN_SAMPLES = 10   # меньше — бюджет max_delay
+
+_hedge_latency: Dict[Tuple[str, str], deque] = {}
+_hedge_stats: Dict[str, Dict[str, Any]] = {}
+
+
+def hf_call(messages: List[dict], task: str = "text", max_tokens: int = 4096):
+    """hedged() leg: HF chat completion (None without HF_TOKEN)."""
+    if not _hf_token():
+        return None
+    model = HF_TASKS.get(task, HF_TASKS["text"])
+    return "hf", [f"hf:{model}"], lambda: _hf_chat(messages, task, max_tokens, LLM_READ_TIMEOUT)
+
+
+def gemini_call(contents, models: List[str] = None, temperature: float = 0.3,
+                max_tokens: int = 4096, label: str = "Gemini"):
+    """hedged() leg: Gemini generate_content (None without GEMINI_API_KEY)."""
+    client = gemini_client()
+    if not client:
+        return None
+    models = models or FALLBACK_MODELS[:2]
+    return ("gemini", [f"gemini:{m}" for m in models],
+            lambda: _gemini_generate_async(client, contents, models, temperature, max_tokens, label))
+
+
+def hedging_enabled(site: str) -> bool:
+    return site in LLM_HEDGE_SITES and site in HEDGE_POLICIES
+
+
+def _hedge_site_stats(site: str) -> Dict[str, Any]:
+    return _hedge_stats.setdefault(site, {"calls": 0, "hedged": 0, "hedge_wins": 0, "fallbacks": 0,
+                                          "cancelled": 0, "failed": 0, "wins": {}})
+
+
+def _hedge_delay(site: str, provider: str) -> float:
+    policy = HEDGE_POLICIES[site]
+    samples = sorted(_hedge_latency.get((site, provider), ()))
+    if len(samples) < HEDGE_MIN_SAMPLES:
+        return policy["max_delay"]
+    p = samples[min(len(samples) - 1, int(len(samples) * policy["percentile"] / 100))]
+    return min(max(p, policy["min_delay"]), policy["max_delay"])
+
+
+def _arrange(calls) -> list:
+    """Configured legs in health order (the given order is the preference)."""
+    legs = {c[0]: c for c in calls if c}
+    return [legs[p] for p in llm_health.providers({p: c[1] for p, c in legs.items()})]
+
+
+async def _hedge(site: str, calls: list) -> Tuple[Optional[str], Optional[str]]:
+    st = _hedge_site_stats(site)
+    st["calls"] += 1
+    hedge = hedging_enabled(site)
+    pending = list(calls)
+    running = {}  # task → (provider, started)
+    fired = False
+
+    def start(kind: str = None):
+        provider, _, factory = pending.pop(0)
+        running[asyncio.ensure_future(factory())] = (provider, time.monotonic())
+        if kind:
+            st[kind] += 1
+
+    start()
+    try:
+        while running:
+            delay = None
+            if hedge and pending and len(running) == 1:
+                provider, started = next(iter(running.values()))
+                delay = max(0.0, _hedge_delay(site, provider) - (time.monotonic() - started))
+            done, _ = await asyncio.wait(running, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                # основной не уложился в бюджет — параллельно запускаем запасного
+                logger.info(f"⏱️ LLM hedge {site}: {running[next(iter(running))][0]} > {delay:.1f}s, "
+                            f"firing {pending[0][0]}")
+                start("hedged")
+                fired = True
+                continue
+            for task in done:
+                provider, started = running.pop(task)
+                try:
+                    result = task.result()
+                except Exception as e:
+                    logger.warning(f"LLM hedge {site} {provider}: {e!r}")
+                    result = None
+                if result:
+                    _hedge_latency.setdefault((site, provider), deque(maxlen=HEDGE_SAMPLES)).append(
+                        time.monotonic() - started)
+                    st["wins"][provider] = st["wins"].get(provider, 0) + 1
+                    if fired and provider != calls[0][0]:
+                        st["hedge_wins"] += 1
+                    return result, provider
+            if not running and pending:
+                start("fallbacks")  # основной ответил ошибкой — обычный fallback
+        st["failed"] += 1
+        return None, None
+    finally:
+        for task in running:  # проигравший запрос больше не нужен
+            task.cancel()
+            st["cancelled"] += 1
+
+
+def hedged(site: str, calls: list) -> Tuple[Optional[str], Optional[str]]:
+    """(answer, provider) from the first leg to answer (blocks the calling thread).
+
+    calls: hf_call(...) / gemini_call(...) legs in preferred order (None legs
+    are skipped); open breakers drop a leg, healthier ones move first. With
+    hedging on for the site, the next leg starts once the current one is over
+    its latency budget; otherwise legs run one after another on failure.
+    """
+    calls = _arrange(calls)
+    if not calls:
+        return None, None
+    return _run_sync(_hedge(site, calls), len(calls) * LLM_READ_TIMEOUT) or (None, None)
+
+
+async def hedged_async(site: str, calls: list) -> Tuple[Optional[str], Optional[str]]:
+    calls = _arrange(calls)
+    if not calls:
+        return None, None
+    return await _run_async(_hedge(site, calls))
+
+
+def hedge_stats() -> Dict[str, Any]:
+    """Per site: calls, extra requests (hedged), wins, and the current latency budgets."""
+    out = {}
+    for site, st in _hedge_stats.items():
+        out[site] = {**st, "wins": dict(st["wins"]), "enabled": hedging_enabled(site),
+                     "extra_cost": round(st["hedged"] / st["calls"], 3) if st["calls"] else None}
+        if site in HEDGE_POLICIES:
+            out[site]["budget_sec"] = {p: round(_hedge_delay(site, p), 2)
+                                       for (s, p) in _hedge_latency if s == site}
+    return out
+
+
+# ─── Lifecycle / stats ───
+
+async def _close_session():
+    global _session_obj
+    if _session_obj is not None and not _session_obj.closed:
+        await _session_obj.close()
+    _session_obj = None
+
+
+def close(timeout: float = 5):
+    """Close pooled HF connections (FastAPI shutdown)."""
+    if _loop is None or _loop_pid != os.getpid():
+        return
+    try:
+        _submit(_close_session()).result(timeout=timeout)
+    except Exception as e:
+        logger.warning(f"LLM gateway close failed: {e!r}")
+
+
+def stats() -> Dict[str, Any]:
+    req, conn = _stats["hf_requests"], _stats["hf_connections"]
+    return {**_stats, "hf_reuse_ratio": round(1 - conn / req, 3) if req else None,
+            "loop_running": bool(_loop and _loop_pid == os.getpid() and _loop.is_running()),
+            "cache": llm_cache.stats(), "breakers": llm_health.stats(), "hedging": hedge_stats()}
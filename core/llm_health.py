@@ -0,0 +1,246 @@
+"""Circuit breakers and health scores for LLM providers / models.
+
+One breaker per target ("hf:<model>", "gemini:<model>"), fed by
+core.llm_gateway on every call and by conduct_ai_ritual's Gemini chats
+(track()). A target whose last calls keep failing is skipped immediately
+instead of waiting out its timeout:
+
+  closed    — calls pass; outcomes go to a rolling window
+  open      — LLM_BREAKER_FAILURES failures in a row, or an error rate of
+              LLM_BREAKER_ERROR_RATE over the window, or a 429 / quota
+              error; calls are refused until the cooldown ends (doubles on
+              every failed probe, quota errors wait LLM_BREAKER_QUOTA_COOLDOWN)
+  half_open — after the cooldown a single probe call passes; success
+              closes the breaker, failure re-opens it
+
+order() / providers() sort fallbacks by state and health (error rate, slow
+answers), keeping the caller's preferred order among equally healthy ones.
+
+State is per process. The bot process publishes stats() to
+data/llm_health.json for /api/admin/db_status (the web process shows its own live).
+"""
+import os
+import json
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Any, List, Iterable
+
+from config import (
+    LLM_BREAKER_FAILURES, LLM_BREAKER_ERROR_RATE, LLM_BREAKER_COOLDOWN,
+    LLM_BREAKER_QUOTA_COOLDOWN, LLM_BREAKER_SLOW_SEC,
+)
+
+logger = logging.getLogger(__name__)
+
+WINDOW = 20              # последних вызовов на цель
+MIN_CALLS = 5            # меньше — доля ошибок ещё ничего не значит
+MAX_COOLDOWN = 600
+STATS_PATH = Path("data") / "llm_health.json"
+
+_STATE_RANK = {"closed": 0, "half_open": 1, "open": 2}
+
+
+class _Breaker:
+    def __init__(self):
+        self.state = "closed"
+        self.window = deque(maxlen=WINDOW)   # True = успех
+        self.streak = 0                      # неудач подряд
+        self.latency = None                  # EWMA успешных, сек
+        self.opened_at = 0.0
+        self.cooldown = LLM_BREAKER_COOLDOWN
+        self.probing = False
+        self.calls = self.failures = self.rejected = self.quota_hits = self.trips = 0
+        self.last_error = None
+
+    def error_rate(self) -> float:
+        return self.window.count(False) / len(self.window) if self.window else 0.0
+
+    def health(self) -> float:
+        h = 1.0 - self.error_rate()
+        if self.latency is not None and self.latency > LLM_BREAKER_SLOW_SEC:
+            h *= 0.5
+        return h
+
+    def ready(self, now: float) -> bool:
+        """Would a call pass now (without taking the half-open probe)?"""
+        if self.state == "closed":
+            return True
+        if self.state == "open":
+            return now - self.opened_at >= self.cooldown
+        return not self.probing
+
+
+_breakers: Dict[str, _Breaker] = {}
+_lock = threading.Lock()
+
+
+def _get(target: str) -> _Breaker:
+    b = _breakers.get(target)
+    if b is None:
+        b = _breakers.setdefault(target, _Breaker())
+    return b
+
+
+def _open(target: str, b: _Breaker, now: float, quota: bool, probe: bool):
+    if probe:
+        b.cooldown = min(MAX_COOLDOWN, b.cooldown * 2)
+    else:
+        b.cooldown = LLM_BREAKER_COOLDOWN
+    if quota:
+        b.cooldown = max(b.cooldown, LLM_BREAKER_QUOTA_COOLDOWN)
+    b.state, b.opened_at, b.probing = "open", now, False
+    b.trips += 1
+    logger.warning(f"🔌 LLM breaker OPEN: {target} for {b.cooldown:.0f}s "
+                   f"({'quota' if quota else f'{b.streak} failures, error rate {b.error_rate():.0%}'})")
+
+
+# ─── Calls ───
+
+def allow(target: str) -> bool:
+    """May a call to target go out now? Takes the half-open probe slot if due."""
+    now = time.time()
+    with _lock:
+        b = _get(target)
+        if b.state == "open" and now - b.opened_at >= b.cooldown:
+            b.state, b.probing = "half_open", False
+            logger.info(f"🔌 LLM breaker HALF-OPEN: {target}")
+        if b.state == "closed":
+            return True
+        if b.state == "half_open" and not b.probing:
+            b.probing = True
+            return True
+        b.rejected += 1
+        return False
+
+
+def record(target: str, ok: bool, latency: float = None, quota: bool = False, error: str = None):
+    """Outcome of a call that allow() let through."""
+    now = time.time()
+    with _lock:
+        b = _get(target)
+        b.calls += 1
+        b.window.append(ok)
+        if ok:
+            b.streak = 0
+            if latency is not None:
+                b.latency = latency if b.latency is None else 0.7 * b.latency + 0.3 * latency
+            if b.state != "closed":
+                logger.info(f"🔌 LLM breaker CLOSED: {target}")
+            b.state, b.probing, b.cooldown = "closed", False, LLM_BREAKER_COOLDOWN
+            return
+        b.failures += 1
+        b.streak += 1
+        b.last_error = (error or "")[:200] or None
+        if quota:
+            b.quota_hits += 1
+        probe = b.state == "half_open" or (b.state == "open" and now - b.opened_at >= b.cooldown)
+        if b.state == "open" and not probe:
+            return  # запоздавший ответ уже открытой цели
+        if (probe or quota or b.streak >= LLM_BREAKER_FAILURES
+                or (len(b.window) >= MIN_CALLS and b.error_rate() >= LLM_BREAKER_ERROR_RATE)):
+            _open(target, b, now, quota, probe)
+
+
+def release(target: str):
+    """The allowed call was cancelled before an outcome: free the probe slot."""
+    with _lock:
+        b = _breakers.get(target)
+        if b is not None and b.state == "half_open":
+            b.probing = False
+
+
+def is_quota_error(e) -> bool:
+    s = str(e)
+    return "429" in s or "RESOURCE_EXHAUSTED" in s or "quota" in s.lower()
+
+
+@contextmanager
+def track(target: str):
+    """Record the outcome of the wrapped call (exceptions are failures and re-raised)."""
+    t0 = time.monotonic()
+    try:
+        yield
+    except Exception as e:
+        record(target, False, quota=is_quota_error(e), error=repr(e))
+        raise
+    record(target, True, time.monotonic() - t0)
+
+
+# ─── Routing ───
+
+def order(targets: Iterable[str], skip_open: bool = True) -> List[str]:
+    """Targets by health, preferred order kept among equals; open ones dropped (skip_open)."""
+    now = time.time()
+    with _lock:
+        ranked = []
+        for i, t in enumerate(targets):
+            b = _breakers.get(t)
+            if b is None:
+                ranked.append((0, -1.0, i, t))  # ещё не вызывали — здорова
+                continue
+            if skip_open and not b.ready(now):
+                continue
+            ranked.append((_STATE_RANK[b.state], -round(b.health(), 1), i, t))
+    return [t for *_, t in sorted(ranked)]
+
+
+def models(provider: str, names: Iterable[str]) -> List[str]:
+    """Model names of a provider in health order, unavailable ones dropped."""
+    prefix = f"{provider}:"
+    return [t[len(prefix):] for t in order(prefix + n for n in names)]
+
+
+def providers(targets: Dict[str, List[str]]) -> List[str]:
+    """Providers in health order: {"hf": [targets], "gemini": [targets]} → ["gemini", "hf"].
+
+    A provider counts by its healthiest available target; one with none left is dropped.
+    """
+    best = {}
+    for provider, ts in targets.items():
+        avail = order(ts)
+        if avail:
+            best[provider] = avail[0]
+    ranked = order(best.values())
+    by_target = {t: p for p, t in best.items()}
+    return [by_target[t] for t in ranked]
+
+
+# ─── Admin ───
+
+def stats() -> Dict[str, Any]:
+    now = time.time()
+    with _lock:
+        return {t: {
+            "state": b.state if b.state != "open" or not b.ready(now) else "open (probe due)",
+            "health": round(b.health(), 2),
+            "error_rate": round(b.error_rate(), 2),
+            "latency_sec": round(b.latency, 2) if b.latency is not None else None,
+            "calls": b.calls, "failures": b.failures, "rejected": b.rejected,
+            "quota_hits": b.quota_hits, "trips": b.trips,
+            "retry_in_sec": round(max(0.0, b.opened_at + b.cooldown - now), 1) if b.state == "open" else None,
+            "last_error": b.last_error,
+        } for t, b in sorted(_breakers.items())}
+
+
+def publish_stats():
+    """Write stats() for the web process (atomic replace)."""
+    try:
+        tmp = STATS_PATH.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"breakers": stats(), "published_at": time.time()}), encoding="utf-8")
+        os.replace(tmp, STATS_PATH)
+    except OSError as e:
+        logger.warning(f"LLM health stats write failed: {e}")
+
+
+def read_stats() -> Dict[str, Any]:
+    """Last breaker stats published by the bot process ({} if none)."""
+    try:
+        data = json.loads(STATS_PATH.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    data["age_sec"] = round(time.time() - data.pop("published_at", 0), 1)
+    return data
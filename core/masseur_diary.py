@@ -5,6 +5,7 @@ import threading
 from typing import Optional, Dict, Any, List
 from pathlib import Path
 from core.supabase_manager import SUPABASE_ENABLED, upsert, _sb_req
+from core import sb_outbox
 
 logger = logging.getLogger(__name__)
 
@@ -59,7 +60,7 @@ def add_diary_entry(chat_id: int, masseur_chat_id: int, entry: dict) -> bool:
         supabase_entry = {k: v for k, v in entry.items()}
         supabase_entry["client_chat_id"] = chat_id
         supabase_entry["session_date"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(entry.get("created_at", time.time())))
-        _sb_req("POST", "diary_entries", supabase_entry)
+        sb_outbox.enqueue("POST", "diary_entries", supabase_entry, entity=f"diary:{chat_id}")
     logger.info(f"Diary entry saved for chat {chat_id} by masseur {masseur_chat_id}")
     return True
 
@@ -102,6 +103,8 @@ def set_masseur(chat_id: int, name: str, specialties: List[str] = None) -> bool:
     }
     with _lock:
         data = _load_json(MASSEURS_PATH)
+        # Расписание (working_hours, break_*) не затираем
+        entry = {**data.get(str(chat_id), {}), **entry}
         data[str(chat_id)] = entry
         _save_json(MASSEURS_PATH, data)
     if SUPABASE_ENABLED:
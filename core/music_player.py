@@ -257,7 +257,7 @@ def ai_search_tracks(query: str) -> List[dict]:
             f"Пример: ambient relaxation ocean sounds\n"
             f"Пример: rock guitar instrumental energetic"
         )
-        ai_result = get_hf_response(ai_prompt)
+        ai_result = get_hf_response(ai_prompt, cache="music_queries")
         if ai_result:
             lines = [l.strip() for l in ai_result.split('\n') if l.strip() and len(l.strip()) > 5]
             queries = lines[:5]
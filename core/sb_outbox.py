@@ -0,0 +1,316 @@
+"""Durable write-behind outbox for Supabase mirroring.
+
+Booking, diary and consultation writes are saved locally first; their
+Supabase mirror requests are appended to a SQLite table (data/outbox.db)
+and the caller returns without waiting on the network. A background thread
+drains the table: inserts into the same table are sent as one array POST,
+failed requests are retried with exponential backoff, and requests of one
+entity (a booking, a client profile) go out strictly in the order they were
+queued — an entity's next request waits until the previous one succeeded.
+
+The bot and the web process share the table; a drain pass holds
+data/outbox.lock, so a queued request is never sent by both of them.
+Requests rejected with a 4xx (or out of attempts) are kept with status
+'dead' for inspection and no longer block their entity. Delivery is
+at-least-once: queue upserts (merge-duplicates) where a row has a natural key.
+"""
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from typing import Optional, Dict, Any, List
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines
+    fcntl = None
+
+from config import SUPABASE_ENABLED, SUPABASE_OUTBOX_BATCH, SUPABASE_OUTBOX_MAX_ATTEMPTS
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = Path("data")
+DATA_DIR.mkdir(parents=True, exist_ok=True)
+
+DB_PATH = DATA_DIR / "outbox.db"
+LOCK_PATH = DATA_DIR / "outbox.lock"
+
+POLL_INTERVAL_SEC = float(os.getenv("OUTBOX_POLL_INTERVAL", "2.0"))
+DEBOUNCE_SEC = 0.2        # собираем пачку перед отправкой
+MAX_BACKOFF_SEC = 300
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS outbox (
+  seq INTEGER PRIMARY KEY AUTOINCREMENT,
+  entity TEXT NOT NULL,
+  method TEXT NOT NULL,
+  path TEXT NOT NULL,
+  prefer TEXT,
+  data TEXT,
+  created_at REAL NOT NULL,
+  attempts INTEGER NOT NULL DEFAULT 0,
+  next_at REAL NOT NULL DEFAULT 0,
+  status TEXT NOT NULL DEFAULT 'pending',
+  last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_status ON outbox(status, seq);
+"""
+
+_local = threading.local()
+_init_lock = threading.Lock()
+_initialized_pid = None
+_drain_lock = threading.Lock()
+_wakeup = threading.Event()
+_worker_pid = None
+_stats = {"enqueued": 0, "sent": 0, "batches": 0, "failed_attempts": 0,
+          "last_error": "", "last_sent_at": 0.0}
+
+
+def _conn() -> sqlite3.Connection:
+    """Per-thread connection (re-opened after fork — web runs in a child process)."""
+    global _initialized_pid
+    pid = os.getpid()
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "pid", None) != pid:
+        conn = sqlite3.connect(str(DB_PATH), timeout=15, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=15000")
+        conn.row_factory = sqlite3.Row
+        _local.conn = conn
+        _local.pid = pid
+    if _initialized_pid != pid:
+        with _init_lock:
+            if _initialized_pid != pid:
+                conn.executescript(SCHEMA_SQL)
+                _initialized_pid = pid
+    return conn
+
+
+class _file_lock:
+    """One drain pass at a time across the bot and web processes."""
+
+    def __enter__(self):
+        _drain_lock.acquire()
+        self._f = None
+        if fcntl is not None:
+            self._f = open(LOCK_PATH, "a")
+            fcntl.flock(self._f, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self._f is not None:
+            fcntl.flock(self._f, fcntl.LOCK_UN)
+            self._f.close()
+        _drain_lock.release()
+        return False
+
+
+# ─── Enqueue ───
+
+def enqueue(method: str, path: str, data=None, prefer: str = None, entity: str = "") -> Optional[int]:
+    """Queue one Supabase REST request. Returns its sequence number.
+
+    entity: ordering key ("booking:123", "profile:42"); requests with the same
+    key are sent one after another in queue order. Empty → no ordering.
+    """
+    if not SUPABASE_ENABLED:
+        return None
+    return enqueue_many([(method, path, data, prefer)], entity=entity)
+
+
+def enqueue_many(requests: List[tuple], entity: str = "") -> Optional[int]:
+    """Queue several (method, path, data, prefer) requests in one transaction."""
+    if not SUPABASE_ENABLED or not requests:
+        return None
+    now = time.time()
+    conn = _conn()
+    seq = None
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for method, path, data, prefer in requests:
+            cur = conn.execute(
+                "INSERT INTO outbox (entity, method, path, prefer, data, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (entity or f"seq:{now}", method.upper(), path, prefer,
+                 json.dumps(data, ensure_ascii=False, default=str) if data is not None else None, now),
+            )
+            seq = cur.lastrowid
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    _stats["enqueued"] += len(requests)
+    _ensure_worker()
+    _wakeup.set()
+    return seq
+
+
+# ─── Drain ───
+
+def _ready_heads(conn: sqlite3.Connection, now: float) -> List[sqlite3.Row]:
+    """Oldest pending request of every entity, if its backoff has expired."""
+    rows = conn.execute(
+        "SELECT * FROM outbox WHERE status = 'pending' ORDER BY seq LIMIT ?",
+        (SUPABASE_OUTBOX_BATCH * 10,),
+    ).fetchall()
+    seen, ready = set(), []
+    for r in rows:
+        if r["entity"] in seen:
+            continue
+        seen.add(r["entity"])
+        if r["next_at"] <= now:
+            ready.append(r)
+    return ready
+
+
+def _groups(rows: List[sqlite3.Row]) -> List[List[sqlite3.Row]]:
+    """Plain inserts into one table (same Prefer, same keys) go out as one array POST."""
+    batches: Dict[tuple, List[sqlite3.Row]] = {}
+    out = []
+    for r in rows:
+        data = json.loads(r["data"]) if r["data"] else None
+        if r["method"] == "POST" and isinstance(data, dict):
+            key = (r["path"], r["prefer"], tuple(sorted(data)))
+            if key not in batches:
+                batches[key] = []
+                out.append(batches[key])
+            if len(batches[key]) < SUPABASE_OUTBOX_BATCH:
+                batches[key].append(r)
+                continue
+        out.append([r])
+    return out
+
+
+def _send(rows: List[sqlite3.Row]):
+    """Send one request or batch. Returns (ok, retryable, error text)."""
+    from core.supabase_manager import _sb_http
+    r0 = rows[0]
+    payload = [json.loads(r["data"]) for r in rows] if len(rows) > 1 else (
+        json.loads(r0["data"]) if r0["data"] else None)
+    try:
+        resp = _sb_http(r0["method"], r0["path"], payload, prefer=r0["prefer"])
+    except Exception as e:
+        return False, True, repr(e)[:300]
+    if resp.status_code < 400:
+        return True, False, ""
+    retryable = resp.status_code in (408, 425, 429) or resp.status_code >= 500
+    return False, retryable, f"{resp.status_code} {resp.text[:300]}"
+
+
+def _mark_sent(conn: sqlite3.Connection, rows: List[sqlite3.Row]):
+    conn.executemany("DELETE FROM outbox WHERE seq = ?", [(r["seq"],) for r in rows])
+    _stats["sent"] += len(rows)
+    _stats["batches"] += 1
+    _stats["last_sent_at"] = time.time()
+
+
+def _mark_failed(conn: sqlite3.Connection, row: sqlite3.Row, retryable: bool, error: str):
+    attempts = row["attempts"] + 1
+    _stats["failed_attempts"] += 1
+    _stats["last_error"] = error
+    if not retryable or attempts >= SUPABASE_OUTBOX_MAX_ATTEMPTS:
+        conn.execute("UPDATE outbox SET status = 'dead', attempts = ?, last_error = ? WHERE seq = ?",
+                     (attempts, error, row["seq"]))
+        logger.error(f"Outbox: giving up on {row['method']} {row['path']} ({row['entity']}): {error}")
+        return
+    delay = min(MAX_BACKOFF_SEC, 2 ** attempts)
+    conn.execute("UPDATE outbox SET attempts = ?, next_at = ?, last_error = ? WHERE seq = ?",
+                 (attempts, time.time() + delay, error, row["seq"]))
+    logger.warning(f"Outbox: {row['method']} {row['path']} failed (attempt {attempts}), retry in {delay}s: {error}")
+
+
+def drain(max_seconds: float = None) -> int:
+    """Send everything that is due now. Returns the number of requests sent."""
+    if not SUPABASE_ENABLED:
+        return 0
+    deadline = time.monotonic() + max_seconds if max_seconds else None
+    sent = 0
+    conn = _conn()
+    with _file_lock():
+        while True:
+            ready = _ready_heads(conn, time.time())
+            if not ready:
+                break
+            for group in _groups(ready):
+                ok, retryable, error = _send(group)
+                if ok:
+                    _mark_sent(conn, group)
+                    sent += len(group)
+                elif len(group) > 1 and not retryable:
+                    # Кто-то из пачки отвергнут — выясняем кто, по одному
+                    for r in group:
+                        ok, retryable, error = _send([r])
+                        if ok:
+                            _mark_sent(conn, [r])
+                            sent += 1
+                        else:
+                            _mark_failed(conn, r, retryable, error)
+                else:
+                    for r in group:
+                        _mark_failed(conn, r, retryable, error)
+            if deadline and time.monotonic() > deadline:
+                break
+    return sent
+
+
+# ─── Background worker ───
+
+def _ensure_worker():
+    """Start the drain thread once per process (web runs in a forked child)."""
+    global _worker_pid, _wakeup
+    pid = os.getpid()
+    if _worker_pid == pid:
+        return
+    if _worker_pid is not None:
+        _wakeup = threading.Event()
+    _worker_pid = pid
+    threading.Thread(target=_worker, daemon=True, name="sb-outbox").start()
+
+
+def _worker():
+    while True:
+        if _wakeup.wait(timeout=POLL_INTERVAL_SEC):
+            time.sleep(DEBOUNCE_SEC)
+        _wakeup.clear()
+        try:
+            drain()
+        except Exception as e:
+            _stats["last_error"] = repr(e)[:300]
+            logger.warning(f"Outbox worker: {e}")
+
+
+def start():
+    """Start draining in this process (picks up requests left from a previous run)."""
+    if SUPABASE_ENABLED:
+        _ensure_worker()
+        _wakeup.set()
+
+
+# ─── Metrics ───
+
+def pending_count() -> int:
+    return _conn().execute("SELECT COUNT(*) FROM outbox WHERE status = 'pending'").fetchone()[0]
+
+
+def stats() -> Dict[str, Any]:
+    """Backlog and lag (shared by both processes) + this process's send counters."""
+    if not SUPABASE_ENABLED:
+        return {"enabled": False}
+    conn = _conn()
+    now = time.time()
+    backlog, oldest, retrying = conn.execute(
+        "SELECT COUNT(*), MIN(created_at), SUM(attempts > 0) FROM outbox WHERE status = 'pending'"
+    ).fetchone()
+    dead = conn.execute("SELECT COUNT(*) FROM outbox WHERE status = 'dead'").fetchone()[0]
+    return {
+        "enabled": True,
+        "backlog": backlog,
+        "retrying": retrying or 0,
+        "dead_total": dead,
+        "lag_sec": round(now - oldest, 1) if oldest else 0,
+        "worker_running": _worker_pid == os.getpid(),
+        **_stats,
+    }
@@ -0,0 +1,344 @@
+"""Shared in-process store for data/user_settings.json.
+
+One dict of per-chat records per process, shared by every handler module
+(messages, massage, booking, vip) and the web endpoints. Writers take the
+record with edit(chat_id), which marks it dirty first, change it in place and
+call touch(chat_id); a background thread coalesces the dirty chats and writes
+them to disk after a short debounce.
+
+The bot (parent) and the web app (forked child) each have their own copy, so
+a flush is a merge: the file is re-read, only the dirty chats are replaced,
+everything else is kept as the other process wrote it. The same thread polls
+the file's mtime and pulls in records changed by the other process (records
+with pending local changes are left alone until they are flushed).
+
+Conversation state (massage_step, massage_waiting_input, specialist_chat,
+booking_state) is additionally indexed per chat, so message filters answer
+from a small dict without touching the records or the disk. The index is
+rebuilt on load and kept current by touch() and reloads.
+"""
+import os
+import json
+import time
+import atexit
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, Any
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = Path("data")
+DATA_DIR.mkdir(parents=True, exist_ok=True)
+
+SETTINGS_PATH = DATA_DIR / "user_settings.json"
+LOCK_PATH = DATA_DIR / "user_settings.lock"
+
+FLUSH_DEBOUNCE_SEC = float(os.getenv("SETTINGS_FLUSH_DEBOUNCE", "0.5"))
+POLL_INTERVAL_SEC = float(os.getenv("SETTINGS_POLL_INTERVAL", "1.0"))
+
+FSM_KEYS = ("massage_step", "massage_waiting_input", "specialist_chat", "booking_state")
+
+_records: Dict[str, dict] = {}
+_fsm: Dict[str, dict] = {}
+_EMPTY: Dict[str, Any] = {}
+_dirty: set = set()
+_loaded = False
+_disk_mtime = 0.0
+_lock = threading.RLock()
+_wakeup = threading.Event()
+_worker_pid = None
+_stats = {"flushes": 0, "flushed_records": 0, "reloads": 0, "errors": 0}
+
+
+# ─── Disk helpers ───
+
+class _file_lock:
+    """Cross-process lock around read-merge-write of the settings file."""
+
+    def __enter__(self):
+        self._f = None
+        if fcntl is not None:
+            self._f = open(LOCK_PATH, "a")
+            fcntl.flock(self._f, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self._f is not None:
+            fcntl.flock(self._f, fcntl.LOCK_UN)
+            self._f.close()
+        return False
+
+
+def _mtime() -> float:
+    try:
+        return SETTINGS_PATH.stat().st_mtime
+    except OSError:
+        return 0.0
+
+
+def _read_disk() -> dict:
+    if not SETTINGS_PATH.exists():
+        return {}
+    try:
+        with open(SETTINGS_PATH, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except (json.JSONDecodeError, OSError) as e:
+        logger.warning(f"Failed to load {SETTINGS_PATH}: {e}")
+        return {}
+
+
+def _write_disk(data: dict):
+    tmp = SETTINGS_PATH.with_suffix(f".json.tmp{os.getpid()}")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, SETTINGS_PATH)
+
+
+def _copy_record(rec) -> Any:
+    """Detached copy of a live record; handlers may mutate it mid-copy."""
+    for _ in range(5):
+        try:
+            return json.loads(json.dumps(rec, ensure_ascii=False))
+        except RuntimeError:
+            time.sleep(0.01)
+    return json.loads(json.dumps(dict(rec), ensure_ascii=False))
+
+
+def _index_chat(cid: str):
+    rec = _records.get(cid)
+    state = {}
+    if isinstance(rec, dict):
+        state = {k: rec[k] for k in FSM_KEYS if rec.get(k) not in (None, "", {})}
+    if state:
+        _fsm[cid] = state
+    else:
+        _fsm.pop(cid, None)
+
+
+def _rebuild_index():
+    _fsm.clear()
+    for cid in list(_records.keys()):
+        _index_chat(cid)
+
+
+def _apply_disk(disk: dict, keep=()):
+    """Take records from disk for every chat without pending local changes.
+
+    Existing record dicts are updated in place so references held by
+    handlers stay valid. Chats in keep are left as they are.
+    """
+    for cid, rec in disk.items():
+        if cid in _dirty or cid in keep:
+            continue
+        cur = _records.get(cid)
+        if isinstance(cur, dict) and isinstance(rec, dict):
+            if cur == rec:
+                continue
+            cur.clear()
+            cur.update(rec)
+        else:
+            _records[cid] = rec
+        _index_chat(cid)
+    for cid in [c for c in _records if c not in disk and c not in _dirty and c not in keep]:
+        del _records[cid]
+        _fsm.pop(cid, None)
+
+
+def _ensure_loaded():
+    global _loaded, _disk_mtime
+    if _loaded:
+        return
+    with _lock:
+        if _loaded:
+            return
+        _disk_mtime = _mtime()
+        _records.update(_read_disk())
+        _rebuild_index()
+        _loaded = True
+        logger.info(f"Settings store: {len(_records)} chats loaded from {SETTINGS_PATH}")
+
+
+# ─── Background flush ───
+
+def _ensure_worker():
+    """Start the flush thread once per process (web runs in a forked child)."""
+    global _worker_pid, _lock, _wakeup, _disk_mtime
+    pid = os.getpid()
+    if _worker_pid == pid:
+        return
+    if _worker_pid is not None:
+        # Forked: the parent's thread and lock state did not come along, and
+        # its pending writes are the parent's to flush, not ours.
+        _lock = threading.RLock()
+        _wakeup = threading.Event()
+        _dirty.clear()
+        _disk_mtime = 0.0
+    _worker_pid = pid
+    threading.Thread(target=_worker, daemon=True, name="settings-flush").start()
+
+
+def _worker():
+    while True:
+        woke = _wakeup.wait(timeout=POLL_INTERVAL_SEC)
+        try:
+            if woke:
+                # Coalesce bursts of touch() into a single write
+                time.sleep(FLUSH_DEBOUNCE_SEC)
+                _wakeup.clear()
+                flush()
+            elif _mtime() != _disk_mtime:
+                reload()
+        except Exception as e:
+            _stats["errors"] += 1
+            logger.warning(f"Settings store worker: {e}")
+
+
+def flush() -> int:
+    """Write dirty chats to disk now. Returns the number of chats written."""
+    global _disk_mtime
+    if not _loaded:
+        return 0
+    with _lock:
+        if not _dirty:
+            return 0
+        dirty = set(_dirty)
+        snapshot = {cid: _copy_record(_records[cid]) if cid in _records else None for cid in dirty}
+        _dirty.difference_update(dirty)
+    try:
+        with _file_lock():
+            disk = _read_disk()
+            for cid, rec in snapshot.items():
+                if rec is None:
+                    disk.pop(cid, None)
+                else:
+                    disk[cid] = rec
+            _write_disk(disk)
+            with _lock:
+                _disk_mtime = _mtime()
+                # Только что записанные чаты не трогаем: живая запись не старее
+                # снимка, а правка могла прийти уже после него
+                _apply_disk(disk, keep=dirty)
+    except Exception as e:
+        with _lock:
+            _dirty.update(dirty)
+        _stats["errors"] += 1
+        logger.error(f"Failed to save settings: {e}")
+        return 0
+    _stats["flushes"] += 1
+    _stats["flushed_records"] += len(snapshot)
+    return len(snapshot)
+
+
+def reload():
+    """Pull in changes written by the other process."""
+    global _disk_mtime
+    _ensure_loaded()
+    with _lock:
+        _disk_mtime = _mtime()
+        _apply_disk(_read_disk())
+    _stats["reloads"] += 1
+
+
+atexit.register(flush)
+
+
+# ─── Public API ───
+
+def records() -> Dict[str, dict]:
+    """The live chat_id → settings dict, for reading. To change a record use
+    edit() (or set_user_data / pop_user_data), then touch()."""
+    _ensure_loaded()
+    _ensure_worker()
+    return _records
+
+
+def touch(chat_ids=None):
+    """Mark chat records as changed and schedule a flush.
+
+    chat_ids: one chat id, an iterable of them, or None for every chat.
+    """
+    _ensure_loaded()
+    _ensure_worker()
+    if chat_ids is None:
+        ids = list(_records.keys())
+    elif isinstance(chat_ids, (str, int)):
+        ids = [chat_ids]
+    else:
+        ids = list(chat_ids)
+    with _lock:
+        for c in ids:
+            cid = str(c)
+            _dirty.add(cid)
+            _index_chat(cid)
+    _wakeup.set()
+
+
+def get_user_data(chat_id) -> dict:
+    """Record for chat_id (live dict; empty dict if the chat is unknown)."""
+    return records().get(str(chat_id), {})
+
+
+def edit(chat_id) -> dict:
+    """Live record for chat_id (created if missing), marked dirty *before* the
+    caller changes it in place, so a reload or flush running meanwhile does not
+    overwrite the edit with the disk copy. Call touch(chat_id) when done.
+    """
+    _ensure_loaded()
+    _ensure_worker()
+    cid = str(chat_id)
+    with _lock:
+        _dirty.add(cid)
+        return _records.setdefault(cid, {})
+
+
+def put_user_data(chat_id, rec: dict):
+    """Replace the whole record for chat_id."""
+    records()  # после fork _lock пересоздаётся здесь
+    with _lock:
+        cur = edit(chat_id)
+        if cur is not rec:
+            cur.clear()
+            cur.update(rec)
+        touch(chat_id)
+
+
+def set_user_data(chat_id, key: str, value):
+    records()
+    with _lock:
+        edit(chat_id)[key] = value
+        touch(chat_id)
+
+
+def pop_user_data(chat_id, key: str, default=None):
+    recs = records()
+    with _lock:
+        rec = recs.get(str(chat_id))
+        if not rec or key not in rec:
+            return default
+        value = edit(chat_id).pop(key)
+        touch(chat_id)
+    return value
+
+
+def conversation_state(chat_id) -> dict:
+    """Indexed FSM fields for a chat (only the non-empty ones). Read-only."""
+    if not _loaded:
+        _ensure_loaded()
+    return _fsm.get(str(chat_id), _EMPTY)
+
+
+def stats() -> Dict[str, Any]:
+    return {
+        "chats": len(_records),
+        "active_conversations": len(_fsm),
+        "dirty": len(_dirty),
+        "path": str(SETTINGS_PATH),
+        **_stats,
+    }
@@ -0,0 +1,130 @@
+"""Asyncio twin of the Supabase REST layer for the FastAPI process.
+
+Same contract as supabase_manager._sb_req / query / upsert (parsed JSON or
+None, never raises), same retry policy and the same http_stats() counters,
+but requests go through one aiohttp.ClientSession per event loop, so a slow
+Supabase call suspends only the request waiting on it instead of the whole
+uvicorn loop. aiohttp is already installed as an aiogram dependency.
+"""
+import json
+import time
+import asyncio
+import logging
+import urllib.parse
+
+import aiohttp
+
+from config import (
+    SUPABASE_URL, SUPABASE_POOL_SIZE, SUPABASE_CONNECT_TIMEOUT,
+    SUPABASE_READ_TIMEOUT, SUPABASE_RETRIES, SUPABASE_RETRY_BACKOFF,
+)
+from core.supabase_manager import (
+    _sb_headers, _record_latency, _retries_any, _http_stats, _RETRY_STATUSES,
+)
+
+logger = logging.getLogger(__name__)
+
+_session_obj = None
+_session_loop = None
+
+# Для reuse_ratio в supabase_manager.http_stats()
+async_pool_stats = {"requests": 0, "connections": 0}
+
+
+async def _on_request_start(session, ctx, params):
+    async_pool_stats["requests"] += 1
+
+
+async def _on_connection_create(session, ctx, params):
+    async_pool_stats["connections"] += 1
+
+
+def _session() -> aiohttp.ClientSession:
+    """Keep-alive session bound to the running loop (re-created if the loop changed)."""
+    global _session_obj, _session_loop
+    loop = asyncio.get_running_loop()
+    if _session_obj is None or _session_obj.closed or _session_loop is not loop:
+        trace = aiohttp.TraceConfig()
+        trace.on_request_start.append(_on_request_start)
+        trace.on_connection_create_end.append(_on_connection_create)
+        _session_obj = aiohttp.ClientSession(
+            headers=_sb_headers(),
+            connector=aiohttp.TCPConnector(limit=SUPABASE_POOL_SIZE, keepalive_timeout=60),
+            timeout=aiohttp.ClientTimeout(sock_connect=SUPABASE_CONNECT_TIMEOUT,
+                                          sock_read=SUPABASE_READ_TIMEOUT),
+            trace_configs=[trace],
+        )
+        _session_loop = loop
+    return _session_obj
+
+
+async def close():
+    """Close the session (FastAPI shutdown)."""
+    global _session_obj
+    if _session_obj is not None and not _session_obj.closed:
+        await _session_obj.close()
+    _session_obj = None
+
+
+async def _sb_http(method: str, path: str, data=None, prefer: str = None):
+    """One REST request with retries. Returns (status, body bytes); raises on final failure."""
+    url = f"{SUPABASE_URL.rstrip('/')}/rest/v1/{path.lstrip('/')}"
+    headers = {"Prefer": prefer} if prefer else None
+    retry_any = _retries_any(method, prefer)
+    attempt = 0
+    while True:
+        t0 = time.monotonic()
+        status, body, err = None, b"", None
+        try:
+            async with _session().request(method, url, json=data, headers=headers) as resp:
+                status, body = resp.status, await resp.read()
+        except aiohttp.ClientConnectorError as e:
+            err, retryable = e, True  # не дошло до сервера — повтор безопасен
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            err, retryable = e, retry_any
+        else:
+            retryable = retry_any and status in _RETRY_STATUSES
+        _record_latency((time.monotonic() - t0) * 1000)
+        if not retryable or attempt >= SUPABASE_RETRIES:
+            if err is not None:
+                _http_stats["errors"] += 1
+                raise err
+            if status >= 400:
+                _http_stats["errors"] += 1
+            return status, body
+        attempt += 1
+        _http_stats["retries"] += 1
+        await asyncio.sleep(SUPABASE_RETRY_BACKOFF * (2 ** (attempt - 1)))
+
+
+async def _sb_req(method: str, path: str, data=None, prefer: str = None):
+    try:
+        status, body = await _sb_http(method, path, data, prefer=prefer)
+        if status >= 400 and status != 201:
+            logger.warning(f"Supabase {method} {path}: {status} {body[:200].decode('utf-8', 'replace')}")
+            return None
+        return json.loads(body) if body else {}
+    except Exception as e:
+        logger.warning(f"Supabase request failed: {e!r}")
+        return None
+
+
+async def check_tables_exist() -> bool:
+    resp = await _sb_req("GET", "profiles?limit=1")
+    return isinstance(resp, list)
+
+
+async def query(table: str, params: dict = None) -> list:
+    """Query rows from a table."""
+    path = f"{table}?{urllib.parse.urlencode(params)}" if params else table
+    result = await _sb_req("GET", path)
+    return result if isinstance(result, list) else []
+
+
+async def upsert(table: str, data, conflict_col: str = "chat_id"):
+    """Upsert via REST API; same fallback as the sync upsert()."""
+    resp = await _sb_req("POST", f"{table}?on_conflict={conflict_col}", data,
+                         prefer="resolution=merge-duplicates")
+    if resp is None:
+        resp = await _sb_req("POST", table, data, prefer="resolution=merge-duplicates")
+    return resp
@@ -1,10 +1,22 @@
 import os
 import json
+import time
 import logging
+import hashlib
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 import requests as req
+from requests.adapters import HTTPAdapter
 
-from config import SUPABASE_URL, SUPABASE_SERVICE_KEY, SUPABASE_ENABLED, DATA_DIR
+from config import (
+    SUPABASE_URL, SUPABASE_SERVICE_KEY, SUPABASE_ENABLED, DATA_DIR,
+    SUPABASE_POOL_SIZE, SUPABASE_CONNECT_TIMEOUT, SUPABASE_READ_TIMEOUT,
+    SUPABASE_RETRIES, SUPABASE_RETRY_BACKOFF,
+    SUPABASE_MIGRATE_CHUNK, SUPABASE_MIGRATE_WORKERS,
+    SUPABASE_COUNT_MODE, SUPABASE_STATS_TTL,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -113,6 +125,7 @@ ALTER TABLE masseur_settings DROP CONSTRAINT IF EXISTS masseur_settings_chat_id_
 ALTER TABLE masseur_settings ADD COLUMN IF NOT EXISTS name TEXT DEFAULT '';
 ALTER TABLE masseur_settings ADD COLUMN IF NOT EXISTS specialties JSONB DEFAULT '[]';
 ALTER TABLE masseur_settings ADD COLUMN IF NOT EXISTS created_at DOUBLE PRECISION DEFAULT 0;
+ALTER TABLE masseur_settings ADD COLUMN IF NOT EXISTS timezone TEXT DEFAULT '';
 ALTER TABLE bookings ADD COLUMN IF NOT EXISTS client_username TEXT DEFAULT '';
 ALTER TABLE bookings ADD COLUMN IF NOT EXISTS slot_date TEXT DEFAULT '';
 ALTER TABLE bookings ADD COLUMN IF NOT EXISTS start_time TEXT DEFAULT '';
@@ -132,6 +145,9 @@ CREATE INDEX IF NOT EXISTS idx_slots_masseur ON time_slots(masseur_chat_id);
 CREATE INDEX IF NOT EXISTS idx_slots_status ON time_slots(status);
 CREATE INDEX IF NOT EXISTS idx_bookings_client ON bookings(client_chat_id);
 CREATE INDEX IF NOT EXISTS idx_bookings_masseur ON bookings(masseur_chat_id);
+-- одна активная запись на время массажиста (последним: упадёт на старых дублях, не трогая остальное)
+CREATE UNIQUE INDEX IF NOT EXISTS uq_bookings_active_slot ON bookings(masseur_chat_id, slot_date, start_time)
+  WHERE status IN ('pending', 'confirmed');
 """
 
 
@@ -143,10 +159,118 @@ def _sb_headers():
     }
 
 
-def _sb_req(method: str, path: str, data: dict = None):
+# ─── HTTP session (keep-alive pool, shared by every Supabase call) ───
+
+_RETRY_STATUSES = {429, 502, 503, 504}
+_IDEMPOTENT = {"GET", "HEAD", "DELETE", "PUT", "PATCH"}
+
+_session_obj = None
+_session_pid = None
+_session_lock = threading.Lock()
+_http_stats = {"requests": 0, "errors": 0, "retries": 0, "total_ms": 0.0, "max_ms": 0.0}
+_latencies = deque(maxlen=500)
+
+
+def _session() -> req.Session:
+    """Pooled keep-alive session, re-created after fork (web runs in a child process)."""
+    global _session_obj, _session_pid
+    pid = os.getpid()
+    if _session_obj is not None and _session_pid == pid:
+        return _session_obj
+    with _session_lock:
+        if _session_obj is None or _session_pid != pid:
+            s = req.Session()
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=SUPABASE_POOL_SIZE, max_retries=0)
+            s.mount("https://", adapter)
+            s.mount("http://", adapter)
+            s.headers.update(_sb_headers())
+            _session_obj, _session_pid = s, pid
+    return _session_obj
+
+
+def _record_latency(ms: float):
+    _http_stats["requests"] += 1
+    _http_stats["total_ms"] += ms
+    _http_stats["max_ms"] = max(_http_stats["max_ms"], ms)
+    _latencies.append(ms)
+
+
+def _retries_any(method: str, prefer: str = None) -> bool:
+    """May a request with this method/Prefer be re-sent after the server saw it?"""
+    return method.upper() in _IDEMPOTENT or "merge-duplicates" in (prefer or "")
+
+
+def _sb_http(method: str, path: str, data=None, prefer: str = None, timeout=None) -> req.Response:
+    """Send one REST request through the pooled session.
+
+    Connection errors are retried for every method (the request never reached
+    the server); read timeouts and 429/5xx only for idempotent ones and for
+    upserts (Prefer: resolution=merge-duplicates). Raises on final failure.
+    """
     url = f"{SUPABASE_URL.rstrip('/')}/rest/v1/{path.lstrip('/')}"
+    headers = {"Prefer": prefer} if prefer else None
+    retry_any = _retries_any(method, prefer)
+    timeout = timeout or (SUPABASE_CONNECT_TIMEOUT, SUPABASE_READ_TIMEOUT)
+    attempt = 0
+    while True:
+        t0 = time.monotonic()
+        try:
+            resp = _session().request(method, url, json=data, headers=headers, timeout=timeout)
+            err = None
+        except (req.ConnectionError, req.Timeout) as e:
+            resp, err = None, e
+        _record_latency((time.monotonic() - t0) * 1000)
+        if resp is not None:
+            retryable = retry_any and resp.status_code in _RETRY_STATUSES
+        else:
+            # ConnectionError (incl. ConnectTimeout): nothing was processed server-side
+            retryable = retry_any or isinstance(err, req.ConnectionError)
+        if not retryable or attempt >= SUPABASE_RETRIES:
+            if err is not None:
+                _http_stats["errors"] += 1
+                raise err
+            if resp.status_code >= 400:
+                _http_stats["errors"] += 1
+            return resp
+        attempt += 1
+        _http_stats["retries"] += 1
+        time.sleep(SUPABASE_RETRY_BACKOFF * (2 ** (attempt - 1)))
+
+
+def http_stats() -> dict:
+    """Request counters, latency and connection reuse of the Supabase session."""
+    n = _http_stats["requests"]
+    lat = sorted(_latencies)
+    connections = 0
+    pool_requests = 0
+    if _session_obj is not None and _session_pid == os.getpid():
+        for adapter in set(_session_obj.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools[key]
+                connections += getattr(pool, "num_connections", 0)
+                pool_requests += getattr(pool, "num_requests", 0)
     try:
-        resp = req.request(method, url, json=data, headers=_sb_headers(), timeout=15)
+        from core.supabase_async import async_pool_stats
+        pool_requests += async_pool_stats["requests"]
+        connections += async_pool_stats["connections"]
+    except ImportError:
+        pass
+    return {
+        **_http_stats,
+        "total_ms": round(_http_stats["total_ms"], 1),
+        "max_ms": round(_http_stats["max_ms"], 1),
+        "avg_ms": round(_http_stats["total_ms"] / n, 1) if n else 0,
+        "p50_ms": round(lat[len(lat) // 2], 1) if lat else 0,
+        "p95_ms": round(lat[min(len(lat) - 1, int(len(lat) * 0.95))], 1) if lat else 0,
+        "connections_opened": connections,
+        "reuse_ratio": round(1 - connections / pool_requests, 3) if pool_requests else 0,
+    }
+
+
+def _sb_req(method: str, path: str, data=None, prefer: str = None):
+    try:
+        resp = _sb_http(method, path, data, prefer=prefer)
         if resp.status_code >= 400 and resp.status_code != 201:
             logger.warning(f"Supabase {method} {path}: {resp.status_code} {resp.text[:200]}")
             return None
@@ -238,11 +362,8 @@ def init_schema():
 def upsert(table: str, data: dict, conflict_col: str = "chat_id"):
     """Upsert a row via REST API (requires unique constraint on conflict_col)."""
     def _try(data, path_override=None):
-        url = f"{SUPABASE_URL.rstrip('/')}/rest/v1/{(path_override or table).lstrip('/')}"
-        headers = _sb_headers()
-        headers["Prefer"] = "resolution=merge-duplicates"
         try:
-            resp = req.request("POST", url, json=data, headers=headers, timeout=15)
+            resp = _sb_http("POST", path_override or table, data, prefer="resolution=merge-duplicates")
             if resp.status_code >= 400:
                 logger.warning(f"Supabase upsert {path_override or table}: {resp.status_code} {resp.text[:200]}")
                 return None
@@ -268,25 +389,261 @@ def query(table: str, params: dict = None) -> list:
     return result if isinstance(result, list) else []
 
 
-def migrate_from_json():
-    """One-time migration from JSON files to Supabase."""
+RESTORE_PAGE_SIZE = 1000  # PostgREST max-rows по умолчанию
+
+
+def query_pages(table: str, order: str = "id", params: dict = None, page_size: int = RESTORE_PAGE_SIZE):
+    """Yield a table page by page (limit/offset over a stable order).
+
+    Unlike query(), which silently stops at the server's max-rows and answers
+    [] on any error, this walks the whole table and raises RuntimeError when
+    a page fails, so a broken read is never mistaken for the end of the table.
+    """
+    import urllib.parse
+    offset = 0
+    while True:
+        qs = urllib.parse.urlencode({**(params or {}), "order": order, "limit": page_size, "offset": offset})
+        page = _sb_req("GET", f"{table}?{qs}")
+        if not isinstance(page, list):
+            raise RuntimeError(f"{table}: page at offset {offset} failed")
+        if page:
+            yield page
+        if len(page) < page_size:
+            return
+        offset += page_size
+
+
+def query_all(table: str, order: str = "id", params: dict = None) -> list:
+    """The whole table in one list (query_pages collected; raises the same way)."""
+    rows = []
+    for page in query_pages(table, order, params):
+        rows.extend(page)
+    return rows
+
+
+# ─── Table statistics ───
+
+STATS_TABLES = ("profiles", "consultations", "diary_entries",
+                "bookings", "masseur_settings", "admin_users")
+
+_stats_cache = {"at": 0.0, "mode": None, "tables": {}}
+_stats_lock = threading.Lock()
+
+
+def count_rows(table: str, mode: str = None) -> int:
+    """Row count without fetching rows: HEAD + Prefer: count=<mode>.
+
+    PostgREST answers with Content-Range: 0-0/<total> (or */<total>).
+    mode: exact | estimated (planner estimate above max-rows) | planned.
+    """
+    mode = mode or SUPABASE_COUNT_MODE
+    resp = _sb_http("HEAD", f"{table}?select=*", prefer=f"count={mode}")
+    if resp.status_code >= 400:
+        raise RuntimeError(f"HTTP {resp.status_code}")
+    total = resp.headers.get("Content-Range", "").rpartition("/")[2]
+    if not total.isdigit():
+        raise RuntimeError(f"no count in Content-Range: {resp.headers.get('Content-Range')!r}")
+    return int(total)
+
+
+def table_stats(mode: str = None, max_age: float = None) -> dict:
+    """Row counts of all tables ({table: int | "err: …"}), cached for max_age seconds."""
+    mode = mode or SUPABASE_COUNT_MODE
+    max_age = SUPABASE_STATS_TTL if max_age is None else max_age
+    with _stats_lock:
+        if _stats_cache["mode"] == mode and time.time() - _stats_cache["at"] < max_age:
+            return dict(_stats_cache["tables"])
+
+    def _one(table):
+        try:
+            return count_rows(table, mode)
+        except Exception as e:
+            return f"err: {e}"
+
+    with ThreadPoolExecutor(max_workers=len(STATS_TABLES)) as ex:
+        tables = dict(zip(STATS_TABLES, ex.map(_one, STATS_TABLES)))
+    with _stats_lock:
+        _stats_cache.update(at=time.time(), mode=mode, tables=tables)
+    return dict(tables)
+
+
+def local_stats() -> dict:
+    """Sizes of the local stores in data/ (file bytes + SQLite row counts)."""
+    files = {}
+    for name in sorted(os.listdir(DATA_DIR)) if os.path.isdir(DATA_DIR) else []:
+        if name.endswith((".json", ".db")):
+            try:
+                files[name] = os.path.getsize(os.path.join(DATA_DIR, name))
+            except OSError:
+                pass
+    out = {"files_bytes": files}
+    try:
+        from core import booking_store
+        out["booking_store"] = booking_store.count_rows()
+    except Exception as e:
+        out["booking_store"] = f"err: {e}"
+    try:
+        from core import settings_store, conversation_store
+        out["settings_chats"] = settings_store.stats()["chats"]
+        out["conversations"] = conversation_store.stats()
+    except Exception as e:
+        out["settings_chats"] = f"err: {e}"
+    return out
+
+
+# ─── Bulk migration ───
+
+MIGRATE_STATE_PATH = os.path.join(DATA_DIR, "migrate_state.json")
+REPORTS_PATH = os.path.join(DATA_DIR, "supabase_reports.json")
+
+
+def _save_report(kind: str, report: dict):
+    """Persist the last migrate/restore report (they run in the bot process,
+    /api/admin/db_status is served by the web process)."""
+    try:
+        data = get_reports()
+        data[kind] = {**report, "finished_at": time.strftime("%Y-%m-%d %H:%M:%S")}
+        with open(REPORTS_PATH, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+    except Exception as e:
+        logger.warning(f"Failed to save {REPORTS_PATH}: {e}")
+
+
+def get_reports() -> dict:
+    if not os.path.exists(REPORTS_PATH):
+        return {}
+    try:
+        with open(REPORTS_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+class _MigrateState:
+    """Committed chunks per table, so an interrupted migration resumes.
+
+    A table's entry is keyed by a fingerprint of its rows: if the local data
+    changed since the interrupted run, that table starts over. The entry is
+    dropped once every chunk of the table is committed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.data = {}
+        if os.path.exists(MIGRATE_STATE_PATH):
+            try:
+                with open(MIGRATE_STATE_PATH, "r", encoding="utf-8") as f:
+                    self.data = json.load(f)
+            except Exception as e:
+                logger.warning(f"Failed to load {MIGRATE_STATE_PATH}: {e}")
+
+    def _save(self):
+        tmp = MIGRATE_STATE_PATH + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.data, f)
+        os.replace(tmp, MIGRATE_STATE_PATH)
+
+    def done_chunks(self, table: str, fingerprint: str) -> set:
+        entry = self.data.get(table)
+        if not entry or entry.get("fingerprint") != fingerprint:
+            return set()
+        return set(entry.get("done", []))
+
+    def commit(self, table: str, fingerprint: str, idx: int):
+        with self._lock:
+            entry = self.data.get(table)
+            if not entry or entry.get("fingerprint") != fingerprint:
+                entry = self.data[table] = {"fingerprint": fingerprint, "done": []}
+            entry["done"].append(idx)
+            self._save()
+
+    def finish(self, table: str):
+        with self._lock:
+            if self.data.pop(table, None) is not None:
+                self._save()
+
+
+def _chunks(rows: list, size: int) -> list:
+    """Split rows into chunks whose objects share one key set (PostgREST bulk requirement)."""
+    groups = {}
+    for r in rows:
+        groups.setdefault(tuple(sorted(r)), []).append(r)
+    out = []
+    for group in groups.values():
+        out.extend(group[i:i + size] for i in range(0, len(group), size))
+    return out
+
+
+def _bulk_write(table: str, rows: list, conflict_col: str = None, state: _MigrateState = None,
+                chunk_size: int = None, workers: int = None) -> dict:
+    """Write rows in chunks, `workers` chunks in flight. conflict_col=None → plain insert."""
+    chunk_size = chunk_size or SUPABASE_MIGRATE_CHUNK
+    workers = workers or SUPABASE_MIGRATE_WORKERS
+    chunks = _chunks(rows, chunk_size)
+    fingerprint = hashlib.sha1(json.dumps(chunks, sort_keys=True, default=str).encode()).hexdigest()
+    done = state.done_chunks(table, fingerprint) if state else set()
+    todo = [i for i in range(len(chunks)) if i not in done]
+    report = {"rows": len(rows), "chunks": len(chunks), "resumed_chunks": len(done),
+              "written_rows": 0, "failed_chunks": 0, "seconds": 0.0, "rows_per_sec": 0.0}
+    if not todo:
+        if state:
+            state.finish(table)
+        return report
+
+    def _send(idx):
+        chunk = chunks[idx]
+        if conflict_col:
+            ok = upsert(table, chunk, conflict_col) is not None
+        else:
+            ok = _sb_req("POST", table, chunk) is not None
+        if ok and state:
+            state.commit(table, fingerprint, idx)
+        return idx, ok
+
+    t0 = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for idx, ok in pool.map(_send, todo):
+            if ok:
+                report["written_rows"] += len(chunks[idx])
+            else:
+                report["failed_chunks"] += 1
+    elapsed = time.monotonic() - t0
+    report["seconds"] = round(elapsed, 2)
+    report["rows_per_sec"] = round(report["written_rows"] / elapsed, 1) if elapsed else 0.0
+    if state and not report["failed_chunks"]:
+        state.finish(table)
+    logger.info(
+        f"Migrated {table}: {report['written_rows']}/{len(rows)} rows in {len(todo)} chunks, "
+        f"{report['seconds']}s ({report['rows_per_sec']} rows/s), "
+        f"resumed {len(done)}, failed {report['failed_chunks']}"
+    )
+    return report
+
+
+def migrate_from_json(chunk_size: int = None, workers: int = None) -> dict:
+    """Migration from JSON files to Supabase in bulk chunks. Returns per-table report."""
     if not SUPABASE_ENABLED:
-        return
+        return {}
 
     if not check_tables_exist():
         logger.warning("Tables don't exist, skipping migration")
-        return
+        return {}
+
+    state = _MigrateState()
+    report = {}
 
-    # 1. Profiles (from user_settings or client_profiles)
-    migrated_profiles = 0
+    # 1. Profiles (from user_settings, then client_profiles on top — it has is_test)
+    profiles = {}
     settings_path = os.path.join(DATA_DIR, "user_settings.json")
+    from core import settings_store
+    settings_store.flush()
     if os.path.exists(settings_path):
         try:
             with open(settings_path, "r", encoding="utf-8") as f:
                 users = json.load(f)
             for cid_str, data in users.items():
                 q = data.get("massage_questionnaire") or {}
-                upsert("profiles", {
+                profiles[int(cid_str)] = {
                     "chat_id": int(cid_str),
                     "first_name": data.get("first_name", ""),
                     "username": data.get("username", ""),
@@ -294,20 +651,19 @@ def migrate_from_json():
                     "full_name": q.get("full_name", ""),
                     "has_questionnaire": bool(q),
                     "questionnaire_data": q,
-                })
-                migrated_profiles += 1
+                }
         except Exception as e:
             logger.warning(f"Profile migration (user_settings): {e}")
 
-    # Also migrate from client_profiles.json (has is_test flag)
     prof_path = os.path.join(DATA_DIR, "client_profiles.json")
+    client_profiles = {}
     if os.path.exists(prof_path):
         try:
             with open(prof_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            for cid_str, profile in data.items():
+                client_profiles = json.load(f)
+            for cid_str, profile in client_profiles.items():
                 q = profile.get("latest_questionnaire") or {}
-                upsert("profiles", {
+                profiles.setdefault(int(cid_str), {}).update({
                     "chat_id": int(cid_str),
                     "first_name": profile.get("first_name", ""),
                     "phone": q.get("phone", ""),
@@ -316,46 +672,36 @@ def migrate_from_json():
                     "is_test": profile.get("is_test", False),
                     "questionnaire_data": q,
                 })
-                migrated_profiles += 1
         except Exception as e:
             logger.warning(f"Profile migration (client_profiles): {e}")
-    if migrated_profiles:
-        logger.info(f"Migrated {migrated_profiles} profiles")
+    if profiles:
+        report["profiles"] = _bulk_write("profiles", list(profiles.values()), "chat_id", state, chunk_size, workers)
 
-    # 2. Consultations (plain POST — no unique constraint conflict to handle)
-    prof_path = os.path.join(DATA_DIR, "client_profiles.json")
-    migrated_cons = 0
-    if os.path.exists(prof_path):
-        try:
-            with open(prof_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            for cid_str, profile in data.items():
-                for cons in profile.get("consultations", []):
-                    raw_date = cons.get("date", "")
-                    # Convert Unix timestamp to ISO format
-                    if isinstance(raw_date, (int, float)) and raw_date > 1e9:
-                        from datetime import datetime, timezone
-                        raw_date = datetime.fromtimestamp(raw_date, tz=timezone.utc).isoformat()
-                    elif not raw_date:
-                        raw_date = None
-                    result = _sb_req("POST", "consultations", {
-                        "chat_id": int(cid_str),
-                        "consultation_date": raw_date,
-                        "recommended_technique": cons.get("recommended_technique", ""),
-                        "music_genre": cons.get("music_genre", ""),
-                        "complaints": cons.get("complaints", ""),
-                        "contraindications": cons.get("contraindications", []),
-                        "photo_count": cons.get("photo_count", 0),
-                        "video_count": cons.get("video_count", 0),
-                        "is_test": profile.get("is_test", False),
-                        "questionnaire_snapshot": cons.get("questionnaire_snapshot", {}),
-                    })
-                    if result is not None:
-                        migrated_cons += 1
-            if migrated_cons:
-                logger.info(f"Migrated {migrated_cons} consultations")
-        except Exception as e:
-            logger.warning(f"Consultation migration: {e}")
+    # 2. Consultations (plain insert — resume state keeps them from being sent twice)
+    from datetime import datetime, timezone
+    cons_rows = []
+    for cid_str, profile in client_profiles.items():
+        for cons in profile.get("consultations", []):
+            raw_date = cons.get("date", "")
+            # Convert Unix timestamp to ISO format
+            if isinstance(raw_date, (int, float)) and raw_date > 1e9:
+                raw_date = datetime.fromtimestamp(raw_date, tz=timezone.utc).isoformat()
+            elif not raw_date:
+                raw_date = None
+            cons_rows.append({
+                "chat_id": int(cid_str),
+                "consultation_date": raw_date,
+                "recommended_technique": cons.get("recommended_technique", ""),
+                "music_genre": cons.get("music_genre", ""),
+                "complaints": cons.get("complaints", ""),
+                "contraindications": cons.get("contraindications", []),
+                "photo_count": cons.get("photo_count", 0),
+                "video_count": cons.get("video_count", 0),
+                "is_test": profile.get("is_test", False),
+                "questionnaire_snapshot": cons.get("questionnaire_snapshot", {}),
+            })
+    if cons_rows:
+        report["consultations"] = _bulk_write("consultations", cons_rows, None, state, chunk_size, workers)
 
     # 3. Admin users
     admin_path = os.path.join(DATA_DIR, "admin_ids_extras.json")
@@ -363,12 +709,10 @@ def migrate_from_json():
         try:
             with open(admin_path, "r", encoding="utf-8") as f:
                 admins = json.load(f)
-            for cid_str, info in admins.items():
-                upsert("admin_users", {
-                    "chat_id": int(cid_str),
-                    "username": info.get("username", ""),
-                })
-            logger.info(f"Migrated {len(admins)} admin users")
+            rows = [{"chat_id": int(cid_str), "username": info.get("username", "")}
+                    for cid_str, info in admins.items()]
+            if rows:
+                report["admin_users"] = _bulk_write("admin_users", rows, "chat_id", state, chunk_size, workers)
         except Exception as e:
             logger.warning(f"Admin migration: {e}")
 
@@ -378,72 +722,119 @@ def migrate_from_json():
         try:
             with open(masseurs_path, "r", encoding="utf-8") as f:
                 masseurs = json.load(f)
-            for cid_str, info in masseurs.items():
-                upsert("masseur_settings", {
-                    "chat_id": int(cid_str),
-                    "name": info.get("name", ""),
-                    "specialties": info.get("specialties", []),
-                    "created_at": info.get("created_at", 0),
-                })
-            logger.info(f"Migrated {len(masseurs)} masseurs")
+            rows = [{
+                "chat_id": int(cid_str),
+                "name": info.get("name", ""),
+                "specialties": info.get("specialties", []),
+                "created_at": info.get("created_at", 0),
+            } for cid_str, info in masseurs.items()]
+            if rows:
+                report["masseur_settings"] = _bulk_write("masseur_settings", rows, "chat_id", state, chunk_size, workers)
         except Exception as e:
             logger.warning(f"Masseur migration: {e}")
 
+    _save_report("migration", report)
+    return report
 
-def restore_from_supabase():
+
+def _parse_json_field(value, default):
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except Exception:
+            return default
+    return value if isinstance(value, type(default)) else default
+
+
+def restore_from_supabase() -> dict:
     """Pull data FROM Supabase TO JSON files.
     
     Runs after migrate_from_json(). On HF Spaces rebuild (empty data/),
     this repopulates JSON files from Supabase so the bot sees all data.
+    Every table is read once, page by page; consultations are joined to
+    profiles in memory. Returns per-step rows/seconds (also logged).
     """
     if not SUPABASE_ENABLED:
-        return
+        return {}
     if not check_tables_exist():
         logger.info("Supabase tables don't exist — nothing to restore")
-        return
-
-    from datetime import datetime, timezone
+        return {}
+    # Local writes not yet mirrored would be overwritten by older Supabase rows
+    from core import sb_outbox
+    sb_outbox.drain(max_seconds=30)
+    backlog = sb_outbox.pending_count()
+    if backlog:
+        logger.warning(f"Restore skipped: {backlog} local changes still queued for Supabase")
+        report = {"skipped": f"outbox backlog {backlog}"}
+        _save_report("restore", report)
+        return report
+
+    report = {}
+    t_start = time.monotonic()
+
+    def _step(name, t0, rows):
+        report[name] = {"rows": rows, "seconds": round(time.monotonic() - t0, 2)}
+
+    def _failed(name, t0, e):
+        """A page failed: the step writes nothing and the local copy stays as it was."""
+        logger.warning(f"Restore {name} skipped, local data kept: {e}")
+        report[name] = {"error": str(e), "seconds": round(time.monotonic() - t0, 2)}
+
+    def _fetch(name, table, order):
+        t0 = time.monotonic()
+        try:
+            return query_all(table, order=order)
+        except RuntimeError as e:
+            _failed(name, t0, e)
+            return None
 
-    # 1. Profiles → user_settings.json
-    profiles = query("profiles")
-    if profiles:
+    # 1. Profiles → user_settings.json (+ chat_id → profile map for step 2)
+    t0 = time.monotonic()
+    profiles_by_id = {}
+    profiles_ok = True
+    try:
+        for page in query_pages("profiles", order="chat_id"):
+            for p in page:
+                profiles_by_id[str(p["chat_id"])] = p
+    except RuntimeError as e:
+        _failed("profiles", t0, e)
+        profiles_ok = False
+    if profiles_ok and profiles_by_id:
         out = {}
-        for p in profiles:
-            cid = str(p["chat_id"])
-            qdata = p.get("questionnaire_data")
-            if isinstance(qdata, str):
-                try:
-                    qdata = json.loads(qdata)
-                except Exception:
-                    qdata = {}
+        for cid, p in profiles_by_id.items():
             out[cid] = {
                 "first_name": p.get("first_name", ""),
                 "username": p.get("username", ""),
-                "massage_questionnaire": qdata if isinstance(qdata, dict) else {},
+                "massage_questionnaire": _parse_json_field(p.get("questionnaire_data"), {}),
             }
         settings_path = os.path.join(DATA_DIR, "user_settings.json")
         with open(settings_path, "w", encoding="utf-8") as f:
             json.dump(out, f, ensure_ascii=False, indent=2)
+        from core import settings_store
+        settings_store.reload()
         logger.info(f"Restored {len(out)} profiles → user_settings.json")
+    if profiles_ok:
+        _step("profiles", t0, len(profiles_by_id))
 
-    # 2. Consultations → client_profiles.json
-    cons = query("consultations")
-    if cons:
-        # Group consultations by chat_id
-        grouped = {}
-        for c in cons:
+    # 2. Consultations → client_profiles.json (joined with profiles from step 1)
+    t0 = time.monotonic()
+    grouped = {}
+    n_cons = 0
+    try:
+        if not profiles_ok:
+            raise RuntimeError("profiles incomplete — consultations can't be joined")
+        pages = list(query_pages("consultations", order="id"))
+    except RuntimeError as e:
+        _failed("consultations", t0, e)
+        pages = None
+    for page in pages or []:
+        for c in page:
+            n_cons += 1
             cid = str(c["chat_id"])
-            if cid not in grouped:
-                # Fetch profile data for this user
-                pdata = query("profiles", {"chat_id": f"eq.{c['chat_id']}"})
-                profile_info = pdata[0] if pdata else {}
-                qdata = profile_info.get("questionnaire_data", {})
-                if isinstance(qdata, str):
-                    try:
-                        qdata = json.loads(qdata)
-                    except Exception:
-                        qdata = {}
-                grouped[cid] = {
+            g = grouped.get(cid)
+            if g is None:
+                profile_info = profiles_by_id.get(cid, {})
+                g = grouped[cid] = {
                     "chat_id": c["chat_id"],
                     "first_name": profile_info.get("first_name", ""),
                     "phone": profile_info.get("phone", ""),
@@ -453,9 +844,9 @@ def restore_from_supabase():
                     "last_visit": "",
                     "total_consultations": 0,
                     "consultations": [],
-                    "latest_questionnaire": qdata,
+                    "latest_questionnaire": _parse_json_field(profile_info.get("questionnaire_data"), {}),
                 }
-            grouped[cid]["consultations"].append({
+            g["consultations"].append({
                 "date": c.get("consultation_date", ""),
                 "recommended_technique": c.get("recommended_technique", ""),
                 "music_genre": c.get("music_genre", ""),
@@ -465,6 +856,7 @@ def restore_from_supabase():
                 "video_count": c.get("video_count", 0),
                 "questionnaire_snapshot": c.get("questionnaire_snapshot", {}),
             })
+    if grouped:
         for cid, g in grouped.items():
             g["total_consultations"] = len(g["consultations"])
             dates = [c["date"] for c in g["consultations"] if c["date"]]
@@ -474,10 +866,13 @@ def restore_from_supabase():
         prof_path = os.path.join(DATA_DIR, "client_profiles.json")
         with open(prof_path, "w", encoding="utf-8") as f:
             json.dump(grouped, f, ensure_ascii=False, indent=2)
-        logger.info(f"Restored {len(cons)} consultations → client_profiles.json")
+        logger.info(f"Restored {n_cons} consultations → client_profiles.json")
+    if pages is not None:
+        _step("consultations", t0, n_cons)
 
     # 3. Admin users → admin_ids_extras.json
-    admins = query("admin_users")
+    t0 = time.monotonic()
+    admins = _fetch("admin_users", "admin_users", "chat_id")
     if admins:
         out = {}
         for a in admins:
@@ -489,25 +884,22 @@ def restore_from_supabase():
         with open(admin_path, "w", encoding="utf-8") as f:
             json.dump(out, f, ensure_ascii=False, indent=2)
         logger.info(f"Restored {len(admins)} admin users → admin_ids_extras.json")
+    if admins is not None:
+        _step("admin_users", t0, len(admins))
 
-    # 4. Time slots → time_slots.json
-    slots = query("time_slots")
-    if slots:
-        slots_path = os.path.join(DATA_DIR, "time_slots.json")
-        with open(slots_path, "w", encoding="utf-8") as f:
-            json.dump(slots, f, ensure_ascii=False, indent=2)
-        logger.info(f"Restored {len(slots)} time slots → time_slots.json")
-
-    # 5. Bookings → bookings.json
-    bookings = query("bookings")
+    from core import booking_store
+    # 4. Bookings → local booking store (SQLite)
+    t0 = time.monotonic()
+    bookings = _fetch("bookings", "bookings", "id")
     if bookings:
-        bookings_path = os.path.join(DATA_DIR, "bookings.json")
-        with open(bookings_path, "w", encoding="utf-8") as f:
-            json.dump(bookings, f, ensure_ascii=False, indent=2)
-        logger.info(f"Restored {len(bookings)} bookings → bookings.json")
-
-    # 6. Masseur settings → masseurs.json
-    masseurs = query("masseur_settings")
+        booking_store.replace_bookings(bookings)
+        logger.info(f"Restored {len(bookings)} bookings → {booking_store.DB_PATH}")
+    if bookings is not None:
+        _step("bookings", t0, len(bookings))
+
+    # 5. Masseur settings → masseurs.json
+    t0 = time.monotonic()
+    masseurs = _fetch("masseur_settings", "masseur_settings", "chat_id")
     if masseurs:
         out = {}
         for m in masseurs:
@@ -516,22 +908,45 @@ def restore_from_supabase():
                 "name": m.get("name", ""),
                 "specialties": m.get("specialties", []),
                 "created_at": m.get("created_at", 0),
+                # расписание — для расчёта свободных слотов (core.availability)
+                "working_hours": _parse_json_field(m.get("working_hours"), {}),
+                "break_start": str(m.get("break_start") or "13:00")[:5],
+                "break_end": str(m.get("break_end") or "13:30")[:5],
+                "timezone": m.get("timezone") or "",
             }
         masseurs_path = os.path.join(DATA_DIR, "masseurs.json")
         with open(masseurs_path, "w", encoding="utf-8") as f:
             json.dump(out, f, ensure_ascii=False, indent=2)
         logger.info(f"Restored {len(masseurs)} masseurs → masseurs.json")
+    if masseurs is not None:
+        _step("masseur_settings", t0, len(masseurs))
 
-    # 7. Diary entries → masseur_diary.json (grouped by client_chat_id)
-    diary = query("diary_entries")
-    if diary:
-        grouped = {}
-        for d in diary:
-            cid = str(d.get("client_chat_id", ""))
-            grouped.setdefault(cid, []).append(d)
+    # 6. Diary entries → masseur_diary.json (grouped by client_chat_id)
+    t0 = time.monotonic()
+    grouped = {}
+    n_diary = 0
+    try:
+        pages = list(query_pages("diary_entries", order="id"))
+    except RuntimeError as e:
+        _failed("diary_entries", t0, e)
+        pages = None
+    for page in pages or []:
+        for d in page:
+            n_diary += 1
+            grouped.setdefault(str(d.get("client_chat_id", "")), []).append(d)
+    if grouped:
         diary_path = os.path.join(DATA_DIR, "masseur_diary.json")
         with open(diary_path, "w", encoding="utf-8") as f:
             json.dump(grouped, f, ensure_ascii=False, indent=2)
-        logger.info(f"Restored {len(diary)} diary entries → masseur_diary.json")
-
-    logger.info("Supabase → JSON restore complete")
+        logger.info(f"Restored {n_diary} diary entries → masseur_diary.json")
+    if pages is not None:
+        _step("diary_entries", t0, n_diary)
+
+    report["total_seconds"] = round(time.monotonic() - t_start, 2)
+    _save_report("restore", report)
+    logger.info("Supabase → JSON restore complete in {}s: {}".format(
+        report["total_seconds"],
+        ", ".join(f"{k} {v['rows']} rows/{v['seconds']}s" if "rows" in v else f"{k} FAILED"
+                  for k, v in report.items() if isinstance(v, dict)),
+    ))
+    return report
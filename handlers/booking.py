@@ -1,5 +1,3 @@
-import json
-import os
 import logging
 import html
 from datetime import datetime, date, time as dtime, timedelta
@@ -12,9 +10,9 @@ from aiogram.types import (
     ReplyKeyboardMarkup, KeyboardButton,
 )
 
-import config
+from core import settings_store
 from core.booking_manager import (
-    get_available_masseurs, get_free_slots, create_booking,
+    get_available_masseurs, get_free_slots, reserve_booking,
     confirm_booking, cancel_booking, get_bookings,
 )
 
@@ -39,39 +37,14 @@ SERVICES = [
 
 # ─── State helpers ───
 
-SETTINGS_PATH = os.path.join(config.DATA_DIR, "user_settings.json")
-
-def _load_settings() -> dict:
-    if os.path.exists(SETTINGS_PATH):
-        try:
-            return json.loads(open(SETTINGS_PATH, "r", encoding="utf-8").read())
-        except (json.JSONDecodeError, OSError) as e:
-            logger.warning(f"Failed to load {SETTINGS_PATH}: {e}")
-    return {}
-
-def _save_settings(data: dict):
-    s = json.dumps(data, ensure_ascii=False, indent=2)
-    with open(SETTINGS_PATH, "w", encoding="utf-8") as f:
-        f.write(s)
-
 def _get_state(chat_id: int) -> dict:
-    s = _load_settings()
-    return s.get(str(chat_id), {}).get("booking_state", {})
+    return settings_store.get_user_data(chat_id).get("booking_state", {})
 
 def _set_state(chat_id: int, state: dict):
-    s = _load_settings()
-    key = str(chat_id)
-    if key not in s:
-        s[key] = {}
-    s[key]["booking_state"] = state
-    _save_settings(s)
+    settings_store.set_user_data(chat_id, "booking_state", state)
 
 def _clear_state(chat_id: int):
-    s = _load_settings()
-    key = str(chat_id)
-    if key in s and "booking_state" in s[key]:
-        del s[key]["booking_state"]
-    _save_settings(s)
+    settings_store.pop_user_data(chat_id, "booking_state")
 
 # ─── Helpers ───
 
@@ -184,7 +157,7 @@ async def on_bk_confirm(call: types.CallbackQuery):
     if not st:
         await call.message.edit_text("❌ Сессия истекла. Начните заново: /book")
         return
-    booking = create_booking(
+    reserved = reserve_booking(
         client_chat_id=chat_id,
         masseur_chat_id=st["masseur_chat_id"],
         slot_date=st["slot_date"],
@@ -192,6 +165,7 @@ async def on_bk_confirm(call: types.CallbackQuery):
         duration_min=st.get("duration_min", 60),
         service_name=st.get("service_name", "Классический массаж"),
     )
+    booking = reserved.get("booking")
     if booking:
         await call.message.edit_text(
             f"✅ *Запись создана!*\n\n"
@@ -202,6 +176,8 @@ async def on_bk_confirm(call: types.CallbackQuery):
             f"Массажист получил уведомление.",
             parse_mode="Markdown",
         )
+    elif reserved.get("message"):
+        await call.message.edit_text(f"❌ {reserved['message']}. Начните заново: /book")
     else:
         await call.message.edit_text("❌ Ошибка при создании записи. Попробуйте позже.")
     _clear_state(chat_id)
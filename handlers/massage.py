@@ -6,7 +6,7 @@ from datetime import datetime
 from aiogram import types, Router, F
 from aiogram.filters import Command, BaseFilter
 from aiogram.types import WebAppInfo, InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
-from config import get_base_url, get_vertical_name, GEM_BOT_URL, TEMP_DIR, DATA_DIR
+from config import get_base_url, get_vertical_name, GEM_BOT_URL, TEMP_DIR
 
 from core.agents import (
     MassageConsultationOrchestrator, format_consultation_results,
@@ -14,6 +14,7 @@ from core.agents import (
     get_agent_def, AgentBase,
 )
 import asyncio
+from core import settings_store
 from core.agents.agent_factory import SpecialistFactory, get_specialists, remove_specialist
 from core.questionnaire import MassageQuestionnaire, QUESTIONNAIRE_STEPS, QUESTIONNAIRE_STEPS_OPTIONAL, load_steps
 
@@ -22,17 +23,9 @@ router = Router()
 
 
 class InQuestionnaireFilter(BaseFilter):
-    def __init__(self):
-        import config
-        self.settings_file = os.path.join(config.DATA_DIR, "user_settings.json")
-
     async def __call__(self, message: types.Message) -> bool:
-        if not os.path.exists(self.settings_file):
-            return False
         try:
-            with open(self.settings_file, 'r', encoding='utf-8') as f:
-                settings = json.load(f)
-            chat_settings = settings.get(str(message.chat.id), {})
+            chat_settings = settings_store.conversation_state(message.chat.id)
             step = chat_settings.get("massage_step")
             if step == "create_specialist":
                 return True
@@ -43,25 +36,9 @@ class InQuestionnaireFilter(BaseFilter):
         except Exception:
             return False
 
-SETTINGS_FILE = os.path.join(DATA_DIR, "user_settings.json")
-
-
-def _load_settings():
-    if os.path.exists(SETTINGS_FILE):
-        try:
-            with open(SETTINGS_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception:
-            return {}
-    return {}
-
 
-def _save_settings(settings):
-    try:
-        with open(SETTINGS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(settings, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        logger.error(f"Failed to save settings: {e}")
+def _save_settings(chat_id=None):
+    settings_store.touch(chat_id)
 
 
 def _massage_url() -> str:
@@ -139,10 +116,7 @@ async def on_mc_spnew(callback: types.CallbackQuery):
 async def on_mc_spchat(callback: types.CallbackQuery):
     await callback.answer()
     name = callback.data.replace("mc_spchat_", "")
-    from handlers.messages import user_settings, save_settings as msg_save
-    chat_str = str(callback.message.chat.id)
-    user_settings.setdefault(chat_str, {})["specialist_chat"] = name
-    msg_save(user_settings)
+    settings_store.set_user_data(callback.message.chat.id, "specialist_chat", name)
     await callback.message.edit_text(
         f"💬 Ты общаешься со специалистом *{name}*.\n"
         "Просто напиши ему сообщение.\n\n"
@@ -154,10 +128,8 @@ async def on_mc_spchat(callback: types.CallbackQuery):
 @router.message(Command("exit_specialist"))
 async def on_exit_specialist(message: types.Message):
     chat_id = str(message.chat.id)
-    settings = _load_settings()
-    if chat_id in settings and "specialist_chat" in settings[chat_id]:
-        del settings[chat_id]["specialist_chat"]
-        _save_settings(settings)
+    if "specialist_chat" in settings_store.get_user_data(chat_id):
+        settings_store.pop_user_data(chat_id, "specialist_chat")
         await message.answer("✅ Вышел из диалога со специалистом.")
     else:
         await message.answer("Ты не в диалоге со специалистом.")
@@ -265,17 +237,11 @@ async def on_mc_back(callback: types.CallbackQuery):
 
 # === AI-КОНСУЛЬТАЦИЯ (АНКЕТИРОВАНИЕ) ===
 def _get_user_data(chat_id) -> dict:
-    settings = _load_settings()
-    return settings.get(str(chat_id), {})
+    return settings_store.get_user_data(chat_id)
 
 
 def _set_user_data(chat_id, key, value):
-    settings = _load_settings()
-    chat_str = str(chat_id)
-    if chat_str not in settings:
-        settings[chat_str] = {}
-    settings[chat_str][key] = value
-    _save_settings(settings)
+    settings_store.set_user_data(chat_id, key, value)
 
 
 def _get_questionnaire(chat_id) -> MassageQuestionnaire:
@@ -919,7 +885,7 @@ async def on_mc_analyze(callback: types.CallbackQuery):
     videos = data.get("massage_videos", [])
 
     try:
-        user_mode = user_settings.get(str(chat_id), {}).get('user_mode', 'vertical')
+        user_mode = _get_user_data(chat_id).get('user_mode', 'vertical')
         orchestrator = MassageConsultationOrchestrator(user_mode=user_mode)
         results = await orchestrator.run_consultation(
             questionnaire_text=q.to_text(),
@@ -1133,24 +1099,19 @@ async def on_mc_final_review(callback: types.CallbackQuery):
     specialist_names = _get_user_data(chat_id).get("massage_referral_specialists", [])
 
     # Собираем историю консультаций
-    convs_file = os.path.join(TEMP_DIR, "specialist_convs.json")
     specialist_context = ""
-    if os.path.exists(convs_file):
-        try:
-            with open(convs_file, "r", encoding="utf-8") as f:
-                all_convs = json.load(f)
-            chat_str = str(chat_id)
-            for sp_name in specialist_names:
-                key = f"{chat_str}:{sp_name}"
-                conv = all_convs.get(key, [])
-                if conv:
-                    lines = [f"\n=== Консультация с {sp_name} ==="]
-                    for turn in conv[-10:]:
-                        role = "Клиент" if turn.get("role") == "user" else sp_name
-                        lines.append(f"{role}: {turn.get('content', '')[:300]}")
-                    specialist_context += "\n".join(lines) + "\n"
-        except Exception as e:
-            logger.warning(f"Failed to load specialist convs: {e}")
+    try:
+        from core import conversation_store
+        for sp_name in specialist_names:
+            conv = conversation_store.load_tail(chat_id, sp_name, limit=10)
+            if conv:
+                lines = [f"\n=== Консультация с {sp_name} ==="]
+                for turn in conv:
+                    role = "Клиент" if turn.get("role") == "user" else sp_name
+                    lines.append(f"{role}: {turn.get('content', '')[:300]}")
+                specialist_context += "\n".join(lines) + "\n"
+    except Exception as e:
+        logger.warning(f"Failed to load specialist convs: {e}")
 
     try:
         from core.agents.agent_base import AgentBase
@@ -1208,10 +1169,10 @@ async def _handle_prophet_action(message: types.Message, action: str):
         status_msg = await message.answer("🧘 *Медитирую над твоими словами...*")
         await conduct_ai_ritual(message, message.bot, "🖼 Видение", status_msg)
     elif action == "playlist_wizard":
-        from handlers.messages import user_settings, save_settings
-        user_settings.setdefault(chat_id, {})['playlist_step'] = 'artist'
-        user_settings[chat_id]['playlist_draft'] = {'items': []}
-        save_settings(user_settings)
+        rec = settings_store.edit(chat_id)
+        rec['playlist_step'] = 'artist'
+        rec['playlist_draft'] = {'items': []}
+        _save_settings(chat_id)
         await message.answer(
             "🎵 *Мастер Плейлистов*\n\nНапиши имя артиста или название трека для поиска:",
             parse_mode="Markdown"
@@ -10,8 +10,9 @@ from aiogram import Router, types, Bot, F
 from aiogram.enums import ChatAction
 from aiogram.filters import Command, CommandStart
 from aiogram.types import WebAppInfo, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile
-from core.ai_engine import get_ai_chat, get_client, reset_chat, get_hf_response, transcribe_with_gemini, transcribe_local
+from core.ai_engine import get_ai_chat, get_client, reset_chat, get_hf_response_async, get_text_response_hedged, transcribe_with_gemini, transcribe_local
 from core.tools import web_search, search_media_content, download_audio, AVAILABLE_FUNCTIONS
+from core import settings_store, llm_health
 from core.agents.agent_factory import SpecialistFactory, get_specialists, get_specialist, remove_specialist, DynamicSpecialist
 from config import FALLBACK_MODELS, TEMP_DIR, DATA_DIR, ADMIN_IDS, get_base_url, get_vertical_name, get_system_prompt, get_hf_system_prompt
 from google.genai import types as genai_types
@@ -24,7 +25,6 @@ _quick_replies: dict = {}
 _qr_counter: int = 0
 
 # Путь к файлу настроек
-SETTINGS_FILE = os.path.join(DATA_DIR, "user_settings.json")
 USERNAME_MAP_FILE = os.path.join(DATA_DIR, "username_chat_map.json")
 
 
@@ -45,19 +45,17 @@ def _update_username_map(message: types.Message):
         pass
 
 def load_settings():
-    if os.path.exists(SETTINGS_FILE):
-        try:
-            with open(SETTINGS_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception: return {}
-    return {}
+    return settings_store.records()
 
-def save_settings(settings):
-    try:
-        with open(SETTINGS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(settings, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        logger.error(f"Failed to save settings: {e}")
+def save_settings(chat_id=None):
+    """Пометить настройки чата изменёнными; запись на диск — фоном (core.settings_store).
+
+    Старый вызов save_settings(user_settings) (весь dict) помечает все чаты.
+    Правка записи на месте — через settings_store.edit(chat_id), до изменения.
+    """
+    if isinstance(chat_id, dict):
+        chat_id = None
+    settings_store.touch(chat_id)
 
 # Глобальные состояния
 user_settings = load_settings()
@@ -170,7 +168,7 @@ def get_voice_confirmation_keyboard(chat_id, text):
     
     # Сохраняем текст в user_settings для последующего выполнения
     voice_confirm_key = f"voice_confirm_{chat_id}"
-    user_settings.setdefault(chat_id, {})['pending_voice_text'] = text
+    settings_store.edit(chat_id)['pending_voice_text'] = text
     
     kb = InlineKeyboardMarkup(inline_keyboard=[
         [
@@ -368,13 +366,13 @@ async def cmd_playlist(message: types.Message, bot: Bot):
 
     # Если просто /playlist или /playlist Группа (без числа)
     args = text.split(maxsplit=1)
-    user_settings.setdefault(chat_id, {})
+    settings_store.edit(chat_id)
     
     if len(args) < 2:
         # Инициализируем мастер
         user_settings[chat_id]['playlist_step'] = 'artist'
         user_settings[chat_id]['playlist_draft'] = {'items': []}
-        save_settings(user_settings)
+        save_settings(chat_id)
         await message.answer(
             "🎸 *Мастер Плейлистов* (Шаг 1/3)\n\n"
             "Что добавим в подборку?\n\n"
@@ -390,7 +388,7 @@ async def cmd_playlist(message: types.Message, bot: Bot):
         user_settings[chat_id]['playlist_step'] = 'count'
         user_settings[chat_id]['playlist_draft'] = {'items': []}
         user_settings[chat_id]['pending_artist'] = query
-        save_settings(user_settings)
+        save_settings(chat_id)
         
         kb = InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="5", callback_data="pl_count:5"), 
@@ -594,8 +592,8 @@ async def _create_and_show_specialist(message: types.Message, chat_id: int, role
     lines.append(f"\n💬 Задай ему вопрос прямо сейчас!")
 
     await status.edit_text("\n".join(lines), parse_mode="Markdown")
-    user_settings.setdefault(str(chat_id), {})["specialist_chat"] = specialist.name
-    save_settings(user_settings)
+    settings_store.edit(chat_id)["specialist_chat"] = specialist.name
+    save_settings(chat_id)
 
 
 async def _handle_create_specialist_auto(chat_id: int, role_description: str, message: types.Message):
@@ -613,15 +611,14 @@ async def _handle_create_specialist_auto(chat_id: int, role_description: str, me
         lines.append(f"\n🔧 *Навыки:* {specialist.skills}")
     lines.append(f"\n💬 Задай ему вопрос прямо сейчас или продолжай общение со мной.")
     await message.answer("\n".join(lines), parse_mode="Markdown")
-    user_settings.setdefault(str(chat_id), {})["specialist_chat"] = specialist.name
-    save_settings(user_settings)
+    settings_store.edit(chat_id)["specialist_chat"] = specialist.name
+    save_settings(chat_id)
     return specialist
 
 
 def _is_chatting_with_specialist(chat_id_str: str) -> bool:
-    settings = user_settings.get(chat_id_str, {})
-    val = settings.get("specialist_chat")
-    logger.info(f"_is_chatting_with_specialist: chat={chat_id_str} settings_keys={list(settings.keys())[:5]} specialist_chat={val}")
+    val = settings_store.conversation_state(chat_id_str).get("specialist_chat")
+    logger.info(f"_is_chatting_with_specialist: chat={chat_id_str} specialist_chat={val}")
     return bool(val)
 
 
@@ -634,7 +631,7 @@ async def handle_photo(message: types.Message, bot: Bot):
     file_path = os.path.join(TEMP_DIR, file_name)
 
     await bot.download(photo, destination=file_path)
-    user_settings[chat_id] = {'pending_photo': file_path}
+    settings_store.put_user_data(chat_id, {'pending_photo': file_path})
 
     # Проверяем VIP режим
     is_vip = user_settings.get(chat_id, {}).get('vip_mode', False)
@@ -681,12 +678,12 @@ async def handle_photo(message: types.Message, bot: Bot):
     user_mode = _get_user_mode(chat_id)
     
     # HF FALLBACK: Ритуал интерпретации туманных образов
-    hf_caption = get_hf_response(image_path=file_path, task="vision", user_mode=user_mode)
+    hf_caption = await get_hf_response_async(image_path=file_path, task="vision", user_mode=user_mode)
     if hf_caption:
         # Просим Mistral интерпретировать сухой технический результат от Vision-модели
         vertical = get_vertical_name()
         interpretation_prompt = f"Ты — консультант «{vertical}». Протрактуй это описание: {hf_caption}. Будь краток. В конце предложи следующий шаг."
-        interpretation = get_hf_response(text=interpretation_prompt, task="text", user_mode=user_mode)
+        interpretation = await get_hf_response_async(text=interpretation_prompt, task="text", user_mode=user_mode)
         
         raw_text = interpretation or f"Вижу это: {hf_caption}. Эфир плотен для деталей."
         clean_text, kb = parse_steps_and_create_kb(raw_text, chat_id)
@@ -736,7 +733,7 @@ async def handle_vision_action(message, bot, chat_id, user_text):
         # Безопасная проверка: файл мог быть удален или задача чисто текстовая
         can_do_vision = path and os.path.exists(path)
         user_mode = _get_user_mode(chat_id)
-        hf_res = get_hf_response(text=user_text, image_path=path if can_do_vision else None, task="vision" if can_do_vision else "text", user_mode=user_mode)
+        hf_res = await get_hf_response_async(text=user_text, image_path=path if can_do_vision else None, task="vision" if can_do_vision else "text", user_mode=user_mode)
         if hf_res:
             if status_msg: await status_msg.edit_text("🧿 *Прозрение свершилось через резервный канал:*")
             clean_text, kb = parse_steps_and_create_kb(hf_res, chat_id)
@@ -745,7 +742,7 @@ async def handle_vision_action(message, bot, chat_id, user_text):
 
     if success and path:
         cleanup_file(path)
-        user_settings[chat_id].pop('pending_photo', None)
+        settings_store.edit(chat_id).pop('pending_photo', None)
 
 @router.callback_query(F.data.startswith("vision_task:"))
 async def vision_task_callback(callback: types.CallbackQuery, bot: Bot):
@@ -814,11 +811,11 @@ async def handle_audio(message: types.Message, bot: Bot):
         # Если Gemini не справился, пробуем HF как бэкап
         if not text:
             logger.info("♻️ Gemini Transcription failed, falling back to HF Whisper.")
-            text = get_hf_response(text=None, image_path=transcribe_path, task="audio", user_mode=user_mode)
+            text = await get_hf_response_async(text=None, image_path=transcribe_path, task="audio", user_mode=user_mode, cache="transcription")
             logger.info(f"📥 HF Whisper результат (fallback): {text[:50] if text else 'None'}...")
     else:
         logger.info("🔄 Запуск HF Whisper через Router...")
-        text = get_hf_response(text=None, image_path=transcribe_path, task="audio", user_mode=user_mode)
+        text = await get_hf_response_async(text=None, image_path=transcribe_path, task="audio", user_mode=user_mode, cache="transcription")
         logger.info(f"📥 HF Whisper результат: {text[:50] if text else 'None'}...")
 
     cleanup_file(file_path)
@@ -832,7 +829,7 @@ async def handle_audio(message: types.Message, bot: Bot):
         int_chat_id = message.chat.id
 
         # 1. Массажная консультация
-        massage_step = user_settings.get(chat_id, {}).get("massage_step")
+        massage_step = settings_store.conversation_state(chat_id).get("massage_step")
         if massage_step == "questionnaire":
             await status_msg.delete()
             message.text = text
@@ -842,7 +839,7 @@ async def handle_audio(message: types.Message, bot: Bot):
         elif massage_step == "create_specialist":
             await status_msg.delete()
             _set_user_data(chat_id, "massage_step", None)
-            save_settings(user_settings)
+            save_settings(chat_id)
             message.text = text
             await _create_and_show_specialist(message, int_chat_id, text)
             return
@@ -874,8 +871,8 @@ async def handle_audio(message: types.Message, bot: Bot):
                         await message.answer("❌ Ошибка при общении со специалистом.")
                     return
                 else:
-                    del user_settings[chat_id]["specialist_chat"]
-                    save_settings(user_settings)
+                    del settings_store.edit(chat_id)["specialist_chat"]
+                    save_settings(chat_id)
 
         # 3. Обычный режим — показываем с подтверждением
         await message.answer(
@@ -924,7 +921,7 @@ async def handle_document(message: types.Message, bot: Bot):
 
             if new_lib:
                 # Мержим библиотеку
-                user_settings.setdefault(chat_id, {})
+                settings_store.edit(chat_id)
                 old_lib = user_settings[chat_id].get('library', [])
                 
                 # Дедупликация и подсчет
@@ -952,7 +949,7 @@ async def handle_document(message: types.Message, bot: Bot):
                 elif isinstance(data, dict) and 'engine' in data:
                     user_settings[chat_id]['engine'] = data['engine']
                 
-                save_settings(user_settings)
+                save_settings(chat_id)
                 
                 msg = f"✅ *Импорт завершен!*\n\n"
                 msg += f"📥 Добавлено новых: `{added_count}`\n"
@@ -1049,8 +1046,8 @@ async def handle_text(message: types.Message, bot: Bot):
                     await message.answer("❌ Ошибка при общении со специалистом.")
                     return
             else:
-                del user_settings[chat_id]["specialist_chat"]
-                save_settings(user_settings)
+                del settings_store.edit(chat_id)["specialist_chat"]
+                save_settings(chat_id)
 
     # Проверка на ввод VIP пароля
     if user_settings.get(chat_id, {}).get('waiting_vip_password'):
@@ -1059,8 +1056,8 @@ async def handle_text(message: types.Message, bot: Bot):
         message.text = f"/dizel0110 {text}"
         await admin_cmd(message)
         # Сбрасываем флаг после попытки
-        user_settings.get(chat_id, {}).pop('waiting_vip_password', None)
-        save_settings(user_settings)
+        settings_store.edit(chat_id).pop('waiting_vip_password', None)
+        save_settings(chat_id)
         return
 
     # Кнопка "Выйти из VIP"
@@ -1079,8 +1076,9 @@ async def handle_text(message: types.Message, bot: Bot):
     # Проверка на редактирование голосового сообщения
     if user_settings.get(chat_id, {}).get('pending_voice_edit'):
         # Пользователь ввёл текст для редактирования распознанного голоса
-        user_settings.setdefault(chat_id, {})['pending_voice_text'] = text
-        user_settings[chat_id].pop('pending_voice_edit', None)
+        rec = settings_store.edit(chat_id)
+        rec['pending_voice_text'] = text
+        rec.pop('pending_voice_edit', None)
         
         await message.answer(
             f"✏️ *Текст изменён:* \n\n_{text}_\n\n"
@@ -1126,12 +1124,12 @@ async def handle_text(message: types.Message, bot: Bot):
         await handle_pl_library(types.CallbackQuery(id="0", from_user=message.from_user, chat_instance="0", message=message, data="pl_library"))
         return
 
-    if "🤖 Авто" in text: user_settings.setdefault(chat_id, {})['engine'] = 'auto'
-    elif "💎 Только Gemini" in text: user_settings.setdefault(chat_id, {})['engine'] = 'gemini'
-    elif "🧿 Только Hugging Face" in text: user_settings.setdefault(chat_id, {})['engine'] = 'hf'
+    if "🤖 Авто" in text: settings_store.edit(chat_id)['engine'] = 'auto'
+    elif "💎 Только Gemini" in text: settings_store.edit(chat_id)['engine'] = 'gemini'
+    elif "🧿 Только Hugging Face" in text: settings_store.edit(chat_id)['engine'] = 'hf'
     
     if any(x in text for x in ["🤖 Авто", "💎 Только Gemini", "🧿 Только Hugging Face"]):
-        save_settings(user_settings) # Сохраняем при изменении
+        save_settings(chat_id) # Сохраняем при изменении
         chat_id = str(message.chat.id)
         is_vip = user_settings.get(chat_id, {}).get('vip_mode', False)
         user_mode = user_settings.get(chat_id, {}).get('user_mode', 'vertical')
@@ -1163,13 +1161,14 @@ async def handle_text(message: types.Message, bot: Bot):
         return
 
     if step == 'artist':
+        state = settings_store.edit(chat_id)
         if 'playlist_draft' not in state:
             state['playlist_draft'] = {'items': []}
             
         artist = message.text.strip()
         state['pending_artist'] = artist # Временно храним артиста пока не узнаем количество
         state['playlist_step'] = 'count'
-        save_settings(user_settings)
+        save_settings(chat_id)
         
         # Если есть дефис, вероятно это конкретный трек
         is_specific = " - " in artist
@@ -1194,6 +1193,7 @@ async def handle_text(message: types.Message, bot: Bot):
 
     if step == 'playlist_naming':
         name = message.text.strip()
+        state = settings_store.edit(chat_id)
         draft = state.get('playlist_draft', {})
         items = draft.get('items', [])
         
@@ -1205,7 +1205,7 @@ async def handle_text(message: types.Message, bot: Bot):
         }
         user_settings[chat_id]['library'].append(new_playlist)
         state['playlist_step'] = 'confirm'
-        save_settings(user_settings)
+        save_settings(chat_id)
         await message.answer(f"✅ Плейлист *{name}* сохранен в библиотеку!", parse_mode="Markdown")
         
         # --- ФИНАЛЬНЫЙ ШТРИХ: Отправка файла плейлиста ---
@@ -1244,13 +1244,14 @@ async def handle_text(message: types.Message, bot: Bot):
                 await message.answer("⚠️ Пожалуйста, введите число от 1 до 30:")
                 return
                 
+            state = settings_store.edit(chat_id)
             artist = state.pop('pending_artist', 'Неизвестный')
             state.setdefault('playlist_draft', {}).setdefault('items', []).append({
                 'query': artist,
                 'count': count
             })
             state['playlist_step'] = 'confirm'
-            save_settings(user_settings)
+            save_settings(chat_id)
             
             await show_playlist_confirm(message, chat_id)
             return
@@ -1285,12 +1286,15 @@ async def conduct_ai_ritual(message: types.Message, bot: Bot, input_text: str, s
         else: status_msg = await message.answer("💎 *Подключение к Gemini 3.5 Flash...*")
 
         user_mode = _get_user_mode(chat_id)
-        for model_name in FALLBACK_MODELS:
+        for model_name in llm_health.models("gemini", FALLBACK_MODELS):  # открытые предохранители пропускаем
             try:
                 chat = get_ai_chat(chat_id, model_name, user_mode=user_mode)
                 if not chat: continue
+                if not llm_health.allow(f"gemini:{model_name}"):
+                    continue  # полуоткрытый: пробу уже ведёт другой запрос
 
-                response = chat.send_message(input_text)
+                with llm_health.track(f"gemini:{model_name}"):
+                    response = chat.send_message(input_text)
                 if response.text:
                     clean_text, kb = parse_steps_and_create_kb(response.text, chat_id)
 
@@ -1308,9 +1312,10 @@ async def conduct_ai_ritual(message: types.Message, bot: Bot, input_text: str, s
     if status_msg: await status_msg.edit_text("🧿 *Прямое подключение к каналу Hugging Face...*")
     else: status_msg = await message.answer("🧿 *Прямое подключение к каналу Hugging Face...*")
 
-    hf_res = get_hf_response(text=input_text, task="text", user_mode=user_mode)
+    # LLM_HEDGE_SITES=ritual: если HF задерживается, параллельно спрашиваем Gemini
+    hf_res, provider = await get_text_response_hedged(input_text, user_mode=user_mode)
     if hf_res:
-        logger.info(f"✅ HF Response received for user {chat_id}")
+        logger.info(f"✅ {provider} response received for user {chat_id}")
 
         # Parse and execute tools с chat_id
         # Защита: выполняем MEDIA/PLAYLIST только если пользователь явно просит музыку
@@ -1323,7 +1328,8 @@ async def conduct_ai_ritual(message: types.Message, bot: Bot, input_text: str, s
         else:
             clean_text, tool_result = hf_res, None
 
-        await status_msg.edit_text("✨ *Ответ получен через поток HF:*")
+        await status_msg.edit_text("✨ *Ответ получен через поток HF:*" if provider == "hf"
+                                   else "✨ *Ответ получен через поток Gemini:*")
         await message.answer(f"🧿 {clean_text}")
 
         # Send tool result if any
@@ -1365,8 +1371,8 @@ async def conduct_ai_ritual(message: types.Message, bot: Bot, input_text: str, s
                 buttons = []
                 if tracks:
                     # Сохраняем результаты поиска для пользователя, чтобы кнопки работали по индексу
-                    user_settings.setdefault(chat_id, {})['last_tracks'] = tracks
-                    save_settings(user_settings)
+                    settings_store.edit(chat_id)['last_tracks'] = tracks
+                    save_settings(chat_id)
 
                     buttons_row = []
                     for i, track in enumerate(tracks, 1):
@@ -1418,10 +1424,13 @@ async def conduct_ai_ritual(message: types.Message, bot: Bot, input_text: str, s
         await status_msg.edit_text("🧘 *Медитирую над потоком данных...*")
         
         user_mode = _get_user_mode(chat_id)
-        for model in FALLBACK_MODELS:
+        for model in llm_health.models("gemini", FALLBACK_MODELS):
             try:
                 chat = get_ai_chat(chat_id, model, user_mode=user_mode)
-                response = chat.send_message(message=full_prompt)
+                if not llm_health.allow(f"gemini:{model}"):
+                    continue
+                with llm_health.track(f"gemini:{model}"):
+                    response = chat.send_message(message=full_prompt)
                 clean_text, kb = parse_steps_and_create_kb(response.text, chat_id)
                 await status_msg.edit_text(clean_text)
                 await message.answer("Мои прозрения верны?", reply_markup=kb)
@@ -1436,11 +1445,14 @@ async def conduct_ai_ritual(message: types.Message, bot: Bot, input_text: str, s
 
     gemini_exhausted = False
     user_mode = _get_user_mode(chat_id)
-    for model in FALLBACK_MODELS:
+    for model in llm_health.models("gemini", FALLBACK_MODELS):
         if gemini_exhausted: break
         try:
             chat = get_ai_chat(chat_id, model, user_mode=user_mode)
-            response = chat.send_message(message=input_text)
+            if not llm_health.allow(f"gemini:{model}"):
+                continue
+            with llm_health.track(f"gemini:{model}"):
+                response = chat.send_message(message=input_text)
             
             # --- ЛОГИКА ОБРАБОТКИ ИНСТРУМЕНТОВ ---
             if response.candidates and response.candidates[0].content.parts:
@@ -1492,7 +1504,7 @@ async def conduct_ai_ritual(message: types.Message, bot: Bot, input_text: str, s
     if status_msg: await status_msg.edit_text("🌀 *Эфир Google зашумлен, открываю канал Hugging Face...*")
     
     user_mode = _get_user_mode(chat_id)
-    hf_res = get_hf_response(text=input_text, task="text", user_mode=user_mode)
+    hf_res = await get_hf_response_async(text=input_text, task="text", user_mode=user_mode)
     if hf_res:
         # Парсим и выполняем инструменты
         clean_text, tool_result = parse_and_execute_tools(hf_res)
@@ -1766,25 +1778,25 @@ async def handle_voice_callback(callback: types.CallbackQuery, bot: Bot):
             await conduct_ai_ritual(callback.message, bot, pending_text, None)
 
             # Очищаем сохранённый текст
-            user_settings.get(chat_id, {}).pop('pending_voice_text', None)
+            settings_store.edit(chat_id).pop('pending_voice_text', None)
         else:
             await callback.answer("❌ Текст не найден. Отправьте голосовое ещё раз.")
 
     elif action == "voice_edit":
         await callback.answer("✏️ Введите новый текст:")
         # Сохраняем флаг и ждём следующее сообщение
-        user_settings.setdefault(chat_id, {})['pending_voice_edit'] = True
+        settings_store.edit(chat_id)['pending_voice_edit'] = True
         # Отправляем инструкцию
         await callback.message.answer(
             "✏️ *Введите исправленный текст:*\n\n"
             "_Просто отправьте сообщение с правильным текстом, и я выполню его._"
         )
         # Очищаем сохранённый текст
-        user_settings.get(chat_id, {}).pop('pending_voice_text', None)
+        settings_store.edit(chat_id).pop('pending_voice_text', None)
 
     elif action == "voice_cancel":
         await callback.answer("❌ Отменено")
-        user_settings.get(chat_id, {}).pop('pending_voice_text', None)
+        settings_store.edit(chat_id).pop('pending_voice_text', None)
         await callback.message.delete()
 
 @router.callback_query(F.data.startswith("cancel_dl:"))
@@ -1799,11 +1811,11 @@ async def handle_playlist_wizard_count(callback: types.CallbackQuery, bot: Bot):
     chat_id = str(callback.message.chat.id)
     data = callback.data.split(":")[1]
     
-    state = user_settings.get(chat_id, {})
+    state = settings_store.edit(chat_id)
     
     if data == "custom":
         state['playlist_step'] = 'count_input'
-        save_settings(user_settings)
+        save_settings(chat_id)
         await callback.message.edit_text("⌨️ *Введите желаемое количество треков (от 1 до 30):*", parse_mode="Markdown")
         return
 
@@ -1818,15 +1830,15 @@ async def handle_playlist_wizard_count(callback: types.CallbackQuery, bot: Bot):
         'count': count
     })
     state['playlist_step'] = 'confirm'
-    save_settings(user_settings)
+    save_settings(chat_id)
     
     await show_playlist_confirm(callback, chat_id)
 
 @router.callback_query(F.data == "pl_add_more")
 async def handle_pl_add_more(callback: types.CallbackQuery):
     chat_id = str(callback.message.chat.id)
-    user_settings[chat_id]['playlist_step'] = 'artist'
-    save_settings(user_settings)
+    settings_store.edit(chat_id)['playlist_step'] = 'artist'
+    save_settings(chat_id)
     await callback.message.edit_text(
         "📝 *Добавление элемента:*\n\n"
         "• Введите *Название группы* для подбора хитов.\n"
@@ -1880,12 +1892,13 @@ async def handle_pl_search(callback: types.CallbackQuery, bot: Bot):
         return
 
     # Сохраняем найденное и описание
+    settings_store.edit(chat_id)
     user_settings[chat_id]['found_tracks'] = all_tracks
     user_settings[chat_id]['search_desc'] = "\n\n".join(descriptions)
     
     # Сбрасываем стейт мастера
     user_settings[chat_id].pop('playlist_step', None)
-    save_settings(user_settings)
+    save_settings(chat_id)
     
     await show_selection_menu(callback, chat_id)
 
@@ -1935,24 +1948,24 @@ async def handle_pl_toggle(callback: types.CallbackQuery):
     chat_id = str(callback.message.chat.id)
     idx = int(callback.data.split(":")[1])
     
-    state = user_settings.get(chat_id, {})
+    state = settings_store.edit(chat_id)
     tracks = state.get('found_tracks', [])
     
     if 0 <= idx < len(tracks):
         tracks[idx]['selected'] = not tracks[idx].get('selected', True)
-        save_settings(user_settings)
+        save_settings(chat_id)
         await show_selection_menu(callback, chat_id)
     await callback.answer()
 
 @router.callback_query(F.data == "pl_shuffle")
 async def handle_pl_shuffle(callback: types.CallbackQuery):
     chat_id = str(callback.message.chat.id)
-    state = user_settings.get(chat_id, {})
+    state = settings_store.edit(chat_id)
     tracks = state.get('found_tracks', [])
     
     if tracks:
         random.shuffle(tracks)
-        save_settings(user_settings)
+        save_settings(chat_id)
         await show_selection_menu(callback, chat_id)
     await callback.answer("🔀 Перемешано!")
 
@@ -1960,26 +1973,26 @@ async def handle_pl_shuffle(callback: types.CallbackQuery):
 async def handle_pl_top(callback: types.CallbackQuery):
     chat_id = str(callback.message.chat.id)
     idx = int(callback.data.split(":")[1])
-    state = user_settings.get(chat_id, {})
+    state = settings_store.edit(chat_id)
     tracks = state.get('found_tracks', [])
     
     if 0 < idx < len(tracks):
         # Перемещаем трек в самое начало
         track = tracks.pop(idx)
         tracks.insert(0, track)
-        save_settings(user_settings)
+        save_settings(chat_id)
         await show_selection_menu(callback, chat_id)
     await callback.answer("🔝 Поднято в начало!")
 
 @router.callback_query(F.data == "pl_reverse")
 async def handle_pl_reverse(callback: types.CallbackQuery):
     chat_id = str(callback.message.chat.id)
-    state = user_settings.get(chat_id, {})
+    state = settings_store.edit(chat_id)
     tracks = state.get('found_tracks', [])
     
     if tracks:
         tracks.reverse()
-        save_settings(user_settings)
+        save_settings(chat_id)
         await show_selection_menu(callback, chat_id)
     await callback.answer("🔃 Порядок изменен на обратный!")
 
@@ -1999,8 +2012,8 @@ async def handle_pl_download_selected(callback: types.CallbackQuery, bot: Bot):
     
     from core.tools import send_playlist
     # Очищаем стейт найденного чтобы не висело в памяти
-    user_settings[chat_id].pop('found_tracks', None)
-    save_settings(user_settings)
+    settings_store.edit(chat_id).pop('found_tracks', None)
+    save_settings(chat_id)
     
     await send_playlist(bot, callback.message.chat.id, selected_tracks, status_msg=callback.message, chat_id_str=chat_id)
 
@@ -2037,11 +2050,11 @@ async def show_playlist_confirm(message_or_callback, chat_id):
 @router.callback_query(F.data == "pl_save_tpl")
 async def handle_pl_save_tpl(callback: types.CallbackQuery):
     chat_id = str(callback.message.chat.id)
-    state = user_settings.get(chat_id, {})
+    state = settings_store.edit(chat_id)
     
     # Переводим в состояние ввода имени
     state['playlist_step'] = 'playlist_naming'
-    save_settings(user_settings)
+    save_settings(chat_id)
     
     await callback.message.answer("📝 *Введите название для этого плейлиста:*", parse_mode="Markdown")
     await callback.answer()
@@ -2094,11 +2107,11 @@ async def handle_pl_library(callback: types.CallbackQuery):
 async def handle_pl_delete(callback: types.CallbackQuery):
     chat_id = str(callback.message.chat.id)
     idx = int(callback.data.split(":")[1])
-    lib = user_settings.get(chat_id, {}).get('library', [])
+    lib = settings_store.edit(chat_id).get('library', [])
     
     if 0 <= idx < len(lib):
         removed = lib.pop(idx)
-        save_settings(user_settings)
+        save_settings(chat_id)
         await callback.answer(f"🗑 Удалено: {removed['name']}")
         await handle_pl_library(callback)
     else:
@@ -2141,8 +2154,8 @@ async def handle_pl_launch(callback: types.CallbackQuery, bot: Bot):
     
     if 0 <= idx < len(lib):
         pl = lib[idx]
-        user_settings[chat_id]['playlist_draft'] = {'items': pl['items']}
-        save_settings(user_settings)
+        settings_store.edit(chat_id)['playlist_draft'] = {'items': pl['items']}
+        save_settings(chat_id)
         await handle_pl_search(callback, bot)
     else:
         await callback.answer("Ошибка!")
@@ -2181,11 +2194,11 @@ async def handle_pl_ex_save(callback: types.CallbackQuery):
     
     if 0 <= idx < len(GLOBAL_EXAMPLES):
         ex = GLOBAL_EXAMPLES[idx]
-        user_settings.setdefault(chat_id, {})
+        settings_store.edit(chat_id)
         # Копируем данные примера в черновик
         user_settings[chat_id]['playlist_draft'] = {'items': ex['items']}
         user_settings[chat_id]['playlist_step'] = 'confirm'
-        save_settings(user_settings)
+        save_settings(chat_id)
         
         await callback.answer("📥 Копирую в мастер плейлистов...")
         # Показываем финальный шаг мастера, где уже есть кнопка "Сохранить как шаблон"
@@ -2197,8 +2210,8 @@ async def handle_pl_ex_run(callback: types.CallbackQuery, bot: Bot):
     idx = int(callback.data.split(":")[1])
     if 0 <= idx < len(GLOBAL_EXAMPLES):
         ex = GLOBAL_EXAMPLES[idx]
-        user_settings.setdefault(chat_id, {})['playlist_draft'] = {'items': ex['items']}
-        save_settings(user_settings)
+        settings_store.edit(chat_id)['playlist_draft'] = {'items': ex['items']}
+        save_settings(chat_id)
         await handle_pl_search(callback, bot)
     await callback.answer()
 
@@ -4,13 +4,13 @@ from aiogram.types import WebAppInfo, ReplyKeyboardMarkup, KeyboardButton
 from config import OWNER_USERNAME, VIP_PASSWORD, VIP_RESET_PASSWORD, get_base_url, ADMIN_IDS, DATA_DIR
 import json
 import os
+from core import settings_store
 import time
 import logging
 
 logger = logging.getLogger(__name__)
 router = Router()
 
-SETTINGS_FILE = os.path.join(DATA_DIR, "user_settings.json")
 ADMIN_PENDING_FILE = os.path.join(DATA_DIR, "admin_pending.json")
 VIP_ALLOWED_FILE = os.path.join(DATA_DIR, "vip_allowed.json")
 
@@ -111,21 +111,14 @@ MAX_FAILED_ATTEMPTS = 3  # Максимум неудачных попыток
 LOCKOUT_DURATION = 3600  # Блокировка на 1 час (3600 сек)
 
 def load_settings():
-    if os.path.exists(SETTINGS_FILE):
-        try:
-            with open(SETTINGS_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception:
-            return {}
-    return {}
+    return settings_store.records()
 
-def save_settings(settings):
-    try:
-        with open(SETTINGS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(settings, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        pass
+def save_settings(chat_id=None):
+    if isinstance(chat_id, dict):
+        chat_id = None
+    settings_store.touch(chat_id)
 
+# Общий с handlers.messages словарь (core.settings_store)
 user_settings = load_settings()
 
 def get_vip_menu():
@@ -152,16 +145,16 @@ def check_lockout(chat_id: str) -> tuple[bool, int]:
     
     # Сбрасываем истёкшую блокировку
     if locked_until > 0:
+        user_data = settings_store.edit(chat_id)
         user_data['vip_locked_until'] = 0
         user_data['vip_failed_attempts'] = 0
-        user_settings[chat_id] = user_data
-        save_settings(user_settings)
+        save_settings(chat_id)
     
     return False, 0
 
 def record_failed_attempt(chat_id: str):
     """Запись неудачной попытки"""
-    user_data = user_settings.get(chat_id, {})
+    user_data = settings_store.edit(chat_id)
     attempts = user_data.get('vip_failed_attempts', 0) + 1
     user_data['vip_failed_attempts'] = attempts
     
@@ -169,16 +162,14 @@ def record_failed_attempt(chat_id: str):
         user_data['vip_locked_until'] = int(time.time()) + LOCKOUT_DURATION
         user_data['vip_failed_attempts'] = 0
     
-    user_settings[chat_id] = user_data
-    save_settings(user_settings)
+    save_settings(chat_id)
 
 def reset_failed_attempts(chat_id: str):
     """Сброс попыток после успешного входа"""
-    user_data = user_settings.get(chat_id, {})
+    user_data = settings_store.edit(chat_id)
     user_data['vip_failed_attempts'] = 0
     user_data['vip_locked_until'] = 0
-    user_settings[chat_id] = user_data
-    save_settings(user_settings)
+    save_settings(chat_id)
 
 @router.message(Command("dizel0110"))
 async def admin_cmd(message: types.Message):
@@ -217,8 +208,8 @@ async def admin_cmd(message: types.Message):
             "_Пароль известен только создателю._",
             parse_mode="Markdown"
         )
-        user_settings.setdefault(chat_id, {})['waiting_vip_password'] = True
-        save_settings(user_settings)
+        settings_store.edit(chat_id)['waiting_vip_password'] = True
+        save_settings(chat_id)
         return
 
     password = args[1]
@@ -248,8 +239,8 @@ async def admin_cmd(message: types.Message):
                 parse_mode="Markdown"
             )
         
-        user_settings.get(chat_id, {}).pop('waiting_vip_password', None)
-        save_settings(user_settings)
+        settings_store.edit(chat_id).pop('waiting_vip_password', None)
+        save_settings(chat_id)
         return
 
     reset_failed_attempts(chat_id)
@@ -260,10 +251,11 @@ async def _enter_vip(message: types.Message, chat_id: str, chat_id_int: int):
     """Установить VIP режим + отправить приветствие."""
     vip_web_app_url = f"{get_base_url()}/static/prophet/index.html?admin=true"
     kb = get_vip_menu()
-    user_settings.setdefault(chat_id, {})['vip_mode'] = True
-    user_settings[chat_id]['user_mode'] = 'prophet'
-    user_settings.get(chat_id, {}).pop('waiting_vip_password', None)
-    save_settings(user_settings)
+    rec = settings_store.edit(chat_id)
+    rec['vip_mode'] = True
+    rec['user_mode'] = 'prophet'
+    rec.pop('waiting_vip_password', None)
+    save_settings(chat_id)
     await message.answer(
         "✅ *VIP режим активирован!*\n\n"
         "🌟 *Доступны расширенные функции:*\n"
@@ -376,9 +368,10 @@ async def exit_vip(message: types.Message):
     chat_id = str(message.chat.id)
     
     if user_settings.get(chat_id, {}).get('vip_mode'):
-        user_settings[chat_id]['vip_mode'] = False
-        user_settings[chat_id]['user_mode'] = 'vertical'
-        save_settings(user_settings)
+        rec = settings_store.edit(chat_id)
+        rec['vip_mode'] = False
+        rec['user_mode'] = 'vertical'
+        save_settings(chat_id)
         
         from handlers.messages import get_main_menu
         
@@ -405,8 +398,8 @@ async def toggle_vip_mode(message: types.Message):
     current_mode = user_settings.get(chat_id, {}).get('user_mode', 'vertical')
     new_mode = 'prophet' if current_mode == 'vertical' else 'vertical'
     
-    user_settings[chat_id]['user_mode'] = new_mode
-    save_settings(user_settings)
+    settings_store.edit(chat_id)['user_mode'] = new_mode
+    save_settings(chat_id)
     
     # Сброс AI-сессии при смене режима
     from core.ai_engine import reset_chat
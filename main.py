@@ -15,7 +15,7 @@ import subprocess
 import shutil
 import tempfile
 import uvicorn
-from datetime import datetime
+from datetime import datetime, timedelta
 from pathlib import Path
 from aiogram import Bot, Dispatcher
 from aiogram.types import FSInputFile
@@ -52,6 +52,43 @@ IS_HF_SPACE = os.getenv("SPACE_ID") is not None
 # FastAPI приложение
 app = FastAPI()
 
+
+@app.on_event("shutdown")
+async def _close_supabase_session():
+    from core import supabase_async, llm_gateway
+    await supabase_async.close()
+    await asyncio.to_thread(llm_gateway.close)
+
+
+def _precompute_availability():
+    from config import AVAILABILITY_PRECOMPUTE_DAYS
+    from core import availability
+    from core.booking_manager import get_available_masseurs
+    ids = [int(m["chat_id"]) for m in get_available_masseurs() if m.get("chat_id")]
+    return availability.precompute(ids, AVAILABILITY_PRECOMPUTE_DAYS, availability.PRECOMPUTE_DURATIONS)
+
+
+async def _availability_precompute_loop():
+    """Warm the slot cache at startup, then nightly at AVAILABILITY_PRECOMPUTE_HOUR."""
+    from config import AVAILABILITY_PRECOMPUTE_HOUR
+    from core import availability
+    while True:
+        try:
+            await asyncio.to_thread(_precompute_availability)
+        except Exception as e:
+            logger.warning(f"Availability precompute failed: {e}")
+        # Час — по времени салона, как у расписаний и дайджеста
+        now = datetime.now(availability.salon_tz())
+        nxt = now.replace(hour=AVAILABILITY_PRECOMPUTE_HOUR, minute=0, second=0, microsecond=0)
+        if nxt <= now:
+            nxt += timedelta(days=1)
+        await asyncio.sleep(nxt.timestamp() - time.time())
+
+
+@app.on_event("startup")
+async def _start_availability_precompute():
+    asyncio.create_task(_availability_precompute_loop())
+
 # Раздача статики (Mini App)
 STATIC_DIR = Path(__file__).parent / "static"
 STATIC_DIR.mkdir(exist_ok=True)
@@ -941,8 +978,8 @@ async def api_booking_request(req: dict):
 @app.get("/api/massage/masseurs_available")
 async def api_masseurs_available():
     """List masseurs with availability."""
-    from core.booking_manager import get_available_masseurs
-    masseurs = get_available_masseurs()
+    from core.booking_manager import get_available_masseurs_async
+    masseurs = await get_available_masseurs_async()
     return {"ok": True, "masseurs": masseurs}
 
 
@@ -951,8 +988,23 @@ async def api_slots(masseur_id: int = 0, slot_date: str = "", tz_offset: int = N
     """Get free slots for a masseur on a date (for client booking)."""
     if not masseur_id or not slot_date:
         return {"ok": False, "error": "masseur_id and slot_date required"}
-    from core.booking_manager import get_free_slots
-    slots = get_free_slots(masseur_id, slot_date, tz_offset)
+    from core.booking_manager import get_free_slots_async
+    slots = await get_free_slots_async(masseur_id, slot_date, tz_offset)
+    return {"ok": True, "slots": slots, "count": len(slots)}
+
+
+@app.get("/api/massage/slots/earliest")
+async def api_slots_earliest(duration: int = 60, time_from: str = "", time_to: str = "",
+                             specialty: str = "", days: int = 14, limit: int = 5,
+                             mode: str = "earliest", tz_offset: int = None):
+    """Earliest (or best-fit) free slots across all masseurs, no masseur/date picked yet."""
+    if mode not in ("earliest", "best_fit"):
+        return {"ok": False, "error": "mode must be earliest or best_fit"}
+    specialties = [s for s in specialty.split(",") if s.strip()]
+    from core.booking_manager import find_earliest_slots_async
+    slots = await find_earliest_slots_async(duration, time_from or None, time_to or None, specialties,
+                                            max(1, min(days, 60)), max(1, min(limit, 50)), mode,
+                                            tz_offset=tz_offset)
     return {"ok": True, "slots": slots, "count": len(slots)}
 
 
@@ -961,8 +1013,8 @@ async def api_slots_all(masseur_id: int = 0, slot_date: str = "", tz_offset: int
     """Get ALL slots with status for a masseur on a date (client view with colors)."""
     if not masseur_id or not slot_date:
         return {"ok": False, "error": "masseur_id and slot_date required"}
-    from core.booking_manager import get_all_slots_for_client
-    slots = get_all_slots_for_client(masseur_id, slot_date, tz_offset)
+    from core.booking_manager import get_all_slots_for_client_async
+    slots = await get_all_slots_for_client_async(masseur_id, slot_date, tz_offset)
     return {"ok": True, "slots": slots, "count": len(slots)}
 
 
@@ -971,8 +1023,8 @@ async def api_slots_month(masseur_id: int = 0, year: int = 0, month: int = 0, tz
     """Get slot availability for all days in a month (for calendar coloring)."""
     if not masseur_id or not year or not month:
         return {"ok": False, "error": "masseur_id, year and month required"}
-    from core.booking_manager import get_free_slots, get_booked_slots_for_month
-    total_map = get_booked_slots_for_month(masseur_id, year, month, tz_offset)
+    from core.booking_manager import get_booked_slots_for_month_async
+    total_map = await get_booked_slots_for_month_async(masseur_id, year, month, tz_offset)
     return {"ok": True, "days": total_map}
 
 
@@ -988,25 +1040,24 @@ async def api_masseur_slots(masseur_id: int = 0, slot_date: str = ""):
 
 @app.post("/api/massage/slots/generate")
 async def api_generate_slots(req: dict):
-    """Generate time slots for a masseur."""
+    """Preview a masseur's free slots for N days (slots are computed, nothing is stored)."""
     masseur_id = req.get("masseur_id", 0)
     start_date = req.get("start_date", "")
     days = req.get("days", 7)
     if not masseur_id:
         return {"ok": False, "error": "masseur_id required"}
-    from core.booking_manager import generate_slots, _save_slots
-    slots = generate_slots(masseur_id, start_date, days)
-    _save_slots(slots)
-    return {"ok": True, "count": len(slots), "message": f"Создано {len(slots)} слотов"}
+    from core.booking_manager import generate_slots
+    slots = await asyncio.to_thread(generate_slots, masseur_id, start_date, days)
+    return {"ok": True, "count": len(slots), "message": f"Свободно {len(slots)} слотов"}
 
 
 @app.get("/api/massage/client_status")
 async def api_client_status(chat_id: int = 0):
     """Check if client has a profile/questionnaire/bookings (for первичный приём gate)."""
     from core.client_profiles import get_profile
-    from core.booking_manager import get_bookings
+    from core.booking_manager import get_bookings_async
     profile = get_profile(chat_id)
-    bookings = get_bookings(client_chat_id=chat_id) or []
+    bookings = await get_bookings_async(chat_id) or []
     has_bookings = any(b.get("status") in ("pending", "confirmed") for b in bookings)
     return {
         "ok": True,
@@ -1033,9 +1084,9 @@ async def api_create_booking(req: dict):
     # Questionnaire gate: new clients can only book "Первичный приём"
     import time
     from core.client_profiles import get_profile
-    from core.booking_manager import get_bookings
+    from core.booking_manager import get_bookings_async
     profile = get_profile(client_id)
-    bookings = get_bookings(client_chat_id=client_id) or []
+    bookings = await get_bookings_async(client_id) or []
     has_any_booking = any(b.get("status") in ("pending", "confirmed", "cancelled") for b in bookings)
     is_primary = "первичный" in (service or "").lower()
     if not has_any_booking:
@@ -1050,11 +1101,12 @@ async def api_create_booking(req: dict):
                 return {"ok": False, "error": "Анкета устарела — пройдите чек-ап"}
     # Determine is_first_visit from actual booking history, not frontend
     first_visit = not has_any_booking
-    from core.booking_manager import create_booking
-    booking = create_booking(client_id, masseur_id, slot_date, start_time,
-                             duration, service, note, first_visit, client_username)
-    if not booking:
-        return {"ok": False, "error": "Нельзя создать больше 2 активных записей"}
+    from core.booking_manager import reserve_booking_async
+    reserved = await reserve_booking_async(client_id, masseur_id, slot_date, start_time,
+                                           duration, service, note, first_visit, client_username)
+    if not reserved["ok"]:
+        return {"ok": False, "error": reserved["message"], "reason": reserved["reason"]}
+    booking = reserved["booking"]
     warn = []
     if booking.get("_errors"):
         if "notify" in booking["_errors"]:
@@ -1070,8 +1122,8 @@ async def api_create_booking(req: dict):
 @app.post("/api/massage/book/{booking_id}/confirm")
 async def api_confirm_booking(booking_id: int):
     """Confirm a booking."""
-    from core.booking_manager import confirm_booking
-    result = confirm_booking(booking_id)
+    from core.booking_manager import confirm_booking_async
+    result = await confirm_booking_async(booking_id)
     return {"ok": result, "message": "Запись подтверждена" if result else "Ошибка подтверждения"}
 
 
@@ -1079,8 +1131,8 @@ async def api_confirm_booking(booking_id: int):
 async def api_cancel_booking(booking_id: int, req: dict = None):
     """Cancel a booking (checks deadline)."""
     cancelled_by = (req or {}).get("cancelled_by", "client")
-    from core.booking_manager import cancel_booking
-    result = cancel_booking(booking_id, cancelled_by)
+    from core.booking_manager import cancel_booking_async
+    result = await cancel_booking_async(booking_id, cancelled_by)
     return {"ok": result.get("ok"), "reason": result.get("reason"), "message": result.get("message")}
 
 
@@ -1089,23 +1141,59 @@ async def api_my_bookings(chat_id: int = 0, as_masseur: int = 0, status: str = "
     """Get bookings for a user (client or masseur)."""
     if not chat_id:
         return {"ok": False, "error": "chat_id required"}
-    from core.booking_manager import get_bookings
+    from core.booking_manager import get_bookings_async
     by_masseur = bool(as_masseur)
     lookup_id = masseur_id if by_masseur and masseur_id else chat_id
-    bookings = get_bookings(lookup_id, by_masseur=by_masseur, status=status or None)
+    bookings = await get_bookings_async(lookup_id, by_masseur=by_masseur, status=status or None)
     return {"ok": True, "bookings": bookings, "count": len(bookings)}
 
 
 @app.get("/api/massage/workload")
-async def api_workload(masseur_id: int = 0, week_start: str = ""):
-    """Get workload stats for a masseur."""
+async def api_workload(masseur_id: int = 0, week_start: str = "", weeks: int = 0):
+    """Get workload stats for a masseur (week from week_start, default this Mon–Sun; weeks=N adds a trend)."""
     if not masseur_id:
         return {"ok": False, "error": "masseur_id required"}
-    from core.booking_manager import get_workload
-    wl = get_workload(masseur_id, week_start or None)
+    from core.booking_manager import get_workload_async
+    wl = await get_workload_async(masseur_id, week_start or None, max(0, min(weeks, 52)))
     return {"ok": True, "workload": wl}
 
 
+@app.get("/api/massage/calendar/{role}/{chat_id}.ics")
+async def api_calendar_feed(role: str, chat_id: int, request: Request, token: str = ""):
+    """Subscribable iCalendar feed of a masseur's / client's bookings (ETag + Last-Modified)."""
+    from fastapi import HTTPException
+    from fastapi.responses import Response
+    from core import ics_feed
+    if not ics_feed.check_token(role, chat_id, token):
+        raise HTTPException(403, "Invalid feed token")
+    body, etag, last_modified = await asyncio.to_thread(ics_feed.get_feed, role, chat_id)
+    headers = {"ETag": etag, "Last-Modified": last_modified, "Cache-Control": "private, max-age=300"}
+    if ics_feed.not_modified(etag, last_modified, request.headers.get("if-none-match"),
+                             request.headers.get("if-modified-since")):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="text/calendar; charset=utf-8", headers=headers)
+
+
+@app.get("/api/massage/calendar/link")
+async def api_calendar_link(request: Request, chat_id: int = 0, _init_data: str = ""):
+    """Feed URLs for the calling user (client feed, plus masseur feed for masseurs)."""
+    from core import ics_feed
+    from core.masseur_diary import get_masseur
+    if not chat_id or not _init_data:
+        return {"ok": False, "error": "chat_id and _init_data required"}
+    try:
+        user = verify_init_data(_init_data, TOKEN)
+    except ValueError as e:
+        return {"ok": False, "error": f"Invalid initData: {e}"}
+    if int(user.get("id", 0)) != chat_id:
+        return {"ok": False, "error": "chat_id mismatch"}
+    base = str(request.base_url).rstrip("/")
+    roles = ["client"] + (["masseur"] if get_masseur(chat_id) else [])
+    links = {r: f"{base}/api/massage/calendar/{r}/{chat_id}.ics?token={ics_feed.feed_token(r, chat_id)}"
+             for r in roles}
+    return {"ok": True, "links": links}
+
+
 # ──────────────────── Massage Diary & Roles API ────────────────────
 
 @app.post("/api/massage/diary/{chat_id}")
@@ -1677,18 +1765,13 @@ async def api_education(chat_id: int = 0, role: str = "client", user_mode: str =
     Returns allowed_roles based on actual user permission.
     Renders {{VERTICAL_NAME}} template based on user_mode.
     """
-    import os, json
-    from config import get_vertical_name, TEMP_DIR
+    import os
+    from config import get_vertical_name
     # Detect user_mode from server-side settings if chat_id provided
     _user_mode = user_mode
     if chat_id:
-        _settings_path = os.path.join(TEMP_DIR, "user_settings.json")
-        try:
-            with open(_settings_path, "r", encoding="utf-8") as _f:
-                _all = json.load(_f)
-            _user_mode = _all.get(str(chat_id), {}).get("user_mode", user_mode)
-        except Exception:
-            pass
+        from core import settings_store
+        _user_mode = settings_store.get_user_data(chat_id).get("user_mode", user_mode)
     role_map = {"client": "education_client.md", "masseur": "education_masseur.md", "admin": "education_admin.md"}
     # Determine allowed roles based on user's actual role
     allowed = ["client"]
@@ -2101,13 +2184,12 @@ async def api_admin_clients(chat_id: int = 0, _init_data: str = ""):
     _require_admin_sync(_init_data, chat_id)
     clients = []
     seen = set()
-    settings_path = os.path.join(DATA_DIR, "user_settings.json")
-    if os.path.exists(settings_path):
+    from core import settings_store
+    all_data = settings_store.records()
+    if all_data:
         try:
-            with open(settings_path, "r", encoding="utf-8") as f:
-                all_data = json.load(f)
             from core.client_profiles import get_profile
-            for cid, data in all_data.items():
+            for cid, data in list(all_data.items()):
                 q = data.get("massage_questionnaire")
                 has_q = bool(q)
                 phone = (q.get("phone") if q else "").strip()
@@ -2221,39 +2303,44 @@ _sync_in_progress = False
 
 @app.get("/api/admin/db_status")
 async def api_admin_db_status(chat_id: int = 0, _init_data: str = ""):
-    """Supabase connection status + table row counts."""
+    """Supabase connection status + table row counts (count-only, cached) + local store sizes."""
     _require_admin_sync(_init_data, chat_id)
-    from core.supabase_manager import SUPABASE_ENABLED, check_tables_exist, _sb_req
+    from core.supabase_manager import SUPABASE_ENABLED
+    from core import supabase_async
+    from core.supabase_manager import local_stats
     result = {"ok": True, "supabase_enabled": SUPABASE_ENABLED, "connected": False, "tables": {}, "error": None, "sync_in_progress": _sync_in_progress}
+    result["local"] = await asyncio.to_thread(local_stats)
+    from core import booking_scheduler
+    result["scheduler"] = booking_scheduler.read_stats()  # очередь auto-cancel / напоминаний (процесс бота)
+    from core import availability
+    result["availability"] = availability.cache_stats()  # кэш слотов и ночной прогрев (этот процесс)
+    from core import llm_gateway
+    result["llm"] = llm_gateway.stats()  # пул HF Router / Gemini, кэш, предохранители (этот процесс)
+    from core import llm_health
+    result["llm_bot"] = llm_health.read_stats()  # предохранители процесса бота
     if not SUPABASE_ENABLED:
         result["error"] = "SUPABASE_URL or SUPABASE_SERVICE_KEY missing in env"
         return result
     try:
-        result["connected"] = check_tables_exist()
+        result["connected"] = await supabase_async.check_tables_exist()
     except Exception as e:
         result["error"] = f"check_tables_exist raised: {e}"
         return result
     if result["connected"]:
-        for tbl in ("profiles", "consultations", "diary_entries", "time_slots",
-                     "bookings", "masseur_settings", "admin_users"):
-            try:
-                rows = _sb_req("GET", f"{tbl}?limit=9999")
-                result["tables"][tbl] = len(rows) if isinstance(rows, list) else 0
-            except Exception as e:
-                result["tables"][tbl] = f"err: {e}"
+        from core.supabase_manager import table_stats
+        result["tables"] = await asyncio.to_thread(table_stats)  # HEAD + count, кэш на несколько секунд
     else:
         # Diagnostic: try a raw request and capture the error
         try:
-            import requests as _r
-            from config import SUPABASE_URL, SUPABASE_SERVICE_KEY
-            _url = f"{SUPABASE_URL.rstrip('/')}/rest/v1/profiles?limit=1"
-            _resp = _r.get(_url, headers={
-                "apikey": SUPABASE_SERVICE_KEY,
-                "Authorization": f"Bearer {SUPABASE_SERVICE_KEY}",
-            }, timeout=15)
-            result["error"] = f"REST API returned {_resp.status_code}: {_resp.text[:200]}"
+            _status, _body = await supabase_async._sb_http("GET", "profiles?limit=1")
+            result["error"] = f"REST API returned {_status}: {_body[:200].decode('utf-8', 'replace')}"
         except Exception as e:
             result["error"] = f"REST API request failed: {e}"
+    from core.supabase_manager import http_stats, get_reports
+    result["http"] = http_stats()
+    result.update(get_reports())  # "migration" / "restore": последние прогоны
+    from core import sb_outbox
+    result["outbox"] = await asyncio.to_thread(sb_outbox.stats)  # backlog / lag write-behind
     return result
 
 
@@ -2306,9 +2393,9 @@ async def api_admin_db_data(table: str, chat_id: int = 0, _init_data: str = ""):
                       "bookings", "masseur_settings", "admin_users")
     if table not in allowed_tables:
         return {"ok": False, "error": "Table not allowed"}
-    from core.supabase_manager import query
+    from core import supabase_async
     try:
-        rows = query(table)
+        rows = await supabase_async.query(table, {"limit": 50})
         if not rows:
             return {"ok": True, "rows": [], "count": 0}
         # Fix double-encoded JSONB strings and truncate long text
@@ -2334,8 +2421,8 @@ async def api_admin_db_data(table: str, chat_id: int = 0, _init_data: str = ""):
 async def api_admin_fix_first_visit(req: dict):
     """Fix is_first_visit flag for all bookings based on actual booking history."""
     _require_admin_sync(req.get("_init_data", ""), int(req.get("chat_id", 0)))
-    from core.booking_manager import get_bookings, _save_json, BOOKINGS_PATH
-    bookings = get_bookings()
+    from core import booking_store
+    bookings = booking_store.get_bookings()
     if not bookings:
         return {"ok": True, "message": "Нет записей для исправления", "fixed": 0}
     from collections import Counter
@@ -2349,9 +2436,8 @@ async def api_admin_fix_first_visit(req: dict):
         cid = b.get("client_chat_id")
         should_be_first = client_counts.get(cid, 0) <= 1
         if b.get("is_first_visit") != should_be_first:
-            b["is_first_visit"] = should_be_first
+            booking_store.update_booking(b["id"], {"is_first_visit": should_be_first})
             fixed += 1
-    _save_json(BOOKINGS_PATH, bookings)
     return {"ok": True, "message": f"Исправлено {fixed} записей", "fixed": fixed}
 
 
@@ -2359,9 +2445,9 @@ async def api_admin_fix_first_visit(req: dict):
 async def api_admin_masseur_clients(masseur_id: int, chat_id: int = 0, _init_data: str = ""):
     """Get unique clients of a masseur (admin only)."""
     _require_admin_sync(_init_data, chat_id)
-    from core.booking_manager import get_bookings
+    from core.booking_manager import get_bookings_async
     from core.client_profiles import get_profile
-    bookings = get_bookings()
+    bookings = await get_bookings_async()
     seen = set()
     clients = []
     for b in sorted(bookings, key=lambda x: x.get("slot_date", "") + "|" + x.get("start_time", ""), reverse=True):
@@ -2428,6 +2514,8 @@ async def start_bot_polling():
         if init_schema():
             migrate_from_json()
             restore_from_supabase()
+            from core import sb_outbox
+            sb_outbox.start()
     except Exception as e:
         logger.warning(f"Supabase init skipped: {e}")
 
@@ -2465,59 +2553,23 @@ async def start_bot_polling():
         await bot.delete_webhook(drop_pending_updates=True)
 
     # ─── Booking background task: auto-cancel, reminders, morning digest ───
-    _cleanup_counter = 0
+    # Sleeps until the next due job (core.booking_scheduler), at most 30 s.
     async def booking_housekeeping():
-        nonlocal _cleanup_counter
+        from core import booking_scheduler, llm_health
+        last_cleanup = time.monotonic()
         while True:
             try:
-                from core.booking_manager import (
-                    auto_cancel_expired_pending,
-                    get_pending_reminder_candidates,
-                    should_send_morning_digest,
-                    get_pending_bookings_grouped_by_masseur,
-                )
-                from core.notifier import (
-                    notify_pending_reminder,
-                    notify_morning_digest,
-                )
-                # 1. Auto-cancel expired pending bookings (<=60 min to session)
-                cancelled = auto_cancel_expired_pending()
-                if cancelled:
-                    logger.info(f"🧹 Auto-cancelled {len(cancelled)} bookings")
-
-                # 2. Remind masseurs about pending bookings ~3h before
-                upcoming = get_pending_reminder_candidates()
-                if upcoming:
-                    by_masseur = {}
-                    for b in upcoming:
-                        mid = b.get("masseur_chat_id")
-                        if mid not in by_masseur:
-                            by_masseur[mid] = 0
-                        by_masseur[mid] += 1
-                    for mid, cnt in by_masseur.items():
-                        try:
-                            notify_pending_reminder(mid, cnt)
-                            logger.info(f"⏰ Reminded masseur {mid} about {cnt} pending bookings")
-                        except Exception as e:
-                            logger.warning(f"Reminder notify to {mid} failed: {e}")
-
-                # 3. Morning digest at 09:00
-                if should_send_morning_digest():
-                    grouped = get_pending_bookings_grouped_by_masseur()
-                    for mid, blist in grouped.items():
-                        try:
-                            notify_morning_digest(mid, len(blist))
-                            logger.info(f"🌅 Morning digest to masseur {mid}: {len(blist)} pending")
-                        except Exception as e:
-                            logger.warning(f"Morning digest to {mid} failed: {e}")
-
-                # 4. Temp cleanup every 30 min (remove files > 24h)
-                _cleanup_counter += 1
-                if _cleanup_counter % 30 == 0:
+                await asyncio.to_thread(booking_scheduler.run_due)
+                booking_scheduler.publish_stats()
+                llm_health.publish_stats()  # предохранители LLM процесса бота → /api/admin/db_status
+
+                # Temp cleanup every 30 min (remove files > 24h)
+                if time.monotonic() - last_cleanup >= 1800:
+                    last_cleanup = time.monotonic()
                     _cleanup_temp_dir()
             except Exception as e:
                 logger.warning(f"Booking housekeeping error: {e}")
-            await asyncio.sleep(60)
+            await asyncio.sleep(max(1.0, booking_scheduler.seconds_until_next()))
 
     asyncio.create_task(booking_housekeeping())
 
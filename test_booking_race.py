@@ -0,0 +1,98 @@
+"""Stress test: many clients grab the same slot at once — exactly one must win.
+
+Workers are separate processes (like the bot and the web server) with
+several threads each, all calling booking_manager.reserve_booking() for the
+same masseur/date/time against one fresh SQLite store in a temp directory.
+
+    python test_booking_race.py [processes] [threads]
+"""
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import multiprocessing
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+MASSEUR, SLOT_DATE, START = 9001, "2030-01-15", "11:00"
+
+
+def _enter(workdir: str):
+    """Spawned process only: run against the temp store, without Supabase."""
+    os.chdir(workdir)  # booking store lives in ./data
+    sys.path.insert(0, ROOT)
+    os.environ["SUPABASE_URL"] = ""  # config читается при импорте → только локальное хранилище
+
+
+def _worker(workdir: str, worker_id: int, threads: int, ready, results):
+    _enter(workdir)
+    from core import booking_manager, booking_store
+    booking_store.get_bookings(masseur_chat_id=MASSEUR)  # соединение открыто до старта
+
+    out = []
+    go = threading.Event()
+
+    def grab(n):
+        client = 100000 + worker_id * 1000 + n
+        # Половина берёт 60 мин с 11:00, половина — 30 мин с 11:30: пересекаются
+        start, duration = (START, 60) if n % 2 == 0 else ("11:30", 30)
+        go.wait()
+        r = booking_manager.reserve_booking(client, MASSEUR, SLOT_DATE, start, duration, "Стресс-тест")
+        out.append((r["reason"], r.get("booking", {}).get("id")))
+
+    ts = [threading.Thread(target=grab, args=(n,)) for n in range(threads)]
+    for t in ts:
+        t.start()
+    ready.wait()  # все процессы готовы — стартуем разом
+    go.set()
+    for t in ts:
+        t.join()
+    results.extend(out)
+
+
+def _read_active(workdir: str, out):
+    _enter(workdir)
+    from core import booking_store
+    out.extend([b for b in booking_store.get_bookings(masseur_chat_id=MASSEUR, slot_date=SLOT_DATE)
+                if b.get("status") in booking_store.ACTIVE_STATUSES])
+
+
+def test_one_winner(processes: int = 8, threads: int = 8):
+    workdir = tempfile.mkdtemp(prefix="booking_race_")
+    ctx = multiprocessing.get_context("spawn")
+    try:
+        with ctx.Manager() as mgr:
+            results = mgr.list()
+            ready = mgr.Barrier(processes + 1)
+            procs = [ctx.Process(target=_worker, args=(workdir, i, threads, ready, results))
+                     for i in range(processes)]
+            for p in procs:
+                p.start()
+            ready.wait(timeout=120)
+            for p in procs:
+                p.join(timeout=120)
+            results = list(results)
+            # Проверка хранилища — тоже в отдельном процессе: cwd и sys.path вызывающего не трогаем
+            active = mgr.list()
+            reader = ctx.Process(target=_read_active, args=(workdir, active))
+            reader.start()
+            reader.join(timeout=60)
+            active = list(active)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    winners = [r for r in results if r[0] == "created"]
+    taken = [r for r in results if r[0] == "slot_taken"]
+    print(f"🏁 {len(results)} attempts: {len(winners)} created, {len(taken)} slot_taken, "
+          f"{len(results) - len(winners) - len(taken)} other")
+
+    assert len(results) == processes * threads, "some workers did not finish"
+    assert len(winners) == 1, f"expected exactly one winner, got {len(winners)}"
+    assert len(taken) == len(results) - 1
+    assert len(active) == 1 and active[0]["id"] == winners[0][1]
+    print("✅ Exactly one booking stored for the slot")
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    test_one_winner(*args)